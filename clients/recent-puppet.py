@@ -7,16 +7,16 @@ import json
 import os
 from pprint import pprint
 
-url = '%s/api/v1/deploy' % os.environ['HISTORY_SERVER_URL']
-encoded_args = urllib.urlencode({'environment' : 'production'})
+url = '%s/api/v1/deploy/search' % os.environ['HISTORY_SERVER_URL']
+# only puppet config deploys that recorded a sync timestamp
+encoded_args = urllib.urlencode({'environment': 'production',
+                                 'thing_name': 'puppet',
+                                 'thing_type': 'config',
+                                 'misc.timestamp': '>='})
 response = urllib2.urlopen(url + "?" + encoded_args).read()
 
 
-entries  = json.loads(response)
-puppets = []
-for e in entries:
-    if e['thing_name'] == 'puppet' and e['type_of_thing'] == 'config':
-        puppets.append(e)
+puppets = json.loads(response).get('deploys', [])
 
 sorted_puppets = sorted(puppets,
                         key=lambda v: v['misc']['timestamp'],
@@ -0,0 +1,9 @@
+----------------------------------------------------------------------
+--- 001-keyset-indexes-down.sql
+
+DROP INDEX IF EXISTS build_insertion_time_id_idx;
+DROP INDEX IF EXISTS artifact_insertion_time_id_idx;
+DROP INDEX IF EXISTS promote_insertion_time_id_idx;
+DROP INDEX IF EXISTS deploy_insertion_time_id_idx;
+
+DELETE FROM schema_migrations WHERE migration_key = 1;
@@ -0,0 +1,11 @@
+----------------------------------------------------------------------
+--- 001-keyset-indexes-up.sql
+--- composite indexes backing newest-first keyset pagination
+--- (ORDER BY insertion_time DESC, id DESC) on the fact tables.
+
+INSERT INTO schema_migrations (migration_key) VALUES (1);
+
+CREATE INDEX build_insertion_time_id_idx ON build (insertion_time, id);
+CREATE INDEX artifact_insertion_time_id_idx ON artifact (insertion_time, id);
+CREATE INDEX promote_insertion_time_id_idx ON promote (insertion_time, id);
+CREATE INDEX deploy_insertion_time_id_idx ON deploy (insertion_time, id);
@@ -0,0 +1,98 @@
+----------------------------------------------------------------------
+--- 002-unordered-views-up.sql
+--- the views no longer sort; queries order what they return (see
+--- PgServer._paginate). deploys_view reaches servername through a
+--- LEFT JOIN instead of a UNION over the nullable FK, so a deploy
+--- without a server has a NULL servername rather than 'null'.
+
+INSERT INTO schema_migrations (migration_key) VALUES (2);
+
+DROP VIEW deploys_view;
+DROP VIEW artifacts_view;
+DROP VIEW versioned_things_view;
+DROP VIEW builds_view;
+DROP VIEW promotes_view;
+
+CREATE VIEW versioned_things_view AS
+SELECT
+    versioned_thing.id  AS versioned_id,
+    versioned_thing.insertion_time as insertion_time,
+    version.id AS version_id,
+    version.version_type AS version_type,
+    version.version AS version,
+    thing.id AS thing_id,
+    thing.thing_type AS thing_type,
+    thing.unique_thing_name AS unique_thing_name
+FROM versioned_thing
+INNER JOIN version ON version.id = versioned_thing.version_id
+INNER JOIN thing ON thing.id = versioned_thing.thing_id;
+
+CREATE VIEW deploys_view AS
+SELECT
+    deploy.id AS deploy_id,
+    deploy.insertion_time AS insertion_time,
+    versioned_things_view.thing_id AS thing_id,
+    versioned_things_view.thing_type AS thing_type,
+    versioned_things_view.unique_thing_name AS thing_name,
+    versioned_things_view.version_id AS version_id,
+    versioned_things_view.version_type AS version_type,
+    versioned_things_view.version AS version,
+    deploy.environment AS environment,
+    servername.servername AS servername,
+    deploy.misc AS misc
+FROM deploy
+INNER JOIN versioned_things_view
+      ON versioned_things_view.versioned_id = deploy.versioned_thing_id
+LEFT JOIN servername
+      ON servername.id = deploy.servername_id;
+
+CREATE VIEW artifacts_view AS
+SELECT
+            artifact.id AS artifact_id,
+            artifact.insertion_time AS insertion_time,
+            versioned_things_view.thing_id AS thing_id,
+            versioned_things_view.thing_type AS thing_type,
+            versioned_things_view.unique_thing_name AS unique_thing_name,
+            versioned_things_view.version_id AS version_id,
+            versioned_things_view.version_type AS version_type,
+            versioned_things_view.version AS version,
+            artifact.build_id AS build_id,
+            build.job_url AS job_url,
+            build.job_description AS job_description,
+            build.duration AS duration,
+            build.result AS result,
+            artifact.misc AS misc
+FROM artifact
+INNER JOIN build
+      ON build.id = artifact.build_id
+INNER JOIN versioned_things_view
+      ON versioned_things_view.versioned_id = artifact.versioned_thing_id;
+
+CREATE VIEW builds_view AS
+SELECT
+        build.id AS build_id,
+        build.insertion_time AS insertion_time,
+        version.id as version_id,
+        version.version_type as version_type,
+        version.version as version,
+        build.job_url as job_url,
+        build.job_description as job_description,
+        build.duration as duration,
+        build.result as result,
+        build.misc as misc
+FROM build
+INNER JOIN version
+      ON version.id = build.version_id;
+
+CREATE VIEW promotes_view AS
+SELECT
+            promote.id as promote_id,
+            promote.insertion_time as insertion_time,
+            thing.thing_type as thing_type,
+            thing.unique_thing_name as thing_name,
+            thing.insertion_time as thing_time,
+            promote.environment as environment,
+            promote.misc as misc
+FROM promote
+INNER JOIN thing
+      ON thing.id = promote.thing_id;
@@ -0,0 +1,11 @@
+----------------------------------------------------------------------
+--- 003-trigram-indexes-down.sql
+--- pg_trgm itself is left installed; other databases may use it.
+
+DROP INDEX IF EXISTS build_job_url_trgm_idx;
+DROP INDEX IF EXISTS build_job_description_trgm_idx;
+DROP INDEX IF EXISTS thing_unique_thing_name_trgm_idx;
+DROP INDEX IF EXISTS version_version_trgm_idx;
+DROP INDEX IF EXISTS servername_servername_trgm_idx;
+
+DELETE FROM schema_migrations WHERE migration_key = 3;
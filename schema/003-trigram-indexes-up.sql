@@ -0,0 +1,20 @@
+----------------------------------------------------------------------
+--- 003-trigram-indexes-up.sql
+--- trigram indexes so that glob searches (LIKE '%foo%', 'foo%') on the
+--- searchable text columns are index scans. Creating the extension
+--- needs a superuser; see docs/HACKING.md.
+
+INSERT INTO schema_migrations (migration_key) VALUES (3);
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE INDEX build_job_url_trgm_idx
+    ON build USING gin (job_url gin_trgm_ops);
+CREATE INDEX build_job_description_trgm_idx
+    ON build USING gin (job_description gin_trgm_ops);
+CREATE INDEX thing_unique_thing_name_trgm_idx
+    ON thing USING gin (unique_thing_name gin_trgm_ops);
+CREATE INDEX version_version_trgm_idx
+    ON version USING gin (version gin_trgm_ops);
+CREATE INDEX servername_servername_trgm_idx
+    ON servername USING gin (servername gin_trgm_ops);
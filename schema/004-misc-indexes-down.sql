@@ -0,0 +1,10 @@
+----------------------------------------------------------------------
+--- 004-misc-indexes-down.sql
+
+DROP INDEX IF EXISTS build_misc_idx;
+DROP INDEX IF EXISTS artifact_misc_idx;
+DROP INDEX IF EXISTS promote_misc_idx;
+DROP INDEX IF EXISTS deploy_misc_idx;
+DROP INDEX IF EXISTS deploy_misc_timestamp_idx;
+
+DELETE FROM schema_migrations WHERE migration_key = 4;
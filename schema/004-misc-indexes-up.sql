@@ -0,0 +1,15 @@
+----------------------------------------------------------------------
+--- 004-misc-indexes-up.sql
+--- indexes for searching inside misc. misc.<key>==value and misc@>{...}
+--- searches become `misc @> ...`, answered by the jsonb_path_ops
+--- indexes. Comparisons on deploy timestamps (misc.timestamp>=...)
+--- use the same ->> expression as the btree index below.
+
+INSERT INTO schema_migrations (migration_key) VALUES (4);
+
+CREATE INDEX build_misc_idx ON build USING gin (misc jsonb_path_ops);
+CREATE INDEX artifact_misc_idx ON artifact USING gin (misc jsonb_path_ops);
+CREATE INDEX promote_misc_idx ON promote USING gin (misc jsonb_path_ops);
+CREATE INDEX deploy_misc_idx ON deploy USING gin (misc jsonb_path_ops);
+
+CREATE INDEX deploy_misc_timestamp_idx ON deploy ((misc ->> 'timestamp'));
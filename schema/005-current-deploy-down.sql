@@ -0,0 +1,8 @@
+----------------------------------------------------------------------
+--- 005-current-deploy-down.sql
+
+DROP TRIGGER IF EXISTS deploy_current_deploy ON deploy;
+DROP FUNCTION IF EXISTS current_deploy_upsert();
+DROP TABLE IF EXISTS current_deploy;
+
+DELETE FROM schema_migrations WHERE migration_key = 5;
@@ -0,0 +1,76 @@
+----------------------------------------------------------------------
+--- 005-current-deploy-up.sql
+--- current_deploy holds the latest deploy of each thing to each
+--- (environment, server), so "what is deployed where" is a lookup
+--- instead of a scan of every deploy ever made. A trigger on deploy
+--- keeps it current in the inserting transaction, whichever code path
+--- inserted the deploy.
+
+INSERT INTO schema_migrations (migration_key) VALUES (5);
+
+CREATE TABLE current_deploy(
+    environment environment_enum NOT NULL,
+    thing_id INTEGER NOT NULL REFERENCES thing(id),
+    -- nullable, like deploy.servername_id.
+    servername_id INTEGER,
+    versioned_thing_id INTEGER NOT NULL REFERENCES versioned_thing(id),
+    deploy_id INTEGER NOT NULL,
+    insertion_time TIMESTAMP WITH TIME ZONE);
+
+-- NULL servernames are one key, not distinct ones.
+CREATE UNIQUE INDEX current_deploy_key_idx
+    ON current_deploy (environment, thing_id, COALESCE(servername_id, 0));
+
+CREATE FUNCTION current_deploy_upsert() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO current_deploy (environment,
+                                thing_id,
+                                servername_id,
+                                versioned_thing_id,
+                                deploy_id,
+                                insertion_time)
+    SELECT NEW.environment,
+           versioned_thing.thing_id,
+           NEW.servername_id,
+           NEW.versioned_thing_id,
+           NEW.id,
+           NEW.insertion_time
+    FROM versioned_thing
+    WHERE versioned_thing.id = NEW.versioned_thing_id
+    ON CONFLICT (environment, thing_id, COALESCE(servername_id, 0))
+    DO UPDATE SET versioned_thing_id = EXCLUDED.versioned_thing_id,
+                  deploy_id = EXCLUDED.deploy_id,
+                  insertion_time = EXCLUDED.insertion_time
+    -- ids come from a sequence: a transaction that commits late must
+    -- not roll the current deploy back.
+    WHERE current_deploy.deploy_id < EXCLUDED.deploy_id;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER deploy_current_deploy
+    AFTER INSERT ON deploy
+    FOR EACH ROW EXECUTE PROCEDURE current_deploy_upsert();
+
+-- what is already deployed.
+INSERT INTO current_deploy (environment,
+                            thing_id,
+                            servername_id,
+                            versioned_thing_id,
+                            deploy_id,
+                            insertion_time)
+SELECT DISTINCT ON (deploy.environment,
+                    versioned_thing.thing_id,
+                    COALESCE(deploy.servername_id, 0))
+       deploy.environment,
+       versioned_thing.thing_id,
+       deploy.servername_id,
+       deploy.versioned_thing_id,
+       deploy.id,
+       deploy.insertion_time
+FROM deploy
+INNER JOIN versioned_thing ON versioned_thing.id = deploy.versioned_thing_id
+ORDER BY deploy.environment,
+         versioned_thing.thing_id,
+         COALESCE(deploy.servername_id, 0),
+         deploy.id DESC;
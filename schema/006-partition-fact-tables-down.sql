@@ -0,0 +1,189 @@
+----------------------------------------------------------------------
+--- 006-partition-fact-tables-down.sql
+--- back to plain fact tables, as of migration 005.
+
+DROP VIEW deploys_view;
+DROP VIEW artifacts_view;
+DROP VIEW builds_view;
+DROP VIEW promotes_view;
+
+ALTER SEQUENCE build_id_seq OWNED BY NONE;
+ALTER SEQUENCE artifact_id_seq OWNED BY NONE;
+ALTER SEQUENCE promote_id_seq OWNED BY NONE;
+ALTER SEQUENCE deploy_id_seq OWNED BY NONE;
+
+ALTER TABLE build RENAME TO build_partitioned;
+ALTER TABLE artifact RENAME TO artifact_partitioned;
+ALTER TABLE promote RENAME TO promote_partitioned;
+ALTER TABLE deploy RENAME TO deploy_partitioned;
+
+CREATE TABLE build(
+    id INTEGER NOT NULL DEFAULT nextval('build_id_seq'),
+    insertion_time TIMESTAMP WITH TIME ZONE,
+    version_id INTEGER NOT NULL REFERENCES version(id),
+    job_url TEXT NOT NULL,
+    job_description TEXT NOT NULL,
+    duration INTEGER NOT NULL,
+    result VARCHAR(16) NOT NULL,
+    misc jsonb NOT NULL);
+
+CREATE TABLE promote(
+    id INTEGER NOT NULL DEFAULT nextval('promote_id_seq'),
+    insertion_time TIMESTAMP WITH TIME ZONE,
+    thing_id INTEGER NOT NULL REFERENCES thing(id),
+    environment environment_enum NOT NULL,
+    misc jsonb NOT NULL);
+
+CREATE TABLE deploy(
+    id INTEGER NOT NULL DEFAULT nextval('deploy_id_seq'),
+    insertion_time TIMESTAMP WITH TIME ZONE,
+    versioned_thing_id INTEGER NOT NULL REFERENCES versioned_thing(id),
+    servername_id INTEGER,
+    environment environment_enum NOT NULL,
+    misc jsonb NOT NULL);
+
+CREATE TABLE artifact(
+    id INTEGER NOT NULL DEFAULT nextval('artifact_id_seq'),
+    insertion_time TIMESTAMP WITH TIME ZONE,
+    versioned_thing_id INTEGER NOT NULL REFERENCES versioned_thing(id),
+    build_id INTEGER NOT NULL,
+    misc jsonb NOT NULL);
+
+ALTER SEQUENCE build_id_seq OWNED BY build.id;
+ALTER SEQUENCE artifact_id_seq OWNED BY artifact.id;
+ALTER SEQUENCE promote_id_seq OWNED BY promote.id;
+ALTER SEQUENCE deploy_id_seq OWNED BY deploy.id;
+
+INSERT INTO build SELECT id, insertion_time, version_id, job_url,
+    job_description, duration, result, misc FROM build_partitioned;
+INSERT INTO artifact SELECT id, insertion_time, versioned_thing_id,
+    build_id, misc FROM artifact_partitioned;
+INSERT INTO promote SELECT id, insertion_time, thing_id, environment,
+    misc FROM promote_partitioned;
+INSERT INTO deploy SELECT id, insertion_time, versioned_thing_id,
+    servername_id, environment, misc FROM deploy_partitioned;
+
+DROP TABLE artifact_partitioned;
+DROP TABLE deploy_partitioned;
+DROP TABLE promote_partitioned;
+DROP TABLE build_partitioned;
+
+DROP FUNCTION ensure_fact_partitions(integer);
+DROP FUNCTION ensure_monthly_partition(text, date);
+DROP FUNCTION artifact_build_exists();
+
+ALTER TABLE build ADD PRIMARY KEY (id);
+ALTER TABLE artifact ADD PRIMARY KEY (id);
+ALTER TABLE promote ADD PRIMARY KEY (id);
+ALTER TABLE deploy ADD PRIMARY KEY (id);
+ALTER TABLE artifact ADD FOREIGN KEY (build_id) REFERENCES build(id);
+
+-- history.sql
+CREATE INDEX ON build (id);
+CREATE INDEX ON build(version_id);
+CREATE INDEX ON build (insertion_time);
+CREATE INDEX ON promote (id);
+CREATE INDEX ON promote(thing_id);
+CREATE INDEX ON promote (insertion_time);
+CREATE INDEX ON deploy (id);
+CREATE INDEX ON deploy(versioned_thing_id);
+CREATE INDEX ON deploy (insertion_time);
+CREATE INDEX ON artifact (id);
+CREATE INDEX ON artifact(versioned_thing_id);
+CREATE INDEX ON artifact (insertion_time);
+
+-- 001
+CREATE INDEX build_insertion_time_id_idx ON build (insertion_time, id);
+CREATE INDEX artifact_insertion_time_id_idx ON artifact (insertion_time, id);
+CREATE INDEX promote_insertion_time_id_idx ON promote (insertion_time, id);
+CREATE INDEX deploy_insertion_time_id_idx ON deploy (insertion_time, id);
+
+-- 003
+CREATE INDEX build_job_url_trgm_idx
+    ON build USING gin (job_url gin_trgm_ops);
+CREATE INDEX build_job_description_trgm_idx
+    ON build USING gin (job_description gin_trgm_ops);
+
+-- 004
+CREATE INDEX build_misc_idx ON build USING gin (misc jsonb_path_ops);
+CREATE INDEX artifact_misc_idx ON artifact USING gin (misc jsonb_path_ops);
+CREATE INDEX promote_misc_idx ON promote USING gin (misc jsonb_path_ops);
+CREATE INDEX deploy_misc_idx ON deploy USING gin (misc jsonb_path_ops);
+CREATE INDEX deploy_misc_timestamp_idx ON deploy ((misc ->> 'timestamp'));
+
+-- 005
+CREATE TRIGGER deploy_current_deploy
+    AFTER INSERT ON deploy
+    FOR EACH ROW EXECUTE PROCEDURE current_deploy_upsert();
+
+CREATE VIEW deploys_view AS
+SELECT
+    deploy.id AS deploy_id,
+    deploy.insertion_time AS insertion_time,
+    versioned_things_view.thing_id AS thing_id,
+    versioned_things_view.thing_type AS thing_type,
+    versioned_things_view.unique_thing_name AS thing_name,
+    versioned_things_view.version_id AS version_id,
+    versioned_things_view.version_type AS version_type,
+    versioned_things_view.version AS version,
+    deploy.environment AS environment,
+    servername.servername AS servername,
+    deploy.misc AS misc
+FROM deploy
+INNER JOIN versioned_things_view
+      ON versioned_things_view.versioned_id = deploy.versioned_thing_id
+LEFT JOIN servername
+      ON servername.id = deploy.servername_id;
+
+CREATE VIEW artifacts_view AS
+SELECT
+            artifact.id AS artifact_id,
+            artifact.insertion_time AS insertion_time,
+            versioned_things_view.thing_id AS thing_id,
+            versioned_things_view.thing_type AS thing_type,
+            versioned_things_view.unique_thing_name AS unique_thing_name,
+            versioned_things_view.version_id AS version_id,
+            versioned_things_view.version_type AS version_type,
+            versioned_things_view.version AS version,
+            artifact.build_id AS build_id,
+            build.job_url AS job_url,
+            build.job_description AS job_description,
+            build.duration AS duration,
+            build.result AS result,
+            artifact.misc AS misc
+FROM artifact
+INNER JOIN build
+      ON build.id = artifact.build_id
+INNER JOIN versioned_things_view
+      ON versioned_things_view.versioned_id = artifact.versioned_thing_id;
+
+CREATE VIEW builds_view AS
+SELECT
+        build.id AS build_id,
+        build.insertion_time AS insertion_time,
+        version.id as version_id,
+        version.version_type as version_type,
+        version.version as version,
+        build.job_url as job_url,
+        build.job_description as job_description,
+        build.duration as duration,
+        build.result as result,
+        build.misc as misc
+FROM build
+INNER JOIN version
+      ON version.id = build.version_id;
+
+CREATE VIEW promotes_view AS
+SELECT
+            promote.id as promote_id,
+            promote.insertion_time as insertion_time,
+            thing.thing_type as thing_type,
+            thing.unique_thing_name as thing_name,
+            thing.insertion_time as thing_time,
+            promote.environment as environment,
+            promote.misc as misc
+FROM promote
+INNER JOIN thing
+      ON thing.id = promote.thing_id;
+
+DELETE FROM schema_migrations WHERE migration_key = 6;
@@ -0,0 +1,286 @@
+----------------------------------------------------------------------
+--- 006-partition-fact-tables-up.sql
+--- build, artifact, promote and deploy become range partitioned on
+--- insertion_time, one partition per (UTC) month, plus a default
+--- partition for rows no monthly partition covers yet. Queries that
+--- constrain insertion_time only touch the months they ask for.
+---
+--- Needs PostgreSQL 11. ensure_fact_partitions() creates partitions
+--- ahead of time; run it from cron (history.py partitions) so the
+--- default partition stays empty.
+---
+--- Rows with a NULL insertion_time cannot be partitioned and make
+--- this migration fail; none are written by the backend.
+
+INSERT INTO schema_migrations (migration_key) VALUES (6);
+
+-- Creates (if missing) the partition of `parent` holding the UTC
+-- month of `month`. Rows already in the default partition for that
+-- month are moved into it.
+CREATE FUNCTION ensure_monthly_partition(parent text, month date)
+RETURNS text AS $$
+DECLARE
+    lower_bound timestamptz :=
+        date_trunc('month', month::timestamp) AT TIME ZONE 'UTC';
+    upper_bound timestamptz :=
+        (date_trunc('month', month::timestamp) + interval '1 month')
+        AT TIME ZONE 'UTC';
+    partition_name text := parent || '_p' || to_char(month, 'YYYYMM');
+BEGIN
+    PERFORM pg_advisory_xact_lock(hashtext(parent));
+    IF to_regclass(partition_name) IS NOT NULL THEN
+        RETURN partition_name;
+    END IF;
+    EXECUTE format('CREATE TABLE %I (LIKE %I INCLUDING DEFAULTS)',
+                   partition_name, parent);
+    EXECUTE format('WITH moved AS (DELETE FROM %I WHERE insertion_time >= %L'
+                   ' AND insertion_time < %L RETURNING *)'
+                   ' INSERT INTO %I SELECT * FROM moved',
+                   parent || '_default', lower_bound, upper_bound,
+                   partition_name);
+    EXECUTE format('ALTER TABLE %I ATTACH PARTITION %I'
+                   ' FOR VALUES FROM (%L) TO (%L)',
+                   parent, partition_name, lower_bound, upper_bound);
+    RETURN partition_name;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Partitions of every fact table from this month to `months_ahead`
+-- months from now.
+CREATE FUNCTION ensure_fact_partitions(months_ahead integer)
+RETURNS SETOF text AS $$
+    SELECT ensure_monthly_partition(parent, month::date)
+    FROM unnest(ARRAY['build', 'artifact', 'promote', 'deploy']) AS parent,
+         generate_series(date_trunc('month', now() AT TIME ZONE 'UTC'),
+                         date_trunc('month', now() AT TIME ZONE 'UTC') +
+                             months_ahead * interval '1 month',
+                         interval '1 month') AS month;
+$$ LANGUAGE sql;
+
+-- artifact.build_id can no longer be a foreign key: build's primary
+-- key has to include insertion_time. This raises the same error the
+-- foreign key did.
+CREATE FUNCTION artifact_build_exists() RETURNS trigger AS $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM build WHERE id = NEW.build_id) THEN
+        RAISE EXCEPTION 'build % does not exist', NEW.build_id
+            USING ERRCODE = 'foreign_key_violation';
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP VIEW deploys_view;
+DROP VIEW artifacts_view;
+DROP VIEW builds_view;
+DROP VIEW promotes_view;
+
+ALTER SEQUENCE build_id_seq OWNED BY NONE;
+ALTER SEQUENCE artifact_id_seq OWNED BY NONE;
+ALTER SEQUENCE promote_id_seq OWNED BY NONE;
+ALTER SEQUENCE deploy_id_seq OWNED BY NONE;
+
+ALTER TABLE build RENAME TO build_unpartitioned;
+ALTER TABLE artifact RENAME TO artifact_unpartitioned;
+ALTER TABLE promote RENAME TO promote_unpartitioned;
+ALTER TABLE deploy RENAME TO deploy_unpartitioned;
+
+CREATE TABLE build(
+    id INTEGER NOT NULL DEFAULT nextval('build_id_seq'),
+    insertion_time TIMESTAMP WITH TIME ZONE NOT NULL,
+    version_id INTEGER NOT NULL REFERENCES version(id),
+    job_url TEXT NOT NULL,
+    job_description TEXT NOT NULL,
+    duration INTEGER NOT NULL,
+    result VARCHAR(16) NOT NULL,
+    misc jsonb NOT NULL)
+PARTITION BY RANGE (insertion_time);
+
+CREATE TABLE promote(
+    id INTEGER NOT NULL DEFAULT nextval('promote_id_seq'),
+    insertion_time TIMESTAMP WITH TIME ZONE NOT NULL,
+    thing_id INTEGER NOT NULL REFERENCES thing(id),
+    environment environment_enum NOT NULL,
+    misc jsonb NOT NULL)
+PARTITION BY RANGE (insertion_time);
+
+CREATE TABLE deploy(
+    id INTEGER NOT NULL DEFAULT nextval('deploy_id_seq'),
+    insertion_time TIMESTAMP WITH TIME ZONE NOT NULL,
+    versioned_thing_id INTEGER NOT NULL REFERENCES versioned_thing(id),
+    -- nullable: not everything is a server.
+    servername_id INTEGER,
+    environment environment_enum NOT NULL,
+    misc jsonb NOT NULL)
+PARTITION BY RANGE (insertion_time);
+
+CREATE TABLE artifact(
+    id INTEGER NOT NULL DEFAULT nextval('artifact_id_seq'),
+    insertion_time TIMESTAMP WITH TIME ZONE NOT NULL,
+    versioned_thing_id INTEGER NOT NULL REFERENCES versioned_thing(id),
+    -- checked by artifact_build_exists()
+    build_id INTEGER NOT NULL,
+    misc jsonb NOT NULL)
+PARTITION BY RANGE (insertion_time);
+
+ALTER SEQUENCE build_id_seq OWNED BY build.id;
+ALTER SEQUENCE artifact_id_seq OWNED BY artifact.id;
+ALTER SEQUENCE promote_id_seq OWNED BY promote.id;
+ALTER SEQUENCE deploy_id_seq OWNED BY deploy.id;
+
+CREATE TABLE build_default PARTITION OF build DEFAULT;
+CREATE TABLE artifact_default PARTITION OF artifact DEFAULT;
+CREATE TABLE promote_default PARTITION OF promote DEFAULT;
+CREATE TABLE deploy_default PARTITION OF deploy DEFAULT;
+
+-- a partition for every month with data, and a few to grow into.
+SELECT ensure_monthly_partition(parent, month::date)
+FROM (SELECT 'build' AS parent, min(insertion_time) AS oldest
+      FROM build_unpartitioned
+      UNION ALL
+      SELECT 'artifact', min(insertion_time) FROM artifact_unpartitioned
+      UNION ALL
+      SELECT 'promote', min(insertion_time) FROM promote_unpartitioned
+      UNION ALL
+      SELECT 'deploy', min(insertion_time) FROM deploy_unpartitioned) AS t,
+     generate_series(date_trunc('month', COALESCE(oldest, now()) AT TIME ZONE 'UTC'),
+                     date_trunc('month', now() AT TIME ZONE 'UTC') +
+                         interval '3 months',
+                     interval '1 month') AS month;
+
+INSERT INTO build (id, insertion_time, version_id, job_url,
+                   job_description, duration, result, misc)
+SELECT id, insertion_time, version_id, job_url,
+       job_description, duration, result, misc
+FROM build_unpartitioned;
+
+INSERT INTO artifact (id, insertion_time, versioned_thing_id, build_id, misc)
+SELECT id, insertion_time, versioned_thing_id, build_id, misc
+FROM artifact_unpartitioned;
+
+INSERT INTO promote (id, insertion_time, thing_id, environment, misc)
+SELECT id, insertion_time, thing_id, environment, misc
+FROM promote_unpartitioned;
+
+INSERT INTO deploy (id, insertion_time, versioned_thing_id,
+                    servername_id, environment, misc)
+SELECT id, insertion_time, versioned_thing_id,
+       servername_id, environment, misc
+FROM deploy_unpartitioned;
+
+-- also drops the old tables' indexes, freeing their names.
+DROP TABLE artifact_unpartitioned;
+DROP TABLE deploy_unpartitioned;
+DROP TABLE promote_unpartitioned;
+DROP TABLE build_unpartitioned;
+
+-- the partition key has to be part of the primary key; id is still
+-- unique, it comes from a sequence.
+ALTER TABLE build ADD PRIMARY KEY (id, insertion_time);
+ALTER TABLE artifact ADD PRIMARY KEY (id, insertion_time);
+ALTER TABLE promote ADD PRIMARY KEY (id, insertion_time);
+ALTER TABLE deploy ADD PRIMARY KEY (id, insertion_time);
+
+CREATE INDEX ON build (version_id);
+CREATE INDEX ON promote (thing_id);
+CREATE INDEX ON deploy (versioned_thing_id);
+CREATE INDEX ON artifact (versioned_thing_id);
+CREATE INDEX ON artifact (build_id);
+
+-- 001
+CREATE INDEX build_insertion_time_id_idx ON build (insertion_time, id);
+CREATE INDEX artifact_insertion_time_id_idx ON artifact (insertion_time, id);
+CREATE INDEX promote_insertion_time_id_idx ON promote (insertion_time, id);
+CREATE INDEX deploy_insertion_time_id_idx ON deploy (insertion_time, id);
+
+-- 003
+CREATE INDEX build_job_url_trgm_idx
+    ON build USING gin (job_url gin_trgm_ops);
+CREATE INDEX build_job_description_trgm_idx
+    ON build USING gin (job_description gin_trgm_ops);
+
+-- 004
+CREATE INDEX build_misc_idx ON build USING gin (misc jsonb_path_ops);
+CREATE INDEX artifact_misc_idx ON artifact USING gin (misc jsonb_path_ops);
+CREATE INDEX promote_misc_idx ON promote USING gin (misc jsonb_path_ops);
+CREATE INDEX deploy_misc_idx ON deploy USING gin (misc jsonb_path_ops);
+CREATE INDEX deploy_misc_timestamp_idx ON deploy ((misc ->> 'timestamp'));
+
+-- 005; current_deploy already reflects the copied deploys.
+CREATE TRIGGER deploy_current_deploy
+    AFTER INSERT ON deploy
+    FOR EACH ROW EXECUTE PROCEDURE current_deploy_upsert();
+
+CREATE TRIGGER artifact_build_exists
+    AFTER INSERT ON artifact
+    FOR EACH ROW EXECUTE PROCEDURE artifact_build_exists();
+
+CREATE VIEW deploys_view AS
+SELECT
+    deploy.id AS deploy_id,
+    deploy.insertion_time AS insertion_time,
+    versioned_things_view.thing_id AS thing_id,
+    versioned_things_view.thing_type AS thing_type,
+    versioned_things_view.unique_thing_name AS thing_name,
+    versioned_things_view.version_id AS version_id,
+    versioned_things_view.version_type AS version_type,
+    versioned_things_view.version AS version,
+    deploy.environment AS environment,
+    servername.servername AS servername,
+    deploy.misc AS misc
+FROM deploy
+INNER JOIN versioned_things_view
+      ON versioned_things_view.versioned_id = deploy.versioned_thing_id
+LEFT JOIN servername
+      ON servername.id = deploy.servername_id;
+
+CREATE VIEW artifacts_view AS
+SELECT
+            artifact.id AS artifact_id,
+            artifact.insertion_time AS insertion_time,
+            versioned_things_view.thing_id AS thing_id,
+            versioned_things_view.thing_type AS thing_type,
+            versioned_things_view.unique_thing_name AS unique_thing_name,
+            versioned_things_view.version_id AS version_id,
+            versioned_things_view.version_type AS version_type,
+            versioned_things_view.version AS version,
+            artifact.build_id AS build_id,
+            build.job_url AS job_url,
+            build.job_description AS job_description,
+            build.duration AS duration,
+            build.result AS result,
+            artifact.misc AS misc
+FROM artifact
+INNER JOIN build
+      ON build.id = artifact.build_id
+INNER JOIN versioned_things_view
+      ON versioned_things_view.versioned_id = artifact.versioned_thing_id;
+
+CREATE VIEW builds_view AS
+SELECT
+        build.id AS build_id,
+        build.insertion_time AS insertion_time,
+        version.id as version_id,
+        version.version_type as version_type,
+        version.version as version,
+        build.job_url as job_url,
+        build.job_description as job_description,
+        build.duration as duration,
+        build.result as result,
+        build.misc as misc
+FROM build
+INNER JOIN version
+      ON version.id = build.version_id;
+
+CREATE VIEW promotes_view AS
+SELECT
+            promote.id as promote_id,
+            promote.insertion_time as insertion_time,
+            thing.thing_type as thing_type,
+            thing.unique_thing_name as thing_name,
+            thing.insertion_time as thing_time,
+            promote.environment as environment,
+            promote.misc as misc
+FROM promote
+INNER JOIN thing
+      ON thing.id = promote.thing_id;
@@ -0,0 +1,12 @@
+----------------------------------------------------------------------
+--- 007-duplicate-indexes-down.sql
+
+CREATE INDEX ON version (id);
+CREATE INDEX ON version (version);
+CREATE INDEX ON servername (servername);
+CREATE INDEX ON servername (id);
+CREATE INDEX ON thing (id);
+CREATE INDEX ON versioned_thing(id);
+CREATE INDEX ON versioned_thing(version_id);
+
+DELETE FROM schema_migrations WHERE migration_key = 7;
@@ -0,0 +1,22 @@
+----------------------------------------------------------------------
+--- 007-duplicate-indexes-up.sql
+--- Drops indexes that duplicate a primary key or unique constraint's
+--- own index, and only cost inserts.
+---
+--- insertion_time keeps the (insertion_time, id) btree alone (001,
+--- 006): keyset pagination needs it and it answers time ranges too,
+--- so a BRIN index next to it would only cost inserts
+--- (scripts/bench-time-indexes.sql).
+
+INSERT INTO schema_migrations (migration_key) VALUES (7);
+
+-- primary keys
+DROP INDEX version_id_idx;
+DROP INDEX servername_id_idx;
+DROP INDEX thing_id_idx;
+DROP INDEX versioned_thing_id_idx;
+-- version_uq, servername_uq
+DROP INDEX version_version_idx;
+DROP INDEX servername_servername_idx;
+-- leading column of synthetic_versioned_thing_uq (version_id, thing_id)
+DROP INDEX versioned_thing_version_id_idx;
@@ -0,0 +1,16 @@
+----------------------------------------------------------------------
+--- 008-hourly-rollups-down.sql
+
+DROP TRIGGER IF EXISTS deploy_hourly_add ON deploy;
+DROP TRIGGER IF EXISTS build_hourly_add ON build;
+DROP FUNCTION IF EXISTS deploy_hourly_add();
+DROP FUNCTION IF EXISTS build_hourly_add();
+DROP FUNCTION IF EXISTS utc_hour(timestamptz);
+DROP VIEW IF EXISTS deploy_hourly_all;
+DROP VIEW IF EXISTS build_hourly_all;
+DROP TABLE IF EXISTS deploy_hourly_delta;
+DROP TABLE IF EXISTS build_hourly_delta;
+DROP TABLE IF EXISTS deploy_hourly;
+DROP TABLE IF EXISTS build_hourly;
+
+DELETE FROM schema_migrations WHERE migration_key = 8;
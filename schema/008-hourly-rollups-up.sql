@@ -0,0 +1,126 @@
+----------------------------------------------------------------------
+--- 008-hourly-rollups-up.sql
+--- hourly rollups of deploys and builds, so dashboards read one row per
+--- (hour, key) instead of every event. Statement triggers on the fact
+--- tables add each INSERT's rows, grouped by bucket, to a delta table
+--- in the inserting transaction; a 10000-line /batch is one delta row
+--- per bucket, not one per row.
+---
+--- The triggers only append: upserting the rollup itself would make
+--- every insert in the same hour queue on that bucket's row lock until
+--- the previous inserter commits. `history.py rollups --fold` (from
+--- cron, every minute or so) moves the deltas into the rollups, and
+--- readers add in whatever is not folded yet (the *_all views).
+---
+--- Hours are UTC. `history.py rollups --check` compares the rollups
+--- with the raw tables, and `--backfill` rebuilds them.
+
+INSERT INTO schema_migrations (migration_key) VALUES (8);
+
+CREATE TABLE deploy_hourly(
+    hour TIMESTAMP WITH TIME ZONE NOT NULL,
+    environment environment_enum NOT NULL,
+    thing_id INTEGER NOT NULL REFERENCES thing(id),
+    count BIGINT NOT NULL,
+    PRIMARY KEY (hour, environment, thing_id));
+
+CREATE TABLE build_hourly(
+    hour TIMESTAMP WITH TIME ZONE NOT NULL,
+    result VARCHAR(16) NOT NULL,
+    version_type version_enum NOT NULL,
+    count BIGINT NOT NULL,
+    duration_sum BIGINT NOT NULL,
+    PRIMARY KEY (hour, result, version_type));
+
+-- no keys: several rows may share a bucket until they are folded.
+CREATE TABLE deploy_hourly_delta(
+    hour TIMESTAMP WITH TIME ZONE NOT NULL,
+    environment environment_enum NOT NULL,
+    thing_id INTEGER NOT NULL,
+    count BIGINT NOT NULL);
+
+CREATE TABLE build_hourly_delta(
+    hour TIMESTAMP WITH TIME ZONE NOT NULL,
+    result VARCHAR(16) NOT NULL,
+    version_type version_enum NOT NULL,
+    count BIGINT NOT NULL,
+    duration_sum BIGINT NOT NULL);
+
+-- what readers sum: a bucket may have a row in each part.
+CREATE VIEW deploy_hourly_all AS
+    SELECT hour, environment, thing_id, count FROM deploy_hourly
+    UNION ALL
+    SELECT hour, environment, thing_id, count FROM deploy_hourly_delta;
+
+CREATE VIEW build_hourly_all AS
+    SELECT hour, result, version_type, count, duration_sum
+    FROM build_hourly
+    UNION ALL
+    SELECT hour, result, version_type, count, duration_sum
+    FROM build_hourly_delta;
+
+CREATE FUNCTION utc_hour(ts timestamptz) RETURNS timestamptz AS $$
+    SELECT date_trunc('hour', ts AT TIME ZONE 'UTC') AT TIME ZONE 'UTC';
+$$ LANGUAGE sql IMMUTABLE;
+
+CREATE FUNCTION deploy_hourly_add() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO deploy_hourly_delta (hour, environment, thing_id, count)
+    SELECT utc_hour(new_rows.insertion_time),
+           new_rows.environment,
+           versioned_thing.thing_id,
+           count(*)
+    FROM new_rows
+    INNER JOIN versioned_thing
+          ON versioned_thing.id = new_rows.versioned_thing_id
+    GROUP BY 1, 2, 3;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE FUNCTION build_hourly_add() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO build_hourly_delta (hour, result, version_type, count,
+                                    duration_sum)
+    SELECT utc_hour(new_rows.insertion_time),
+           new_rows.result,
+           version.version_type,
+           count(*),
+           sum(new_rows.duration)
+    FROM new_rows
+    INNER JOIN version ON version.id = new_rows.version_id
+    GROUP BY 1, 2, 3;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- creating the triggers locks out inserts until this migration
+-- commits, so the backfill below and the triggers see the same rows.
+CREATE TRIGGER deploy_hourly_add
+    AFTER INSERT ON deploy
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE PROCEDURE deploy_hourly_add();
+
+CREATE TRIGGER build_hourly_add
+    AFTER INSERT ON build
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE PROCEDURE build_hourly_add();
+
+INSERT INTO deploy_hourly (hour, environment, thing_id, count)
+SELECT utc_hour(deploy.insertion_time),
+       deploy.environment,
+       versioned_thing.thing_id,
+       count(*)
+FROM deploy
+INNER JOIN versioned_thing ON versioned_thing.id = deploy.versioned_thing_id
+GROUP BY 1, 2, 3;
+
+INSERT INTO build_hourly (hour, result, version_type, count, duration_sum)
+SELECT utc_hour(build.insertion_time),
+       build.result,
+       version.version_type,
+       count(*),
+       sum(build.duration)
+FROM build
+INNER JOIN version ON version.id = build.version_id
+GROUP BY 1, 2, 3;
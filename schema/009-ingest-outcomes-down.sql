@@ -0,0 +1,6 @@
+----------------------------------------------------------------------
+--- 009-ingest-outcomes-down.sql
+
+DROP TABLE IF EXISTS ingest_outcome;
+
+DELETE FROM schema_migrations WHERE migration_key = 9;
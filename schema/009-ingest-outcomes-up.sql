@@ -0,0 +1,18 @@
+----------------------------------------------------------------------
+--- 009-ingest-outcomes-up.sql
+--- ingest_outcome records, in the transaction that inserts them, the
+--- row each write-behind assertion (src/ingest.py) became, keyed by the
+--- ingest log's id and the assertion's sequence number. An assertion
+--- whose transaction committed but whose outcome never reached the log
+--- (the database went away mid-retry, or the process died before the
+--- fsync) is found here on retry or replay instead of being inserted a
+--- second time. Rows are dropped once the log holds their outcome.
+
+INSERT INTO schema_migrations (migration_key) VALUES (9);
+
+CREATE TABLE ingest_outcome(
+    log UUID NOT NULL,
+    seq BIGINT NOT NULL,
+    kind VARCHAR(16) NOT NULL,
+    id INTEGER NOT NULL,
+    PRIMARY KEY (log, seq));
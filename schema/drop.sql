@@ -1,6 +1,19 @@
 -- run this script to DROP the schema
 drop table if exists schema_migrations;
 
+drop table if exists ingest_outcome cascade;
+drop table if exists deploy_hourly cascade;
+drop table if exists build_hourly cascade;
+drop table if exists deploy_hourly_delta cascade;
+drop table if exists build_hourly_delta cascade;
+drop function if exists deploy_hourly_add() cascade;
+drop function if exists build_hourly_add() cascade;
+drop function if exists utc_hour(timestamptz) cascade;
+drop table if exists current_deploy cascade;
+drop function if exists current_deploy_upsert() cascade;
+drop function if exists artifact_build_exists() cascade;
+drop function if exists ensure_fact_partitions(integer) cascade;
+drop function if exists ensure_monthly_partition(text, date) cascade;
 drop table if exists artifact cascade;
 drop table if exists deploy cascade;
 drop table if exists build cascade;
@@ -0,0 +1,17 @@
+----------------------------------------------------------------------
+--- bench-rollup-inserts.sql
+--- A pgbench script: every transaction inserts one build, and every
+--- build lands in the same build_hourly bucket (hour, result,
+--- version_type), so it measures how concurrent inserts contend in the
+--- rollup triggers of migration 008. Compare the tps for 1 and many
+--- clients:
+---
+---   pgbench -n -U historyserverrole -f scripts/bench-rollup-inserts.sql -c 1 -T 15 scratchdb
+---   pgbench -n -U historyserverrole -f scripts/bench-rollup-inserts.sql -c 32 -T 15 scratchdb
+---
+--- The builds stay; needs a version with id 1.
+
+INSERT INTO build (insertion_time, version_id, job_url, job_description,
+                   duration, result, misc)
+VALUES (now(), 1, 'http://example.com/pgbench', 'rollup contention', 1,
+        'success', '{}');
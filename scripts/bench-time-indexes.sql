@@ -0,0 +1,88 @@
+----------------------------------------------------------------------
+--- bench-time-indexes.sql
+--- Insert throughput, range-scan latency and index size of the
+--- insertion_time indexes on a fact table, on copies of the deploy
+--- table's shape filled the way the backend fills it: in insertion_time
+--- order. deploy_brin carries the (insertion_time, id) keyset btree
+--- plus a BRIN index on insertion_time; deploy_btree carries the btree
+--- alone (migration 007).
+---
+---   psql -U historyserverrole -v rows=5000000 scratchdb < scripts/bench-time-indexes.sql
+---
+--- Compare the \timing of each pair of statements. Only temporary
+--- tables are used.
+
+\set ON_ERROR_STOP on
+\timing on
+
+CREATE TEMPORARY TABLE deploy_btree(
+    id SERIAL PRIMARY KEY,
+    insertion_time TIMESTAMP WITH TIME ZONE NOT NULL,
+    versioned_thing_id INTEGER NOT NULL,
+    servername_id INTEGER,
+    environment TEXT NOT NULL,
+    misc jsonb NOT NULL);
+CREATE TEMPORARY TABLE deploy_brin(
+    id SERIAL PRIMARY KEY,
+    insertion_time TIMESTAMP WITH TIME ZONE NOT NULL,
+    versioned_thing_id INTEGER NOT NULL,
+    servername_id INTEGER,
+    environment TEXT NOT NULL,
+    misc jsonb NOT NULL);
+
+CREATE INDEX ON deploy_btree (insertion_time, id);
+CREATE INDEX ON deploy_brin (insertion_time, id);
+CREATE INDEX ON deploy_brin USING brin (insertion_time);
+
+-- insert throughput
+INSERT INTO deploy_btree (insertion_time, versioned_thing_id, servername_id,
+                          environment, misc)
+SELECT now() - (:rows - i) * interval '1 second', i % 1000, i % 500,
+       'production', '{}'
+FROM generate_series(1, :rows) AS i;
+
+INSERT INTO deploy_brin (insertion_time, versioned_thing_id, servername_id,
+                         environment, misc)
+SELECT now() - (:rows - i) * interval '1 second', i % 1000, i % 500,
+       'production', '{}'
+FROM generate_series(1, :rows) AS i;
+
+VACUUM ANALYZE deploy_btree;
+VACUUM ANALYZE deploy_brin;
+
+-- index size
+SELECT relname, pg_size_pretty(pg_relation_size(oid)) AS size
+FROM pg_class
+WHERE relname IN ('deploy_btree_insertion_time_id_idx',
+                  'deploy_brin_insertion_time_id_idx',
+                  'deploy_brin_insertion_time_idx');
+
+-- range scans: the last day, and the last 30 days.
+EXPLAIN ANALYZE SELECT count(*) FROM deploy_btree
+    WHERE insertion_time > now() - interval '1 day';
+EXPLAIN ANALYZE SELECT count(*) FROM deploy_brin
+    WHERE insertion_time > now() - interval '1 day';
+
+EXPLAIN ANALYZE SELECT count(*) FROM deploy_btree
+    WHERE insertion_time > now() - interval '30 days';
+EXPLAIN ANALYZE SELECT count(*) FROM deploy_brin
+    WHERE insertion_time > now() - interval '30 days';
+
+-- a keyset page from the middle of the table.
+EXPLAIN ANALYZE SELECT * FROM deploy_btree
+    WHERE (insertion_time, id) < (now() - interval '30 days', 0)
+    ORDER BY insertion_time DESC, id DESC LIMIT 100;
+EXPLAIN ANALYZE SELECT * FROM deploy_brin
+    WHERE (insertion_time, id) < (now() - interval '30 days', 0)
+    ORDER BY insertion_time DESC, id DESC LIMIT 100;
+
+-- steady-state appends with the indexes in place.
+INSERT INTO deploy_btree (insertion_time, versioned_thing_id, servername_id,
+                          environment, misc)
+SELECT now() + i * interval '1 second', i % 1000, i % 500, 'production', '{}'
+FROM generate_series(1, :rows / 10) AS i;
+
+INSERT INTO deploy_brin (insertion_time, versioned_thing_id, servername_id,
+                         environment, misc)
+SELECT now() + i * interval '1 second', i % 1000, i % 500, 'production', '{}'
+FROM generate_series(1, :rows / 10) AS i;
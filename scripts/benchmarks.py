@@ -0,0 +1,230 @@
+#!/usr/bin/env python2.7
+"""
+Micro-benchmarks for the history server's hot paths.
+
+Run from the src directory, with the web requirements installed:
+
+    python ../scripts/benchmarks.py rows
+    python ../scripts/benchmarks.py encode --sizes 10000 100000
+    python ../scripts/benchmarks.py prepared --calls 5000
+    python ../scripts/benchmarks.py memory --rows 1000000
+
+`prepared` needs the database in env.properties.toml; it adds one
+build (and its version) to it.
+"""
+import argparse
+import datetime
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+import dateutil.parser
+import dateutil.tz
+from flask_restplus import marshal
+
+import web
+from backend import DIMENSION_CACHE, PgServer
+
+NOW = datetime.datetime.now(dateutil.tz.tzutc())
+
+# (name, result record, swagger model); a record's _fields are its
+# columns.
+ENTITIES = (
+    ('build', PgServer.BuildRecord, web.build),
+    ('artifact', PgServer.ArtifactRecord, web.artifact),
+    ('promote', PgServer.PromoteRecord, web.promote),
+    ('deploy', PgServer.DeployRecord, web.deploy),
+)
+
+
+def sample_rows(columns, count):
+    """
+    Tuples shaped like what psycopg2 returns for `columns`.
+    """
+    def value(column, i):
+        if column.endswith('_time'):
+            return NOW - datetime.timedelta(seconds=i)
+        if column.endswith('_id') or column == 'duration':
+            return i
+        if column == 'misc':
+            return {'comment': 'benchmark', 'n': i}
+        return '{0}-{1}'.format(column, i)
+    return [tuple(value(c, i) for c in columns) for i in xrange(count)]
+
+
+def timed(func, *args):
+    start = time.time()
+    func(*args)
+    return time.time() - start
+
+
+def report(name, count, before, after, unit='row'):
+    print "{0:<16} before {1:8.2f} us/{4}   after {2:8.2f} us/{4}   {3:5.1f}x".format(
+        name, before / count * 1e6, after / count * 1e6, before / after, unit)
+
+
+##############################
+# rows: backend row -> marshalled response
+
+def legacy_rows(columns, rows, model):
+    """
+    The pre-typed-row pipeline: isoformat in the backend getter, then
+    dateutil back to datetimes in the web handler, then marshal.
+    """
+    results = []
+    for row in rows:
+        temp = dict(zip(columns, row))
+        for attr in temp:
+            if attr.endswith('_time'):
+                temp[attr] = temp[attr].isoformat()
+        results.append(temp)
+    for obj in results:
+        for attr in obj:
+            if attr.endswith('_time'):
+                obj[attr] = dateutil.parser.parse(obj[attr])
+    return marshal(results, model)
+
+
+def current_rows(record, rows, model):
+    return marshal(list(PgServer._iter_getter(record, rows)), model)
+
+
+def bench_rows(args):
+    with web.app.app_context():
+        for name, record, model in ENTITIES:
+            rows = sample_rows(record._fields, args.rows)
+            report(name, args.rows,
+                   timed(legacy_rows, record._fields, rows, model),
+                   timed(current_rows, record, rows, model))
+
+
+##############################
+# encode: backend rows -> JSON body of a /<thing>/all response
+
+def marshal_encode(record, rows, model):
+    return json.dumps(current_rows(record, rows, model),
+                      default=web.json_default)
+
+
+def row_encode(encoder, rows):
+    return ''.join(encoder.encode_list(rows))
+
+
+def bench_encode(args):
+    with web.app.app_context():
+        for name, record, model in ENTITIES:
+            encoder = web.list_encoders[name + 's']
+            check = sample_rows(record._fields, 100)
+            assert (json.loads(marshal_encode(record, check, model)) ==
+                    json.loads(row_encode(encoder, check))), name
+            for size in args.sizes:
+                rows = sample_rows(record._fields, size)
+                report('{0}/{1}'.format(name, size), size,
+                       timed(marshal_encode, record, rows, model),
+                       timed(row_encode, encoder, rows))
+                del rows
+
+
+##############################
+# memory: a result set held as dicts against as records
+
+def held(convert, rows):
+    """
+    Bytes allocated for the result set `convert` makes of `rows`: the
+    list and each converted row, not the column values, which both
+    forms share. tracemalloc, which would count this for us, is
+    Python 3 only.
+    """
+    results = map(convert, rows)
+    return (sys.getsizeof(results) +
+            sum(sys.getsizeof(result) for result in results))
+
+
+def bench_memory(args):
+    for name, record, _ in ENTITIES:
+        columns = record._fields
+        rows = sample_rows(columns, args.rows)
+        as_dicts = held(lambda row: dict(zip(columns, row)), rows)
+        as_records = held(record._make, rows)
+        print ("{0:<16} dicts {1:8.1f} MB ({2:4d} B/row)   "
+               "records {3:8.1f} MB ({4:4d} B/row)   {5:5.1f}x").format(
+                   '{0}/{1}'.format(name, args.rows),
+                   as_dicts / 1e6, as_dicts / args.rows,
+                   as_records / 1e6, as_records / args.rows,
+                   float(as_dicts) / as_records)
+        del rows
+
+
+##############################
+# prepared: plain statements against PREPARE once, EXECUTE after
+
+def bench_prepared(args):
+    version = 'benchmark-prepared'
+    with PgServer(web.ENVIRONMENT_PROPERTIES, pooled=True) as server:
+        build_id = server.append_build('changeset', version,
+                                       'http://example.com/benchmark',
+                                       'prepared statement benchmark',
+                                       1, 'success', {})
+
+    def ensure_version(server):
+        # make it a lookup in the database, not the cache.
+        DIMENSION_CACHE.clear()
+        server.ensure_version('changeset', version)
+
+    def get_build_by_build_id(server):
+        server.get_build_by_build_id(build_id)
+
+    def get_artifact_by_build_id(server):
+        server.get_artifact_by_build_id(build_id)
+
+    def calls(func):
+        # one transaction per call on a pooled connection, like a
+        # request to the web app.
+        for _ in xrange(args.calls):
+            with PgServer(web.ENVIRONMENT_PROPERTIES, pooled=True) as server:
+                func(server)
+
+    for func in (ensure_version, get_build_by_build_id,
+                 get_artifact_by_build_id):
+        PgServer.prepare_statements = False
+        before = timed(calls, func)
+        PgServer.prepare_statements = True
+        after = timed(calls, func)
+        report(func.__name__, args.calls, before, after, 'call')
+
+
+def arg_handler():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    subparsers = parser.add_subparsers(title='benchmarks', dest='command')
+
+    temp_parser = subparsers.add_parser(
+        'rows', help='per-row cost of turning query results into a response')
+    temp_parser.add_argument('--rows', type=int, default=20000)
+    temp_parser.set_defaults(func=bench_rows)
+
+    temp_parser = subparsers.add_parser(
+        'encode', help='marshal + json.dumps against the RowEncoder fast path')
+    temp_parser.add_argument('--sizes', type=int, nargs='+',
+                             default=[10000, 100000, 1000000])
+    temp_parser.set_defaults(func=bench_encode)
+
+    temp_parser = subparsers.add_parser(
+        'memory', help='memory held by a result set of dicts against records')
+    temp_parser.add_argument('--rows', type=int, default=1000000)
+    temp_parser.set_defaults(func=bench_memory)
+
+    temp_parser = subparsers.add_parser(
+        'prepared', help='fixed statements sent as is against prepared')
+    temp_parser.add_argument('--calls', type=int, default=5000)
+    temp_parser.set_defaults(func=bench_prepared)
+
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = arg_handler()
+    args.func(args)
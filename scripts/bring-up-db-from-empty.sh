@@ -7,6 +7,8 @@ cd $(dirname $(dirname $(readlink -f $0)))/scripts
 psql -U postgres -c 'create database historyserverdb'
 psql -U postgres -c "create user historyserverrole with password 'mysecretpassword'"
 psql -U postgres -c 'grant all privileges on database historyserverdb to historyserverrole'
+# extensions the migrations use, which historyserverrole can't create
+psql -U postgres historyserverdb -c 'create extension if not exists pg_trgm'
 
 export PGPASSWORD="mysecretpassword"
 # initialize the
@@ -44,6 +44,34 @@ python history.py w-deploy config "config-$RANDOM_SLUG" $FAKE_GIT2 "qa"  no-op
 python history.py w-promote "artifact-$MAJOR_SLUG.$MINOR_SLUG" qa no-op
 python history.py w-promote "artifact-$MAJOR_SLUG.$MINOR_SLUG" production no-op
 
+# bulk imports: CSV from a file, NDJSON from stdin, with rejects (a
+# bad duration, more fields than the header, a numeric insertion_time)
+# that must not stop the rest.
+IMPORT_CSV=$(mktemp --suffix=.csv)
+IMPORT_REJECTS=$(mktemp)
+cat > $IMPORT_CSV <<EOF
+version_type,version,job_url,job_description,duration,result,misc,insertion_time
+changeset,$FAKE_GIT,http://example.com/import-$RANDOM_SLUG,imported,12,success,{},2015-06-01T12:00:00Z
+changeset,$FAKE_GIT,http://example.com/import-$RANDOM_SLUG,imported,not-a-number,success,{},
+changeset,$FAKE_GIT,http://example.com/import-$RANDOM_SLUG,imported,12,success,{},,extra
+EOF
+python ./history.py import build $IMPORT_CSV --rejects $IMPORT_REJECTS
+grep -q 'unexpected extra fields' $IMPORT_REJECTS
+rm -f $IMPORT_CSV
+(echo '{"thing_type": "filename", "thing_name": "artifact-'$MAJOR_SLUG.$MINOR_SLUG'", "version_type": "changeset", "version": "'$FAKE_GIT'", "environment": "qa", "servername": "server-import", "insertion_time": "2015-06-02T00:00:00Z"}'
+ echo '{"thing_type": "filename", "thing_name": "artifact-'$MAJOR_SLUG.$MINOR_SLUG'", "version_type": "changeset", "version": "'$FAKE_GIT'", "environment": "qa", "servername": "server-import", "insertion_time": 1433160000}'
+) | python ./history.py import deploy --rejects $IMPORT_REJECTS
+grep -q 'insertion_time must be an ISO 8601 timestamp' $IMPORT_REJECTS
+rm -f $IMPORT_REJECTS
+
+# bulk exports
+python ./history.py export build --where job_url=http://example.com/import-$RANDOM_SLUG
+python ./history.py export deploy --format ndjson --since 2015-06-01 --until 2015-07-01
+
+# rollups
+python ./history.py rollups --fold
+python ./history.py rollups --check --since 2015-06-01
+
 # read from all the things
 
 # builds
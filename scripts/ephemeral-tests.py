@@ -2,13 +2,26 @@
 import json
 import os
 import random
+import re
+import sys
+import tempfile
+import threading
+import time
 import urllib
 import urllib2
+import urlparse
 import unittest
 
 WEB_SERVER_HOST = os.getenv('WEB_SERVER_HOST', 'localhost')
 WEB_SERVER_PORT = os.getenv('WEB_SERVER_PORT', '5000')
 
+# the Test*Backend classes drive src/backend.py in this process, against
+# the web app's database.
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                   os.pardir, 'src')
+sys.path.insert(0, SRC)
+import backend
+
 class TestApi(object):
     server = 'http://{0}:{1}'.format(WEB_SERVER_HOST, WEB_SERVER_PORT)
     maxDiff = None
@@ -632,6 +645,348 @@ class TestApiV1Deploy(TestApiV1):
         del got_search.get('deploys')[0]['insertion_time']
         self.assertEqual(got_search.get('deploys')[0], expected_result)
 
+class TestEnvironmentCurrent(TestApiV1):
+
+    def test_latest_deploy_wins(self):
+        thing = 'current-' + TestApi.random_changeset()
+        old, new = TestApi.random_changeset(), TestApi.random_changeset()
+        for version, server in ((old, 'one.example.com'),
+                                (old, 'two.example.com'),
+                                (new, 'one.example.com'),
+                                (new, None)):
+            self.post_deploy('filename', thing, 'changeset', version,
+                             'system', server, {})
+
+        current = [d for d in self.get_encoded('/environment/current',
+                                               {'environment': 'system'})
+                   if d['thing_name'] == thing]
+        got = sorted((d['servername'], d['version']) for d in current)
+        self.assertEqual(got, [(None, new),
+                               ('one.example.com', new),
+                               ('two.example.com', old)])
+
+
+class TestSearchPaging(TestApiV1):
+
+    def test_build_search_pages(self):
+        job_url = 'http://example.com/paging-' + TestApi.random_changeset()
+        for duration in (11, 12, 13):
+            self.post_build('changeset', TestApi.random_changeset(), job_url,
+                            'search paging test', duration, 'success', {})
+
+        count = self.get_encoded('/build/search', {'job_url': job_url,
+                                                   'count_only': 'true'})
+        self.assertEqual(count, {'builds': 3})
+
+        first = self.get_encoded('/build/search', {'job_url': job_url,
+                                                   'order_by': 'duration',
+                                                   'limit': 2})
+        self.assertEqual([b['duration'] for b in first['builds']], [11, 12])
+        self.assertEqual(first['truncated'], ['builds'])
+
+        second = self.get_encoded('/build/search',
+                                  {'job_url': job_url,
+                                   'order_by': 'duration',
+                                   'limit': 2,
+                                   'after': first['next']['builds']})
+        self.assertEqual([b['duration'] for b in second['builds']], [13])
+        self.assertNotIn('truncated', second)
+
+
+class TestLineage(TestApiV1):
+
+    def test_changeset_to_deploy(self):
+        changeset = TestApi.random_changeset()
+        package = 'lineage-' + TestApi.random_changeset()[:10]
+        filename = 'lineage-' + TestApi.random_changeset()
+        build_id = int(self.post_build('changeset', changeset,
+                                       'http://example.com/lineage',
+                                       'lineage test', 15, 'success', {}))
+        # the artifact is versioned as a package, not the changeset.
+        self.post_artifact(filename, 'package', package, build_id, {})
+        self.post_deploy('filename', filename, 'package', package,
+                         'qa', None, {})
+
+        lineage = self.get_encoded('/lineage', {'version': changeset})
+        self.assertEqual(lineage['version'], changeset)
+        self.assertEqual([e['type'] for e in lineage['timeline']],
+                         ['build', 'artifact', 'deploy'])
+        self.assertEqual(lineage['timeline'][1]['build_id'], build_id)
+        self.assertEqual(lineage['timeline'][2]['thing_name'], filename)
+
+
+class TestStats(TestApiV1):
+
+    def test_build_and_deploy_stats(self):
+        result = 'stats-' + TestApi.random_changeset()[:10]
+        for duration in (10, 20, 30):
+            self.post_build('changeset', TestApi.random_changeset(),
+                            'http://example.com/stats', 'stats test',
+                            duration, result, {})
+        builds = [b for b in self.get_encoded('/stats/builds')
+                  if b['result'] == result]
+        self.assertEqual(len(builds), 1)
+        self.assertEqual(builds[0]['count'], 3)
+        self.assertEqual(builds[0]['avg_duration'], 20.0)
+        self.assertEqual(builds[0]['p50_duration'], 20.0)
+
+        thing = 'stats-' + TestApi.random_changeset()
+        for _ in range(2):
+            self.post_deploy('filename', thing, 'changeset',
+                             TestApi.random_changeset(), 'qa', None, {})
+        deploys = [d for d in self.get_encoded('/stats/deploys')
+                   if d['thing_name'] == thing]
+        self.assertEqual(deploys, [{'environment': 'qa',
+                                    'thing_type': 'filename',
+                                    'thing_name': thing,
+                                    'count': 2}])
+        self.assertEqual(len(self.get_encoded('/stats/deploys', {'top': 1})),
+                         1)
+
+    def test_deploy_hourly(self):
+        before = sum(h['count'] for h in
+                     self.get_encoded('/stats/deploys/hourly',
+                                      {'environment': 'system'}))
+        self.post_deploy('filename', 'hourly-' + TestApi.random_changeset(),
+                         'changeset', TestApi.random_changeset(), 'system',
+                         None, {})
+        hours = self.get_encoded('/stats/deploys/hourly',
+                                 {'environment': 'system'})
+        self.assertEqual(sum(h['count'] for h in hours), before + 1)
+        self.assertEqual(set(h['environment'] for h in hours), set(['system']))
+
+
+class TestListPagination(TestApiV1):
+
+    def test_build_pages(self):
+        for duration in (11, 12, 13):
+            self.post_build('changeset',
+                            TestApi.random_changeset(),
+                            'http://example.com/pages',
+                            'a paging test',
+                            duration,
+                            'true',
+                            {})
+        newest = self.get_encoded('/build/all', {'limit': 3})
+        self.assertEqual(len(newest), 3)
+
+        first = urllib2.urlopen(self.url_encode('/build/all', {'limit': 2}))
+        first_page = json.loads(first.read())
+        self.assertEqual(len(first_page), 2)
+        next_link = first.info().getheader('Link')
+        self.assertIn('rel="next"', next_link)
+
+        next_url = next_link[next_link.index('<') + 1:next_link.index('>')]
+        second_page = json.loads(urllib2.urlopen(next_url).read())
+        self.assertEqual(second_page[0], newest[2])
+
+        # after= alone: everything older than the cursor, unpaged
+        after = urlparse.parse_qs(
+            next_url[next_url.index('?') + 1:])['after'][0]
+        rest = urllib2.urlopen(self.url_encode('/build/all',
+                                               {'after': after}))
+        self.assertIsNone(rest.info().getheader('Link'))
+        self.assertEqual(json.loads(rest.read())[0], newest[2])
+
+    def test_deploy_stream(self):
+        resp = urllib2.urlopen(self.url_encode('/deploy/all', {'stream': 'true'}))
+        rows = [json.loads(line) for line in resp.read().splitlines()]
+        self.assertTrue(len(rows) > 0)
+        self.assertIn('deploy_id', rows[0])
+
+
+class TestBatch(TestApiV1):
+
+    def test_batch(self):
+        test_changeset = TestApi.random_changeset()
+        test_name = "test-batch-" + str(int(random.random() * 10000))
+        build_id = self.post_build('changeset',
+                                   test_changeset,
+                                   'http://example.com/batch',
+                                   'a batch test',
+                                   10,
+                                   'true',
+                                   {})
+        lines = [
+            {'type': 'artifact', 'filename': test_name,
+             'version_type': 'changeset', 'version': test_changeset,
+             'build_id': build_id, 'misc': {'comment': 'batched'}},
+            {'type': 'deploy', 'thing_type': 'filename', 'thing_name': test_name,
+             'version_type': 'changeset', 'version': test_changeset,
+             'environment': 'qa', 'servername': 'batch-1.example.com'},
+            {'type': 'deploy', 'thing_type': 'filename', 'thing_name': test_name,
+             'version_type': 'changeset', 'version': test_changeset,
+             'environment': 'qa'},
+            {'type': 'deploy', 'thing_type': 'filename', 'thing_name': test_name,
+             'environment': 'qa'},
+            {'type': 'promote', 'thing_type': 'filename', 'thing_name': test_name,
+             'environment': 'nowhere'},
+        ]
+        body = "\n".join(json.dumps(l) for l in lines) + "\nnot json\n"
+        got = json.loads(urllib2.urlopen(self.url + "/batch", body).read())
+
+        self.assertEqual([g['line'] for g in got], [1, 2, 3, 4, 5, 6])
+        for ok in got[:3]:
+            self.assertIn('id', ok)
+        for bad in got[3:]:
+            self.assertIn('error', bad)
+
+        deploys = self.get_encoded('/deploy', {'thing_name': test_name})
+        self.assertItemsEqual([d['deploy_id'] for d in deploys],
+                              [got[1]['id'], got[2]['id']])
+        artifact = self.get_encoded('/artifact/{0}'.format(got[0]['id']))
+        self.assertEqual(artifact[0]['misc'], {'comment': 'batched'})
+
+    def test_batch_database_errors(self):
+        # lines that parse, but that the database refuses, fail alone.
+        test_changeset = TestApi.random_changeset()
+        test_url = 'http://example.com/batch-errors-' + test_changeset
+        self.post_build('changeset', test_changeset,
+                        'http://example.com/batch', 'a batch test',
+                        10, 'true', {})
+        build = {'type': 'build', 'version_type': 'changeset',
+                 'version': TestApi.random_changeset(),
+                 'job_url': test_url,
+                 'job_description': 'a batch test', 'duration': 20,
+                 'result': 'true', 'misc': {}}
+        lines = [
+            build,
+            dict(build, version_type='package', version=test_changeset),
+            dict(build, duration=2 ** 40),
+            build,
+        ]
+        body = "\n".join(json.dumps(l) for l in lines)
+        got = json.loads(urllib2.urlopen(self.url + "/batch", body).read())
+
+        self.assertEqual([g['line'] for g in got], [1, 2, 3, 4])
+        self.assertIn('id', got[0])
+        self.assertIn('is not a package', got[1]['error'])
+        self.assertIn('out of range', got[2]['error'])
+        self.assertIn('id', got[3])
+        builds = self.get_encoded('/build', {'job_url': test_url})
+        self.assertItemsEqual([b['build_id'] for b in builds],
+                              [got[0]['id'], got[3]['id']])
+
+    def test_batch_limits(self):
+        build = {'type': 'build', 'version_type': 'changeset',
+                 'version': TestApi.random_changeset(),
+                 'job_url': 'http://example.com/batch-limits',
+                 'job_description': 'a batch test', 'duration': 20.0,
+                 'result': 'true', 'misc': {}}
+        lines = [build, dict(build, duration=3.7), dict(build, duration=True)]
+        body = "\n".join(json.dumps(l) for l in lines)
+        got = json.loads(urllib2.urlopen(self.url + "/batch", body).read())
+        self.assertIn('id', got[0])
+        self.assertEqual(got[1]['error'], 'duration must be an integer')
+        self.assertEqual(got[2]['error'], 'duration must be an integer')
+
+        with self.assertRaises(urllib2.HTTPError) as raised:
+            urllib2.urlopen(self.url + "/batch", "\n" * 10001)
+        self.assertEqual(raised.exception.code, 413)
+
+
+class TestWriteBehind(TestApiV1):
+
+    def test_queued_build(self):
+        job_url = 'http://example.com/write-behind-' + TestApi.random_changeset()
+        request = urllib2.Request(self.url + "/build", urllib.urlencode({
+            'version_type': 'changeset',
+            'version': TestApi.random_changeset(),
+            'job_url': job_url,
+            'job_description': 'a write-behind test',
+            'duration': 15,
+            'result': 'success',
+            'misc': json.dumps({})}), {'Prefer': 'respond-async'})
+        response = urllib2.urlopen(request)
+        self.assertEqual(response.getcode(), 202)
+        queued = json.loads(response.read())
+
+        for _ in xrange(50):
+            status = self.get_encoded('/ingest/status/{0}'.format(queued['seq']))
+            if status['state'] != 'pending':
+                break
+            time.sleep(0.1)
+        self.assertEqual(status['state'], 'done')
+        got = self.get_encoded('/build', {'job_url': job_url})
+        self.assertEqual([b['build_id'] for b in got], [status['id']])
+
+    def test_unknown_seq(self):
+        with self.assertRaises(urllib2.HTTPError) as raised:
+            urllib2.urlopen(self.url + '/ingest/status/0')
+        self.assertEqual(raised.exception.code, 404)
+
+
+class TestExport(TestApiV1):
+
+    def test_export_build(self):
+        test_url = 'http://example.com/export-' + TestApi.random_changeset()
+        build_id = self.post_build('changeset',
+                                   TestApi.random_changeset(),
+                                   test_url,
+                                   'an export test',
+                                   14,
+                                   'success',
+                                   {'foo': 'bar'})
+        query = urllib.urlencode({'format': 'ndjson', 'job_url': test_url})
+        response = urllib2.urlopen(self.url + '/export/build?' + query)
+        self.assertEqual(response.info().gettype(), 'application/x-ndjson')
+        rows = [json.loads(line) for line in response.read().splitlines()]
+        self.assertEqual([row['build_id'] for row in rows], [int(build_id)])
+        self.assertEqual(rows[0]['misc'], {'foo': 'bar'})
+
+        query = urllib.urlencode({'format': 'csv', 'job_url': test_url})
+        lines = urllib2.urlopen(self.url + '/export/build?' + query).read().splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertIn('job_url', lines[0].split(','))
+
+    def test_export_bad_filter(self):
+        with self.assertRaises(urllib2.HTTPError) as raised:
+            urllib2.urlopen(self.url + '/export/build?misc=x')
+        self.assertEqual(raised.exception.code, 400)
+
+    def test_export_bad_filter_value(self):
+        for query in ('build_id=abc', 'environment=nowhere'):
+            kind = 'build' if query.startswith('build') else 'deploy'
+            with self.assertRaises(urllib2.HTTPError) as raised:
+                urllib2.urlopen(self.url + '/export/' + kind + '?' + query)
+            self.assertEqual(raised.exception.code, 400)
+
+
+class TestConcurrentAssertions(TestApiV1):
+
+    def test_concurrent_new_dimensions(self):
+        # every thread asserts the same brand new version and thing,
+        # racing to create the dimension rows.
+        test_changeset = TestApi.random_changeset()
+        test_name = "test-race-" + str(int(random.random() * 10000))
+        errors = []
+
+        def hammer():
+            try:
+                for env in ('qa', 'production'):
+                    self.post_deploy('filename',
+                                     test_name,
+                                     'changeset',
+                                     test_changeset,
+                                     env,
+                                     'race-%d.example.com' % (int(random.random() * 4)),
+                                     {})
+            except Exception as ex:
+                errors.append(ex)
+
+        threads = [threading.Thread(target=hammer) for _ in xrange(16)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(errors, [])
+        got = self.get_encoded('/deploy', {'thing_name': test_name})
+        self.assertEqual(len(got), 32)
+        # one version row, one thing row, shared by all deploys.
+        self.assertEqual(len(set(d['version_id'] for d in got)), 1)
+
+
 class TestSearch(TestApiV1):
 
     # Tests for enhanced search features (wildcard, comparators)
@@ -709,5 +1064,275 @@ class TestSearch(TestApiV1):
 
         self.assertEqual(got_search['builds'][0]['duration'], 7)
 
+    def test_search_misc(self):
+        team = 'team-' + TestApi.random_changeset()
+        for timestamp in ('2017-01-01T00:00:00', '2017-02-01T00:00:00'):
+            self.post_deploy('config',
+                             'puppet',
+                             'changeset',
+                             TestApi.random_changeset(),
+                             'production',
+                             None,
+                             {'team': team, 'timestamp': timestamp,
+                              'owner': {'name': team}})
+
+        got_search = self.get_encoded('/deploy/search', {
+            'misc': '@>{"team": "%s"}' % team,
+        })
+        self.assertEqual(len(got_search['deploys']), 2)
+
+        got_search = self.get_encoded('/deploy/search', {
+            'misc.owner.name': team,
+            'misc.timestamp': '>=2017-01-15',
+        })
+        self.assertEqual(len(got_search['deploys']), 1)
+        self.assertEqual(got_search['deploys'][0]['misc']['timestamp'],
+                         '2017-02-01T00:00:00')
+
+class TestSearchTimeout(TestApiV1):
+
+    def active_searches(self, locker):
+        locker.cur.execute(
+            "SELECT count(*) FROM pg_stat_activity"
+            " WHERE state = 'active' AND pid <> pg_backend_pid()"
+            " AND query ILIKE '%%builds_view%%'")
+        return locker.cur.fetchone()[0]
+
+    def test_search_timeout(self):
+        settings = backend.load_settings(
+            os.path.join(SRC, 'env.properties.toml'))
+        self.post_build('changeset', TestApi.random_changeset(),
+                        'http://example.com/build', 'a test', 7, 'true', {})
+
+        # with build locked every build search waits until its
+        # statement_timeout, and there are more of them than search
+        # connections, so some also wait for a slot.
+        results = []
+        def search():
+            results.append(self.get_encoded('/build/search',
+                                            {'duration': '<8'}))
+        searches = [threading.Thread(target=search)
+                    for _ in range(settings.search_connections + 1)]
+        with backend.PgServer(settings) as locker:
+            locker.cur.execute(
+                'LOCK TABLE build IN ACCESS EXCLUSIVE MODE')
+            started = time.time()
+            for thread in searches:
+                thread.start()
+            for thread in searches:
+                thread.join()
+            elapsed = time.time() - started
+            self.assertEqual(self.active_searches(locker), 0)
+        self.assertLess(elapsed, settings.search_timeout + 3)
+        self.assertEqual(len(results), len(searches))
+        for result in results:
+            self.assertEqual(result, {'timed_out': ['builds']})
+
+        # the cancelled searches handed their slots and connections
+        # back, so the next one is answered.
+        got_search = self.get_encoded('/build/search', {'duration': '<8'})
+        self.assertNotIn('timed_out', got_search)
+        self.assertTrue(got_search['builds'])
+
+class TestBackend(unittest.TestCase):
+    properties = os.path.join(SRC, 'env.properties.toml')
+
+    def settings(self):
+        return backend.load_settings(self.properties)
+
+
+class TestPoolBackend(TestBackend):
+
+    def setUp(self):
+        self.pool = backend.ConnectionPool(self.settings().connection_string,
+                                           maxconn=2, timeout=0.2)
+
+    def tearDown(self):
+        self.pool.closeall()
+
+    def test_checkout_and_return(self):
+        conn = self.pool.getconn()
+        self.pool.putconn(conn)
+        # the idle connection is handed out again, not a new one
+        self.assertIs(self.pool.getconn(), conn)
+
+    def test_rolled_back_on_return(self):
+        conn = self.pool.getconn()
+        conn.cursor().execute("SELECT 1")
+        self.pool.putconn(conn)
+        self.assertEqual(conn.get_transaction_status(),
+                         backend.psycopg2.extensions.TRANSACTION_STATUS_IDLE)
+
+    def test_broken_connection_replaced(self):
+        conn = self.pool.getconn()
+        self.pool.putconn(conn, broken=True)
+        self.assertTrue(conn.closed)
+        self.assertIsNot(self.pool.getconn(), conn)
+
+    def test_exhausted(self):
+        held = [self.pool.getconn(), self.pool.getconn()]
+        started = time.time()
+        with self.assertRaises(backend.psycopg2.pool.PoolError):
+            self.pool.getconn()
+        self.assertGreaterEqual(time.time() - started, 0.2)
+
+        # a connection returned meanwhile goes to the waiting checkout
+        threading.Timer(0.05, self.pool.putconn, [held.pop()]).start()
+        self.assertIsNotNone(self.pool.getconn(timeout=5))
+
+    def test_pooled_server_returns_its_connection(self):
+        with backend.PgServer(self.properties, pooled=True) as server:
+            pool = server._pool
+            conn = server.conn
+        self.assertIn(conn, [idle for idle, _ in pool._idle])
+
+
+class TestDimensionCacheBackend(TestBackend):
+
+    @staticmethod
+    def counted(name, dimension):
+        return backend.prometheus_client.REGISTRY.get_sample_value(
+            'history_dimension_cache_{0}_total'.format(name),
+            {'dimension': dimension}) or 0
+
+    def test_hits_misses_and_eviction(self):
+        dimension = 'test-' + TestApi.random_changeset()
+        cache = backend.LRUCache(2)
+        a, b, c = [(dimension, 'db', key) for key in 'abc']
+        self.assertIsNone(cache.get(a))
+        cache.put(a, 1)
+        cache.put(b, 2)
+        self.assertEqual(cache.get(a), 1)
+        # b is now the least recently used, and makes way for c
+        cache.put(c, 3)
+        self.assertEqual(len(cache), 2)
+        self.assertIsNone(cache.get(b))
+        self.assertEqual(cache.get(c), 3)
+        self.assertEqual(self.counted('hits', dimension), 2)
+        self.assertEqual(self.counted('misses', dimension), 2)
+        self.assertEqual(self.counted('evictions', dimension), 1)
+
+    def test_ids_cached_on_commit_only(self):
+        version = ('changeset', TestApi.random_changeset())
+        hits = self.counted('hits', 'version')
+        with self.assertRaises(ValueError):
+            with backend.PgServer(self.properties) as server:
+                server.ensure_version(*version)
+                raise ValueError('roll back')
+        # rolled back: neither the row nor its id is kept
+        self.assertEqual(self.counted('hits', 'version'), hits)
+        with backend.PgServer(self.properties) as server:
+            version_id = server.ensure_version(*version)
+        self.assertEqual(self.counted('hits', 'version'), hits)
+        with backend.PgServer(self.properties) as server:
+            self.assertEqual(server.ensure_version(*version), version_id)
+        self.assertEqual(self.counted('hits', 'version'), hits + 1)
+
+
+class TestPreparedBackend(TestBackend):
+
+    @staticmethod
+    def executions():
+        return backend.prometheus_client.REGISTRY.get_sample_value(
+            'history_prepared_executions_total') or 0
+
+    @staticmethod
+    def prepare(server):
+        server.get_current_environment('qa')
+        return server.conn.prepared
+
+    def test_unpooled_statements_sent_as_is(self):
+        with backend.PgServer(self.properties) as server:
+            self.assertEqual(self.prepare(server), {})
+            server.cur.execute("SELECT count(*) FROM pg_prepared_statements")
+            self.assertEqual(server.cur.fetchone()[0], 0)
+
+    def test_pooled_prepared_once(self):
+        with backend.PgServer(self.properties, pooled=True) as server:
+            prepared = dict(self.prepare(server))
+            self.assertTrue(prepared)
+            executions = self.executions()
+            self.assertEqual(self.prepare(server), prepared)
+            self.assertEqual(self.executions(), executions + 1)
+            server.cur.execute("SELECT name FROM pg_prepared_statements")
+            self.assertLessEqual(
+                set(name for name, _ in prepared.values()),
+                set(row[0] for row in server.cur.fetchall()))
+
+    def test_prepared_again_after_reconnect(self):
+        pool = backend.get_pool(self.settings().connection_string)
+        with backend.PgServer(self.properties, pooled=True) as server:
+            self.prepare(server)
+            dead = server.conn
+        with backend.PgServer(self.properties) as admin:
+            admin.cur.execute("SELECT pg_terminate_backend(%s)",
+                              (dead.get_backend_pid(),))
+        # handed out again (the pool is LIFO), it fails and is dropped
+        with self.assertRaises(backend.psycopg2.Error):
+            with backend.PgServer(self.properties, pooled=True) as server:
+                self.assertIs(server.conn, dead)
+                self.prepare(server)
+        self.assertTrue(dead.closed)
+
+        # with the other idle connections held, the next one is new
+        held = [pool.getconn() for _ in list(pool._idle)]
+        try:
+            with backend.PgServer(self.properties, pooled=True) as server:
+                self.assertEqual(server.conn.prepared, {})
+                self.assertTrue(self.prepare(server))
+        finally:
+            for conn in held:
+                pool.putconn(conn)
+
+
+class TestReloadBackend(TestBackend):
+
+    def setUp(self):
+        handle, self.reloaded = tempfile.mkstemp(suffix='.toml')
+        os.close(handle)
+        self.write_properties(3)
+        self.pool = backend.get_pool(self.settings().connection_string,
+                                     maxconn=self.settings().pool_size)
+        self.saved = (self.pool.maxconn, self.pool.max_lifetime)
+
+    def tearDown(self):
+        self.pool.resize(*self.saved)
+        # or the next reload_settings would look for it
+        backend._SETTINGS.pop(self.reloaded, None)
+        os.remove(self.reloaded)
+
+    def write_properties(self, pool_size):
+        text = re.sub(r'(?m)^PGPOOLSIZE = .*$',
+                      'PGPOOLSIZE = {0}'.format(pool_size),
+                      open(self.properties).read())
+        with open(self.reloaded, 'w') as properties:
+            properties.write(text)
+
+    def test_pool_resized(self):
+        self.assertEqual(backend.load_settings(self.reloaded).pool_size, 3)
+        self.write_properties(self.saved[0] + 2)
+        backend.reload_settings()
+        self.assertEqual(backend.load_settings(self.reloaded).pool_size,
+                         self.saved[0] + 2)
+        self.assertEqual(self.pool.maxconn, self.saved[0] + 2)
+        # same connection string: the pool is resized, not replaced
+        self.assertIs(backend.get_pool(self.settings().connection_string),
+                      self.pool)
+
+    def test_pool_shrinks_as_connections_return(self):
+        pool = backend.ConnectionPool(self.settings().connection_string,
+                                      maxconn=3)
+        conns = [pool.getconn() for _ in range(3)]
+        pool.putconn(conns.pop())
+        pool.resize(1, pool.max_lifetime)
+        # the idle one goes at once, the others as they come back
+        self.assertEqual(len(pool._idle), 0)
+        pool.putconn(conns.pop())
+        self.assertEqual(len(pool._idle), 0)
+        pool.putconn(conns.pop())
+        self.assertEqual(len(pool._idle), 1)
+        pool.closeall()
+
+
 if __name__ == '__main__':
     unittest.main()
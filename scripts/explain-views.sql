@@ -0,0 +1,141 @@
+----------------------------------------------------------------------
+--- explain-views.sql
+--- EXPLAIN ANALYZE of the typical view queries over a synthetic data
+--- set. Run against a scratch database, once with schema/history.sql
+--- alone and once after the migrations, and compare:
+---
+---   psql -U historyserverrole scratchdb < schema/history.sql
+---   psql -U historyserverrole -v rows=1000000 scratchdb < scripts/explain-views.sql
+---
+--- `rows` (required) is the size of each fact table; fact rows are
+--- 90 seconds apart, so 1000000 of them span almost three years and,
+--- once migrated, land in monthly partitions rather than the default
+--- one. Everything happens inside a transaction that is rolled back,
+--- so the synthetic rows never stick around.
+
+\set ON_ERROR_STOP on
+
+BEGIN;
+
+-- after schema/006: a partition for every month the fact rows cover.
+SELECT to_regproc('ensure_monthly_partition') IS NOT NULL AS partitioned
+\gset
+\if :partitioned
+SELECT count(ensure_monthly_partition(parent, month::date))
+FROM unnest(ARRAY['build', 'artifact', 'promote', 'deploy']) AS parent,
+     generate_series(date_trunc('month', now() - :rows * interval '90 seconds'),
+                     now(), interval '1 month') AS month;
+\endif
+
+-- the triggers of later migrations (current_deploy, rollups) keep a
+-- few summary rows current; rewriting them a million times in one
+-- transaction takes far longer than the load itself, and none of the
+-- queries below read them.
+ALTER TABLE build DISABLE TRIGGER USER;
+ALTER TABLE artifact DISABLE TRIGGER USER;
+ALTER TABLE promote DISABLE TRIGGER USER;
+ALTER TABLE deploy DISABLE TRIGGER USER;
+
+INSERT INTO version (insertion_time, version_type, version)
+SELECT now(), 'changeset', md5(i::text)
+FROM generate_series(1, :rows / 10) AS i;
+
+INSERT INTO thing (insertion_time, thing_type, unique_thing_name)
+SELECT now(), 'dockerimage', 'image-' || i
+FROM generate_series(1, 1000) AS i;
+
+INSERT INTO servername (insertion_time, servername)
+SELECT now(), 'host-' || i
+FROM generate_series(1, 500) AS i;
+
+INSERT INTO versioned_thing (insertion_time, version_id, thing_id)
+SELECT now(), v.id, 1 + v.id % 1000
+FROM version v;
+
+INSERT INTO build (insertion_time, version_id, job_url, job_description,
+                   duration, result, misc)
+SELECT now() - i * interval '90 seconds', 1 + i % (:rows / 10),
+       'https://ci/job/' || i, 'job ' || i, i % 600, 'success', '{}'
+FROM generate_series(1, :rows) AS i;
+
+INSERT INTO artifact (insertion_time, versioned_thing_id, build_id, misc)
+SELECT now() - i * interval '90 seconds', 1 + i % (:rows / 10), i, '{}'
+FROM generate_series(1, :rows) AS i;
+
+INSERT INTO promote (insertion_time, thing_id, environment, misc)
+SELECT now() - i * interval '90 seconds', 1 + i % 1000, 'qa', '{}'
+FROM generate_series(1, :rows) AS i;
+
+-- every fifth deploy has no server.
+INSERT INTO deploy (insertion_time, versioned_thing_id, servername_id,
+                    environment, misc)
+SELECT now() - i * interval '90 seconds', 1 + i % (:rows / 10),
+       CASE WHEN i % 5 = 0 THEN NULL ELSE 1 + i % 500 END,
+       'production', '{}'
+FROM generate_series(1, :rows) AS i;
+
+ANALYZE;
+
+-- point lookups: no reason to sort anything.
+EXPLAIN ANALYZE SELECT * FROM deploys_view WHERE deploy_id = 4242;
+EXPLAIN ANALYZE SELECT * FROM artifacts_view WHERE artifact_id = 4242;
+EXPLAIN ANALYZE SELECT * FROM builds_view WHERE build_id = 4242;
+EXPLAIN ANALYZE SELECT * FROM promotes_view WHERE promote_id = 4242;
+
+-- filtered lists, ordered by the query.
+EXPLAIN ANALYZE SELECT * FROM deploys_view WHERE version_id = 42
+    ORDER BY insertion_time DESC, deploy_id DESC;
+EXPLAIN ANALYZE SELECT * FROM deploys_view WHERE servername IS NULL
+    ORDER BY insertion_time DESC, deploy_id DESC LIMIT 100;
+
+-- first /deploy/all and /build/all pages.
+EXPLAIN ANALYZE SELECT * FROM deploys_view
+    ORDER BY insertion_time DESC, deploy_id DESC LIMIT 100;
+EXPLAIN ANALYZE SELECT * FROM builds_view
+    ORDER BY insertion_time DESC, build_id DESC LIMIT 100;
+
+-- glob searches, as SQLClauseFactory writes them.
+EXPLAIN ANALYZE SELECT * FROM builds_view WHERE job_url LIKE '%/job/4242%'
+    ORDER BY insertion_time DESC, build_id DESC;
+EXPLAIN ANALYZE SELECT * FROM deploys_view WHERE thing_name LIKE 'image-42%'
+    ORDER BY insertion_time DESC, deploy_id DESC;
+EXPLAIN ANALYZE SELECT * FROM deploys_view WHERE servername LIKE '%st-42%'
+    ORDER BY insertion_time DESC, deploy_id DESC;
+EXPLAIN ANALYZE SELECT * FROM artifacts_view WHERE version LIKE 'abc%'
+    ORDER BY insertion_time DESC, artifact_id DESC;
+
+-- a dashboard's last 30 days: only recent partitions (schema/006).
+EXPLAIN ANALYZE SELECT * FROM deploys_view
+    WHERE insertion_time > now() - interval '30 days'
+    ORDER BY insertion_time DESC, deploy_id DESC;
+EXPLAIN ANALYZE SELECT * FROM builds_view
+    WHERE insertion_time >= date_trunc('month', now() - interval '1 year')
+      AND insertion_time < date_trunc('month', now() - interval '11 months')
+    ORDER BY insertion_time DESC, build_id DESC LIMIT 100;
+
+-- /environment/current (schema/005), backfilled as the migration does:
+-- each current row should probe one deploy partition, not all of them.
+SELECT to_regclass('current_deploy') IS NOT NULL AS current_deploys
+\gset
+\if :current_deploys
+INSERT INTO current_deploy (environment, thing_id, servername_id,
+                            versioned_thing_id, deploy_id, insertion_time)
+SELECT DISTINCT ON (deploy.environment,
+                    versioned_thing.thing_id,
+                    COALESCE(deploy.servername_id, 0))
+       deploy.environment, versioned_thing.thing_id, deploy.servername_id,
+       deploy.versioned_thing_id, deploy.id, deploy.insertion_time
+FROM deploy
+INNER JOIN versioned_thing ON versioned_thing.id = deploy.versioned_thing_id
+ORDER BY deploy.environment, versioned_thing.thing_id,
+         COALESCE(deploy.servername_id, 0), deploy.id DESC;
+ANALYZE current_deploy;
+EXPLAIN ANALYZE SELECT deploys_view.* FROM current_deploy
+    INNER JOIN deploys_view
+          ON deploys_view.deploy_id = current_deploy.deploy_id
+         AND deploys_view.insertion_time = current_deploy.insertion_time
+    WHERE current_deploy.environment = 'production'
+    ORDER BY deploys_view.thing_name, deploys_view.servername;
+\endif
+
+ROLLBACK;
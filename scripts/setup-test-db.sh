@@ -16,6 +16,8 @@ set +e
 psql -h $PGHOST -U ${PGROLE} -c 'create database historyserverdb'
 psql -h $PGHOST -U ${PGROLE} -c "create user historyserverrole with password 'mysecretpassword'"
 psql -h $PGHOST -U ${PGROLE} -c 'grant all privileges on database historyserverdb to historyserverrole'
+# extensions the migrations use, which historyserverrole can't create
+psql -h $PGHOST -U ${PGROLE} historyserverdb -c 'create extension if not exists pg_trgm'
 
 # unwind any applied migrations
 ./unmigrate-db.sh
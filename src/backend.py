@@ -3,11 +3,22 @@ Backend for the history-server system; interacts with the SQL
 database
 """
 
+import collections
+import cStringIO
+import datetime
+import itertools
+import json
 import logging
 import os
+import re
+import threading
+import time
 
 import psycopg2
+import psycopg2.extensions
 import psycopg2.extras
+import psycopg2.pool
+import prometheus_client
 import pytoml
 
 
@@ -31,25 +42,610 @@ class VersionType(object):
     PACKAGE = 'package'
     CHANGESET = 'changeset'
 
+class Settings(collections.namedtuple('Settings', ('env',
+                                                   'host',
+                                                   'dbname',
+                                                   'user',
+                                                   'password',
+                                                   'pool_size',
+                                                   'pool_lifetime',
+                                                   'search_timeout',
+                                                   'search_connections',
+                                                   'export_connections',
+                                                   'export_timeout',
+                                                   'search_limit',
+                                                   'stream_itersize',
+                                                   'ingest_log',
+                                                   'ingest_max_pending',
+                                                   'ingest_batch_size'))):
+    """
+    Immutable, fully resolved database settings.
+
+    Resolution order, last wins: the [default] table of the toml file,
+    the table named by $WEB_ENV, then the PG* environment variables.
+    """
+    __slots__ = ()
+
+    @classmethod
+    def from_file(cls, filename):
+        data = pytoml.loads(open(filename).read())
+        env = os.getenv('WEB_ENV', 'default')
+
+        def resolve(key, fallback=None):
+            value = data['default'].get(key, fallback)
+            value = data[env].get(key, value)
+            return os.getenv(key, value)
+
+        return cls(env=env,
+                   host=resolve('PGHOST'),
+                   dbname=resolve('PGDATABASE'),
+                   user=resolve('PGUSER'),
+                   password=resolve('PGPASSWORD'),
+                   pool_size=int(resolve('PGPOOLSIZE', 10)),
+                   pool_lifetime=int(resolve('PGPOOLLIFETIME', 3600)),
+                   search_timeout=float(resolve('SEARCHTIMEOUT', 5)),
+                   search_connections=int(resolve('SEARCHCONNECTIONS', 5)),
+                   export_connections=int(resolve('EXPORTCONNECTIONS', 2)),
+                   export_timeout=float(resolve('EXPORTTIMEOUT', 3600)),
+                   search_limit=int(resolve('SEARCHLIMIT', 1000)),
+                   stream_itersize=int(resolve('STREAMITERSIZE', 2000)),
+                   ingest_log=resolve('INGESTLOG', ''),
+                   ingest_max_pending=int(resolve('INGESTMAXPENDING', 10000)),
+                   ingest_batch_size=int(resolve('INGESTBATCHSIZE', 500)))
+
+    @property
+    def connection_string(self):
+        return "host={0} dbname={1} user={2} password={3}".format(
+            self.host, self.dbname, self.user, self.password)
+
+_SETTINGS = {}
+_SETTINGS_LOCK = threading.Lock()
+
+def load_settings(filename='env.properties.toml'):
+    """
+    Returns the Settings for `filename`, parsing it only the first time
+    it is asked for in this process.
+    """
+    settings = _SETTINGS.get(filename)
+    if settings is None:
+        with _SETTINGS_LOCK:
+            settings = _SETTINGS.get(filename)
+            if settings is None:
+                settings = Settings.from_file(filename)
+                _SETTINGS[filename] = settings
+    return settings
+
+def reload_settings(*_):
+    """
+    Re-resolves every cached Settings from disk and the environment;
+    suitable as a SIGHUP handler. Pools whose connection string changed
+    are drained so new requests connect with the new settings; the
+    others are resized to a changed PGPOOLSIZE or PGPOOLLIFETIME. The
+    dimension ids cached so far are forgotten.
+    """
+    DIMENSION_CACHE.clear()
+    with _SETTINGS_LOCK:
+        for filename, old in _SETTINGS.items():
+            new = Settings.from_file(filename)
+            _SETTINGS[filename] = new
+            if new.connection_string != old.connection_string:
+                with _POOLS_LOCK:
+                    pool = _POOLS.pop(old.connection_string, None)
+                if pool is not None:
+                    pool.closeall()
+            elif (new.pool_size, new.pool_lifetime) != (old.pool_size,
+                                                        old.pool_lifetime):
+                with _POOLS_LOCK:
+                    pool = _POOLS.get(new.connection_string)
+                if pool is not None:
+                    pool.resize(new.pool_size, new.pool_lifetime)
+                    LOGGER.info("resized the pool to %d connections, "
+                                "%ds lifetime",
+                                new.pool_size, new.pool_lifetime)
+            LOGGER.info("reloaded settings from %s", filename)
+
+class PoolTimeout(psycopg2.pool.PoolError):
+    """
+    Raised when no pooled connection became free within the checkout
+    timeout.
+    """
+    pass
+
+class PreparingConnection(psycopg2.extensions.connection):
+    """
+    psycopg2 connection that remembers the statements PREPAREd on it;
+    see PgServer._execute_prepared. Prepared statements live as long as
+    the database session, so the registry lives on the connection.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(PreparingConnection, self).__init__(*args, **kwargs)
+        # query text -> (statement name, parameter names)
+        self.prepared = {}
+
+PREPARED_STATEMENTS = prometheus_client.Counter(
+    'history_prepared_statements_total',
+    'Statements PREPAREd on a database connection')
+PREPARED_EXECUTIONS = prometheus_client.Counter(
+    'history_prepared_executions_total',
+    'EXECUTEs of a statement already prepared on its connection')
+
+# psycopg2's placeholders; %% is a literal percent sign.
+_PLACEHOLDER = re.compile(r'%\((\w+)\)s|%s|%%')
+
+def _numbered_placeholders(query):
+    """
+    Rewrites the psycopg2 placeholders of `query` as PREPARE's $1,
+    $2...; a named placeholder used twice keeps its number.
+
+    Returns (query, names): the parameter name behind each number, or
+    None for positional ones.
+    """
+    names = []
+
+    def number(match):
+        if match.group(0) == '%%':
+            return '%'
+        name = match.group(1)
+        if name is None or name not in names:
+            names.append(name)
+            return '${0}'.format(len(names))
+        return '${0}'.format(names.index(name) + 1)
+
+    return _PLACEHOLDER.sub(number, query), names
+
+class ConnectionPool(object):
+    """
+    Bounded, thread-safe pool of psycopg2 connections, shared by every
+    PgServer in the process that asks for `pooled=True`.
+
+    - checkout blocks (up to `timeout` seconds) once `maxconn`
+      connections are handed out.
+    - connections idle for longer than `check_idle` seconds are pinged
+      before being handed out; dead ones are replaced.
+    - connections older than `max_lifetime` seconds are closed on
+      return or checkout and replaced by fresh ones.
+    - a connection returned in the middle of a transaction is rolled
+      back before it is made available again.
+    """
+
+    def __init__(self, connection_string, maxconn=10, max_lifetime=3600,
+                 timeout=30, check_idle=30):
+        self._connection_string = connection_string
+        self.maxconn = maxconn
+        self.max_lifetime = max_lifetime
+        self.timeout = timeout
+        self.check_idle = check_idle
+
+        self._lock = threading.Condition(threading.Lock())
+        # idle connections; LIFO so the hot ones stay hot.
+        self._idle = []
+        # id(conn) -> time the connection was opened
+        self._born = {}
+        self._used = 0
+        self._closed = False
+
+    def _connect(self):
+        conn = psycopg2.connect(self._connection_string,
+                                connection_factory=PreparingConnection)
+        self._born[id(conn)] = time.time()
+        return conn
+
+    def _discard(self, conn):
+        self._born.pop(id(conn), None)
+        if not conn.closed:
+            try:
+                conn.close()
+            except psycopg2.Error:
+                pass
+
+    def _expired(self, conn):
+        return time.time() - self._born.get(id(conn), 0) > self.max_lifetime
+
+    def _healthy(self, conn, idle_since):
+        """
+        Cheap checks first; only round-trip to the server when the
+        connection has sat idle long enough that it may have been cut.
+        """
+        if conn.closed or self._expired(conn):
+            return False
+        if time.time() - idle_since < self.check_idle:
+            return True
+        try:
+            cur = conn.cursor()
+            cur.execute("SELECT 1")
+            cur.close()
+            conn.rollback()
+        except psycopg2.Error:
+            return False
+        return True
+
+    def getconn(self, timeout=None):
+        """
+        Check a connection out of the pool, connecting a new one if
+        there is room. Raises PoolTimeout if the pool stays exhausted
+        for `timeout` seconds (the pool's own timeout by default).
+        """
+        if timeout is None:
+            timeout = self.timeout
+        deadline = time.time() + timeout
+        with self._lock:
+            while not self._idle and self._used >= self.maxconn:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise PoolTimeout(
+                        "no connection available after {0}s".format(
+                            timeout))
+                self._lock.wait(remaining)
+            self._used += 1
+            idle = self._idle.pop() if self._idle else None
+
+        try:
+            if idle is not None:
+                conn, idle_since = idle
+                if self._healthy(conn, idle_since):
+                    return conn
+                LOGGER.debug("recycling pooled connection")
+                self._discard(conn)
+            return self._connect()
+        except Exception:
+            with self._lock:
+                self._used -= 1
+                self._lock.notify()
+            raise
+
+    def putconn(self, conn, broken=False):
+        """
+        Return `conn` to the pool. Any open transaction is rolled back;
+        broken, closed or expired connections, and any returned after
+        closeall(), are closed instead of being reused.
+        """
+        if not broken and not conn.closed:
+            status = conn.get_transaction_status()
+            if status == psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN:
+                broken = True
+            elif status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                try:
+                    conn.rollback()
+                except psycopg2.Error:
+                    broken = True
+
+        if broken or conn.closed or self._closed or self._expired(conn):
+            self._discard(conn)
+            conn = None
+
+        with self._lock:
+            # more connections than maxconn after a resize() shrank it
+            surplus = self._used + len(self._idle) > self.maxconn
+            self._used -= 1
+            if conn is not None and not surplus:
+                self._idle.append((conn, time.time()))
+                conn = None
+            self._lock.notify()
+        if conn is not None:
+            self._discard(conn)
+
+    def resize(self, maxconn, max_lifetime):
+        """
+        Change maxconn and max_lifetime in place. Growing lets waiting
+        checkouts through at once; shrinking closes idle connections
+        beyond the new size now, and checked-out ones as they come back.
+        """
+        with self._lock:
+            self.maxconn = maxconn
+            self.max_lifetime = max_lifetime
+            excess = max(0, self._used + len(self._idle) - maxconn)
+            surplus = self._idle[:min(excess, len(self._idle))]
+            del self._idle[:len(surplus)]
+            self._lock.notify_all()
+        for conn, _ in surplus:
+            self._discard(conn)
+
+    def closeall(self):
+        """
+        Close every idle connection, and every checked-out one as it
+        comes back; for a pool that is being retired.
+        """
+        with self._lock:
+            self._closed = True
+            idle, self._idle = self._idle, []
+        for conn, _ in idle:
+            self._discard(conn)
+
+
+_POOLS = {}
+_POOLS_LOCK = threading.Lock()
+
+def get_pool(connection_string, **kwargs):
+    """
+    Returns the process-wide pool for `connection_string`, creating it
+    on first use.
+    """
+    with _POOLS_LOCK:
+        pool = _POOLS.get(connection_string)
+        if pool is None:
+            pool = ConnectionPool(connection_string, **kwargs)
+            _POOLS[connection_string] = pool
+        return pool
+
+class LRUCache(object):
+    """
+    Bounded, thread-safe least-recently-used mapping.
+
+    Keys are tuples whose first element names the dimension; it labels
+    the hit/miss/eviction counters. The second is the connection string
+    of the database the id came from.
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._data = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            try:
+                value = self._data.pop(key)
+            except KeyError:
+                DIMENSION_CACHE_MISSES.labels(key[0]).inc()
+                return None
+            # re-insert as most recently used.
+            self._data[key] = value
+        DIMENSION_CACHE_HITS.labels(key[0]).inc()
+        return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = value
+            while len(self._data) > self.maxsize:
+                evicted, _ = self._data.popitem(last=False)
+                DIMENSION_CACHE_EVICTIONS.labels(evicted[0]).inc()
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+DIMENSION_CACHE_HITS = prometheus_client.Counter(
+    'history_dimension_cache_hits_total',
+    'Dimension id lookups answered from the in-process cache',
+    ['dimension'])
+DIMENSION_CACHE_MISSES = prometheus_client.Counter(
+    'history_dimension_cache_misses_total',
+    'Dimension id lookups that had to go to the database',
+    ['dimension'])
+DIMENSION_CACHE_EVICTIONS = prometheus_client.Counter(
+    'history_dimension_cache_evictions_total',
+    'Dimension ids evicted from the in-process cache',
+    ['dimension'])
+
+# version, thing, servername and versioned_thing rows are never
+# updated or deleted, so an id, once committed, never goes stale; short
+# of the schema being dropped and reloaded, after which a SIGHUP (see
+# reload_settings) empties the cache.
+DIMENSION_CACHE = LRUCache(10000)
+
+# One dimension (version, thing, ...) resolved inside a WITH clause:
+# look it up, and only on a miss insert it. ON CONFLICT DO NOTHING
+# makes a concurrent insert of the same row harmless; in that case
+# `{name}` comes back empty and the caller simply re-runs the
+# statement, whose new snapshot will see the winner's row.
+_UPSERT_CTE = """
+{name}_sel AS (
+    SELECT id FROM {table} WHERE {where}),
+{name}_ins AS (
+    INSERT INTO {table} (insertion_time, {columns})
+    SELECT now(), {values} {source}
+    WHERE NOT EXISTS (SELECT 1 FROM {name}_sel)
+    ON CONFLICT DO NOTHING
+    RETURNING id),
+{name} AS (
+    SELECT id FROM {name}_sel UNION ALL SELECT id FROM {name}_ins)"""
+
+_RECORD_TEMPLATE = """
+def __init__(self, {args}):
+    {assignments}
+"""
+
+# ISO 8601 timestamps, as history.py import takes them.
+_ISO_TIMESTAMP = re.compile(
+    r'^(\d{4})-(\d{2})-(\d{2})'
+    r'(?:[T ](\d{2}):(\d{2})(?::(\d{2})(?:\.(\d{1,6})\d*)?)?)?'
+    r'\s*(Z|[+-]\d{2}(?::?\d{2})?)?$')
+
+def _import_timestamp(text):
+    """
+    `text`, an ISO 8601 timestamp (UTC if it gives no offset), as a
+    timestamptz literal; ValueError if it is not one. Checked here so
+    a bad one rejects its row rather than failing the whole COPY.
+    """
+    # NDJSON rows may give a number, a list...
+    if not isinstance(text, basestring):
+        raise ValueError('insertion_time must be an ISO 8601 timestamp')
+    match = _ISO_TIMESTAMP.match(text.strip())
+    if match is None:
+        raise ValueError('insertion_time must be an ISO 8601 timestamp')
+    year, month, day, hour, minute, second, fraction, offset = match.groups()
+    try:
+        moment = datetime.datetime(int(year), int(month), int(day),
+                                   int(hour or 0), int(minute or 0),
+                                   int(second or 0),
+                                   int((fraction or '0').ljust(6, '0')))
+    except ValueError as ex:
+        raise ValueError('insertion_time: {0}'.format(ex))
+    if offset in (None, 'Z'):
+        offset = '+00:00'
+    else:
+        digits = offset[1:].replace(':', '')
+        if int(digits[:2]) > 15 or int(digits[2:] or 0) > 59:
+            raise ValueError('insertion_time: bad UTC offset')
+        offset = '{0}{1}:{2}'.format(offset[0], digits[:2],
+                                     digits[2:] or '00')
+    return moment.isoformat(' ') + offset
+
+def record_type(name, columns, optional=()):
+    """
+    A class for rows of `columns`: the columns are its __slots__, so a
+    record holds the row's values and nothing else (no per-row dict),
+    and marshal() reads them as attributes. _asdict() makes the dict
+    only where one is needed (json.dumps), leaving out any `optional`
+    column that is None.
+
+    record(*row) and record._make(row) build one from a row in column
+    order.
+    """
+    columns = tuple(columns)
+    namespace = {}
+    # one assignment per column, like namedtuple's generated __new__;
+    # a loop over setattr costs twice as much per row.
+    exec _RECORD_TEMPLATE.format(
+        args=', '.join(columns),
+        assignments='; '.join('self.{0} = {0}'.format(column)
+                              for column in columns)) in namespace
+
+    def _make(cls, row):
+        return cls(*row)
+
+    def _asdict(self):
+        result = dict((column, getattr(self, column)) for column in columns)
+        for column in optional:
+            if result[column] is None:
+                del result[column]
+        return result
+
+    def __repr__(self):
+        return '{0}({1})'.format(name, ', '.join(
+            '{0}={1!r}'.format(column, getattr(self, column))
+            for column in columns))
+
+    return type(name, (object,), {'__slots__': columns,
+                                  '_fields': columns,
+                                  '__init__': namespace['__init__'],
+                                  '_make': classmethod(_make),
+                                  '_asdict': _asdict,
+                                  '__repr__': __repr__})
+
 class SQLClauseFactory(object):
 
+    # View columns that are plain text columns of a base table. LIKE on
+    # them is left uncast, so it reaches the base column and its
+    # trigram index (schema/003); anything else (enums, ids, times,
+    # misc) has to be cast to text first.
+    text_columns = frozenset([
+        'job_url',
+        'job_description',
+        'result',
+        'unique_thing_name',
+        'thing_name',
+        'version',
+        'servername'])
+
     @staticmethod
-    def generate_where(query_args):
+    def _json_value(value):
+        """
+        misc.<path>==value compares against the JSON scalar `value`
+        spells ("true", "3", '"3"'); anything else is a string.
+        """
+        try:
+            return json.loads(value)
+        except ValueError:
+            return value
+
+    @classmethod
+    def _json_where(cls, column, path, condition, value):
+        """
+        Predicate on the value at `path` (dotted) inside a jsonb column.
+
+        Equality becomes containment, which the jsonb_path_ops indexes
+        answer; comparisons and globs work on the value as text, with
+        the same ->> expression the expression indexes are built on.
+        """
+        keys = path.split('.')
+        if condition == '=':
+            document = cls._json_value(value)
+            for key in reversed(keys):
+                document = {key: document}
+            return ("{0} @> %s".format(column),
+                    [psycopg2.extras.Json(document)])
+        if len(keys) == 1:
+            return ("{0} ->> %s {1} %s".format(column, condition),
+                    [keys[0], value])
+        return ("{0} #>> %s {1} %s".format(column, condition),
+                [keys, value])
+
+    @classmethod
+    def generate_where(cls, query_args):
         wheres = []
         where_params = []
         if len(query_args) > 0:
             for k, val in query_args.iteritems():
+                column, _, path = k.partition('.')
                 for v in val:
-                    condition = '='
-                    if v.get('condition'):
-                        condition = v.get('condition')
-                    if v.get('attr_alias'):
-                        k = v.get('attr_alias')
-                    wheres.append("{0} {1} %s".format(k, v.get('condition')))
+                    condition = v.get('condition') or '='
+                    if path:
+                        where, params = cls._json_where(
+                            column, path, condition, v.get('value'))
+                        wheres.append(where)
+                        where_params.extend(params)
+                        continue
+                    if condition == '@>':
+                        wheres.append("{0} @> %s".format(column))
+                        where_params.append(
+                            psycopg2.extras.Json(v.get('value')))
+                        continue
+                    target = column
+                    if condition == 'LIKE' and k not in cls.text_columns:
+                        target = column + '::text'
+                    wheres.append("{0} {1} %s".format(target, condition))
                     where_params.append(v.get('value'))
-        where = 'WHERE ' + 'AND '.join(wheres)
+        where = 'WHERE ' + ' AND '.join(wheres)
         return where, tuple(where_params)
 
+    # Columns search results cannot be ordered by: keyset paging needs
+    # a total order, and servername can be NULL.
+    unorderable_columns = frozenset(['misc', 'servername'])
+
+    @classmethod
+    def generate_order(cls, order_by, id_column, after=None):
+        """
+        ORDER BY for `order_by`, a column name, descending if it starts
+        with '-' (default '-insertion_time'); ties are broken on
+        `id_column` in the same direction. With `after`, the
+        (value, id) of the last row of the previous page, also a
+        condition selecting only the rows that follow it.
+
+        Returns (condition or None, params, order clause).
+        """
+        order_by = order_by or '-insertion_time'
+        column = order_by.lstrip('-')
+        if column in cls.unorderable_columns:
+            raise ValueError("cannot order by " + column)
+        descending = order_by.startswith('-')
+        order = " ORDER BY {0} {2}, {1} {2}".format(
+            column, id_column, 'DESC' if descending else 'ASC')
+        if after is None:
+            return None, (), order
+        comparison = '<' if descending else '>'
+        condition = "({0}, {1}) {2} (%s, %s)".format(column, id_column,
+                                                     comparison)
+        params = tuple(after)
+        if column == 'insertion_time':
+            # implied, but lets the planner skip partitions.
+            condition = "insertion_time {0}= %s AND {1}".format(comparison,
+                                                              condition)
+            params = (after[0],) + params
+        return condition, params, order
+
+    @staticmethod
+    def generate_count(query):
+        """
+        Wraps `query` to count its rows instead of returning them.
+        """
+        return "SELECT count(*) FROM ({0}) AS matches".format(query)
+
 class PgServer(object):
     """
     The "model" class in an MVC system. Provides an interface between
@@ -63,59 +659,31 @@ class PgServer(object):
     # Organization: each table gets a section in the class, delimited
     # by a comment.
 
-    def __init__(self, filename='env.properties.toml'):
+    def __init__(self, settings='env.properties.toml', pooled=False,
+                 checkout_timeout=None):
         """
-        Pick out the required variables from the env.properties toml file.
-        """
-        data = pytoml.loads(open(filename).read())
-
-        PGHOST = 'PGHOST'
-        PGDATABASE = 'PGDATABASE'
-        PGUSER = 'PGUSER'
-        PGPASSWORD = 'PGPASSWORD'
-
-        self._host = data['default'][PGHOST]
-        self._dbname = data['default'][PGDATABASE]
-        self._pguser = data['default'][PGUSER]
-        self._pgpassword = data['default'][PGPASSWORD]
-
-        # overlay the above settings with the local environment
-        self._env = os.getenv('WEB_ENV', 'default')
-        self._host = data[self._env].get(PGHOST, self._host)
-        self._dbname = data[self._env].get(PGDATABASE, self._dbname)
-        self._pguser = data[self._env].get(PGUSER, self._pguser)
-        self._pgpassword = data[self._env].get(PGPASSWORD, self._pgpassword)
-
-        # now overlay with any environment variables that are set.
-        self._host = os.getenv(PGHOST, self._host)
-        self._dbname = os.getenv(PGDATABASE, self._dbname)
-        self._pguser = os.getenv(PGUSER, self._pguser)
-        self._pgpassword = os.getenv(PGPASSWORD, self._pgpassword)
+        `settings` is a Settings, or the name of an env.properties toml
+        file to load them from (parsed once per process).
 
-        self._connection_string = "host={0} dbname={1} user={2} password={3}".format(
-            self._host, self._dbname, self._pguser, self._pgpassword)
-
-        # SELECT strings - note the trailing space!!
-
-        self._artifact_select = "SELECT {0} FROM artifacts_view ".format(
-            ", ".join(self.wanted_artifact_columns))
-
-        self._deploy_select =  "SELECT {0} FROM deploys_view ".format(
-            ", ".join(self.wanted_deploy_columns))
-
-        self._build_select = "SELECT {0} FROM builds_view ".format(
-            ", ".join(self.wanted_build_columns))
-
-        self._promote_select = "SELECT {0} FROM promotes_view ".format(
-            ", ".join(self.wanted_promote_columns))
-
-        self._versioned_select = "SELECT {0} from versioned_things_view".format(
-            ", ".join(self.wanted_versioned_columns))
+        If `pooled` is set, connections are checked out of (and returned
+        to) a process-wide ConnectionPool rather than opened and closed
+        for every transaction; the checkout waits up to
+        `checkout_timeout` seconds (the pool's default if None) for a
+        free connection.
+        """
+        if not isinstance(settings, Settings):
+            settings = load_settings(settings)
+        self._settings = settings
+        self._pooled = pooled
+        self._checkout_timeout = checkout_timeout
 
-        # SQL connection
+        # SQL connection, and the pool it was checked out of
         self.conn = None
+        self._pool = None
         # SQL cursor
         self.cur = None
+        # dimension ids resolved in this transaction; cached on commit.
+        self._resolved = []
 
     # Fodder for the context manager.
     def start(self):
@@ -146,21 +714,52 @@ class PgServer(object):
         # letting it fall out of scope) will result in an implicit
         # rollback.
 
+        settings = self._settings
         LOGGER.debug("host={0} dbname={1} user={2}".format(
-            self._host, self._dbname, self._pguser))
-        self.conn = psycopg2.connect(self._connection_string)
+            settings.host, settings.dbname, settings.user))
+        if self._pooled:
+            # kept, so the connection goes back to this pool even if a
+            # reload replaces it meanwhile.
+            self._pool = get_pool(settings.connection_string,
+                                  maxconn=settings.pool_size,
+                                  max_lifetime=settings.pool_lifetime)
+            self.conn = self._pool.getconn(self._checkout_timeout)
+        else:
+            self.conn = psycopg2.connect(
+                settings.connection_string,
+                connection_factory=PreparingConnection)
         self.cur = self.conn.cursor()
         LOGGER.debug("connecting to database")
 
-    def end(self):
+    def end(self, failed=False):
         """
         Called by the context manager.
 
-        Implicitly commits, then ends a database transaction.
-        """
-
-        self.conn.commit()
-        self.cur.close()
+        Implicitly commits (or, if `failed`, rolls back), then ends a
+        database transaction. The connection is closed, or handed back
+        to the pool when pooled.
+        """
+        broken = False
+        try:
+            if failed:
+                self.conn.rollback()
+            else:
+                self.conn.commit()
+                for key, value in self._resolved:
+                    DIMENSION_CACHE.put(key, value)
+            self.cur.close()
+        except psycopg2.Error:
+            broken = True
+            raise
+        finally:
+            if self._pooled:
+                self._pool.putconn(self.conn, broken=broken)
+            else:
+                self.conn.close()
+            self.conn = None
+            self._pool = None
+            self.cur = None
+            self._resolved = []
         LOGGER.debug("disconnected from  database")
 
 
@@ -168,25 +767,284 @@ class PgServer(object):
         self.start()
         return self
 
-    def __exit__(self, _1, _2, _3):
-        self.end()
+    def __exit__(self, exc_type, _2, _3):
+        self.end(failed=exc_type is not None)
 
-    def _process_getter(self, ordered_column_list):
+    @staticmethod
+    def _iter_getter(record, rows):
         """
-        Converts the cursor's results into a list of dicts indexed by the
-        `ordered_column_list`. Further, if a key 'insertion_time'
-        exists in the dict, we assume it's a postgres datetime object
-        and convert it to ISO format.
+        Lazily converts `rows` into `record`s (see record_type).
+
+        Timestamps stay the timezone-aware datetimes psycopg2 hands us;
+        serializing them is the caller's business, and done once.
         """
-        results = []
-        for result in self.cur.fetchall():
-            temp = dict(zip(tuple(ordered_column_list), result))
-            # courtesy DRY.
-            if temp.has_key('insertion_time'):
-                temp['insertion_time'] = temp['insertion_time'].isoformat()
+        return itertools.starmap(record, rows)
 
-            results.append(temp)
-        return results
+    def _process_getter(self, record):
+        """
+        Converts the cursor's results into a list of `record`s; see
+        _iter_getter.
+        """
+        return list(itertools.starmap(record, self.cur.fetchall()))
+
+    # named cursors need names unique within the connection.
+    _stream_names = itertools.count()
+
+    def _stream(self, query, params=(), itersize=None):
+        """
+        Runs `query` on a named (server-side) cursor and yields its raw
+        rows, fetched `itersize` (default: the stream_itersize setting)
+        at a time, so the result set never has to fit in memory. Must
+        be consumed inside the transaction.
+        """
+        cur = self.conn.cursor(
+            name='history_stream_{0}'.format(next(self._stream_names)))
+        cur.itersize = itersize or self._settings.stream_itersize
+        try:
+            cur.execute(query, params)
+            for row in cur:
+                yield row
+        finally:
+            cur.close()
+
+    @staticmethod
+    def _order_newest(id_column, time_column='insertion_time'):
+        """
+        The views are unordered; anything returning several rows sorts
+        them newest first with this clause (note the leading space).
+        """
+        return " ORDER BY {0} DESC, {1} DESC".format(time_column, id_column)
+
+    @staticmethod
+    def _limit(query, params, limit=None):
+        """
+        Appends a LIMIT to `query` if `limit` is set.
+
+        Returns (query, params).
+        """
+        if limit is None:
+            return query, params
+        return query + " LIMIT %s", tuple(params) + (limit,)
+
+    def _search(self, select, columns, id_column, attrs, limit=None,
+                order_by=None, after=None, count_only=False):
+        """
+        Runs the search for `attrs` (see SQLClauseFactory.generate_where)
+        over `select`, one of the *_view SELECTs returning `columns`.
+        See SQLClauseFactory.generate_order for `order_by` and `after`;
+        at most `limit` rows are fetched.
+
+        Returns the number of matching rows if `count_only`; otherwise
+        the rows are left on the cursor.
+        """
+        where, params = SQLClauseFactory.generate_where(attrs)
+        if count_only:
+            self.cur.execute(SQLClauseFactory.generate_count(select + where),
+                             params)
+            return self.cur.fetchone()[0]
+        if order_by and order_by.lstrip('-') not in columns:
+            raise ValueError("unknown column " + order_by.lstrip('-'))
+        condition, order_params, order = SQLClauseFactory.generate_order(
+            order_by, id_column, after)
+        if condition:
+            where += ' AND ' + condition
+            params += order_params
+        self.cur.execute(*self._limit(select + where + order, params, limit))
+
+    # see _execute_prepared; off, every statement is sent as is.
+    prepare_statements = True
+
+    def _execute_prepared(self, query, params=()):
+        """
+        Runs `query` like cur.execute, as a prepared statement: PREPAREd
+        the first time its connection sees it and EXECUTEd from then on,
+        so Postgres parses and plans it once per connection rather than
+        on every call.
+
+        Only for the fixed statements: every distinct text stays
+        prepared for the life of the connection. Literals in them are
+        fixed at PREPARE time too, so say now(), never 'now()'.
+
+        Unpooled connections (the CLI, scripts) are closed at the end
+        of their one transaction, so a PREPARE would be an extra round
+        trip that is never reused; they send the statement as is.
+        """
+        if not self.prepare_statements or not self._pooled:
+            self.cur.execute(query, params)
+            return
+        statement = self.conn.prepared.get(query)
+        if statement is None:
+            numbered, names = _numbered_placeholders(query)
+            name = 'history_{0}'.format(len(self.conn.prepared))
+            # on its own, so that a statement is only registered once
+            # it is known to exist.
+            self.cur.execute("PREPARE {0} AS {1}".format(name, numbered))
+            statement = self.conn.prepared[query] = (name, names)
+            PREPARED_STATEMENTS.inc()
+        else:
+            PREPARED_EXECUTIONS.inc()
+        name, names = statement
+        if isinstance(params, dict):
+            params = [params[n] for n in names]
+        if params:
+            self.cur.execute("EXECUTE {0} ({1})".format(
+                name, ", ".join(["%s"] * len(params))), params)
+        else:
+            self.cur.execute("EXECUTE " + name)
+
+    def set_statement_timeout(self, seconds):
+        """
+        Cancels any statement of this transaction still running after
+        `seconds`; it then raises psycopg2.extensions.QueryCanceledError.
+        """
+        self.cur.execute("SET LOCAL statement_timeout = %s",
+                         (int(seconds * 1000),))
+
+    @classmethod
+    def _paginate(cls, select, id_column, limit=None, after=None):
+        """
+        Orders one of the *_view SELECTs newest first, on
+        (insertion_time, `id_column`), and applies keyset pagination:
+        only rows strictly older than the `after` (insertion_time, id)
+        pair, and at most `limit` of them.
+
+        The plain insertion_time bound is implied by the row comparison,
+        but only it lets the planner skip partitions newer than `after`.
+
+        Returns (query, params).
+        """
+        params = ()
+        if after:
+            select += ("WHERE insertion_time <= %s "
+                       "AND (insertion_time, {0}) < (%s, %s) ").format(
+                           id_column)
+            params += (after[0],) + tuple(after)
+        select += cls._order_newest(id_column).lstrip()
+        if limit:
+            select += " LIMIT %s"
+            params += (limit,)
+        return select, params
+
+    ##############################
+    # Dimensions
+    #
+    # version, thing, servername and versioned_thing are append-only
+    # lookup tables. Every assertion needs some of their ids; they are
+    # resolved together in a single statement.
+
+    def _ensure_dimensions(self,
+                           version=None,
+                           thing=None,
+                           servername=None,
+                           versioned_thing=False):
+        """
+        Looks up, inserting where missing, the ids of
+
+        - `version`: a (version_type, version) pair
+        - `thing`: a (thing_type, thing_name) pair
+        - `servername`: a string
+        - `versioned_thing`: if set, the (version, thing) pair
+
+        and returns a dict of '<table>_id' -> id. Ids already in
+        DIMENSION_CACHE cost nothing; the rest are resolved in one
+        round trip.
+        """
+        ids = {}
+        ctes = []
+        database = self._settings.connection_string
+        # (result column, cache key) for everything we have to ask for.
+        missing = []
+        params = {}
+
+        def resolve(name, column, key, **upsert):
+            cached = DIMENSION_CACHE.get(key) if key else None
+            if cached is not None:
+                ids[column] = params[column] = cached
+                ctes.append("\n{0} AS (SELECT %({1})s::integer AS id)".format(
+                    name, column))
+            else:
+                ctes.append(_UPSERT_CTE.format(name=name, **upsert))
+                missing.append((name, column, key))
+
+        if version:
+            params['version_type'], params['version'] = version
+            resolve('v', 'version_id', ('version', database) + tuple(version),
+                    table='version',
+                    where='version_type = %(version_type)s AND version = %(version)s',
+                    columns='version_type, version',
+                    values='%(version_type)s, %(version)s',
+                    source='')
+        if thing:
+            params['thing_type'], params['thing_name'] = thing
+            resolve('t', 'thing_id', ('thing', database) + tuple(thing),
+                    table='thing',
+                    where='thing_type = %(thing_type)s AND unique_thing_name = %(thing_name)s',
+                    columns='thing_type, unique_thing_name',
+                    values='%(thing_type)s, %(thing_name)s',
+                    source='')
+        if versioned_thing:
+            assert version and thing, "versioned_thing needs version and thing"
+            # n.b, this SQL is part of the schema - we only get 0 or 1
+            # thing back:
+            #
+            # constraint synthetic_versioned_thing_uq unique (version_id, thing_id)
+            #
+            # the cache key needs both ids; without them, ask the db.
+            key = ('versioned_thing',
+                   database,
+                   ids.get('version_id'),
+                   ids.get('thing_id'))
+            if None in key:
+                key = None
+            resolve('vt', 'versioned_thing_id', key,
+                    table='versioned_thing',
+                    where='version_id = (SELECT id FROM v) AND thing_id = (SELECT id FROM t)',
+                    columns='version_id, thing_id',
+                    values='v.id, t.id',
+                    source='FROM v, t')
+        if servername:
+            params['servername'] = servername
+            resolve('s', 'servername_id', ('servername', database, servername),
+                    table='servername',
+                    where='servername = %(servername)s',
+                    columns='servername',
+                    values='%(servername)s',
+                    source='')
+
+        if not missing:
+            return ids
+
+        query = "WITH {0}\nSELECT {1}".format(
+            ",".join(ctes),
+            ", ".join("(SELECT id FROM {0}) AS {1}".format(name, column)
+                      for name, column, _ in missing))
+        # a lost insert race leaves a NULL; ON CONFLICT waited for the
+        # winner to commit, so the next statement sees its row. A NULL
+        # the second time is a conflict with some other row: a version
+        # is unique by itself, not with its version_type.
+        for _ in range(2):
+            self._execute_prepared(query, params)
+            ids.update(zip([column for _, column, _ in missing],
+                           self.cur.fetchone()))
+            if None not in ids.values():
+                break
+        else:
+            if ids.get('version_id', 0) is None:
+                raise psycopg2.IntegrityError(
+                    "version {0} exists, but is not a {1}".format(
+                        params['version'], params['version_type']))
+            raise psycopg2.IntegrityError(
+                "unable to resolve {0}: {1}".format(
+                    [k for k, v in ids.items() if v is None], params))
+
+        # rows we inserted vanish if this transaction rolls back, so
+        # they only go into the cache once end() has committed.
+        for _, column, key in missing:
+            if column == 'versioned_thing_id':
+                key = ('versioned_thing', database,
+                       ids['version_id'], ids['thing_id'])
+            self._resolved.append((key, ids[column]))
+        return ids
 
     ##############################
     # Version
@@ -208,25 +1066,18 @@ class PgServer(object):
 
         Returns version id
         """
-        self.cur.execute(
+        self._execute_prepared(
             """INSERT INTO version (insertion_time, version_type, version)
-            VALUES ('now()', %s, %s)
+            VALUES (now(), %s, %s)
             RETURNING id""", (version_type, version))
         return self.cur.fetchone()[0]
 
     def ensure_version(self, version_type, version):
-        self.cur.execute(
-            """SELECT id FROM version
-            WHERE version_type = %s AND version = %s""",
-            (version_type, version))
-        # contract via postgres schema: 0 or 1.
-        results = self.cur.fetchone()
-        if results:
-            version_id = results[0]
-        else:
-            version_id = self.append_version(version_type, version)
-
-        return version_id
+        """
+        Returns the version id, inserting the version if needed.
+        """
+        return self._ensure_dimensions(
+            version=(version_type, version))['version_id']
 
     ##############################
     # Versioned thing
@@ -240,6 +1091,12 @@ class PgServer(object):
         'thing_type',
         'unique_thing_name')
 
+    VersionedThingRecord = record_type('VersionedThingRecord',
+                                       wanted_versioned_columns)
+
+    # SELECT strings - note the trailing space!!
+    _versioned_select = "SELECT {0} FROM versioned_things_view ".format(
+        ", ".join(wanted_versioned_columns))
 
     def find_versioned_thing(self, versioned_thing_id):
         """
@@ -248,9 +1105,9 @@ class PgServer(object):
 
         Note, versioned_thing_id is a primary key.
         """
-        self.cur.execute(self._versioned_select +
-                         "WHERE versioned_id = %s",
-                         (versioned_thing_id,))
+        self._execute_prepared(self._versioned_select +
+                               "WHERE versioned_id = %s",
+                               (versioned_thing_id,))
         res = self.cur.fetchone()[0]
         return res
 
@@ -259,9 +1116,9 @@ class PgServer(object):
         insert version_id, thing_id into the versioned_thing table,
         returning the primary key.
         """
-        self.cur.execute(
+        self._execute_prepared(
             """INSERT INTO versioned_thing (insertion_time, version_id, thing_id)
-            VALUES ('now()', %s, %s)
+            VALUES (now(), %s, %s)
             RETURNING id""", (version_id, thing_id))
         return self.cur.fetchone()[0]
 
@@ -271,14 +1128,14 @@ class PgServer(object):
 
         It is possible that there might be multiple of them.
         """
-        self.cur.execute(self._versioned_select +
-                         """
-                         WHERE version_type = %s AND
-                         version = %s
-                         """,
-                         (version_type, version))
+        self._execute_prepared(self._versioned_select +
+                               """
+                               WHERE version_type = %s AND
+                               version = %s
+                               """ + self._order_newest('versioned_id'),
+                               (version_type, version))
 
-        return self._process_getter(self.wanted_versioned_columns)
+        return self._process_getter(self.VersionedThingRecord)
 
 
 
@@ -289,28 +1146,10 @@ class PgServer(object):
         database and returns a primary key representing their unique
         tuple.
         """
-        version_id = self.ensure_version(version_type, version)
-        thing_id = self.ensure_thing(thing_type, thing_name)
-
-        self.cur.execute("""
-        SELECT id
-        FROM versioned_thing
-        WHERE versioned_thing.version_id = %s
-           AND versioned_thing.thing_id = %s
-        """, (version_id, thing_id))
-        results = self.cur.fetchone()
-        if results:
-            # n.b, this SQL is part of the schema - we only get 0 or 1
-            # thing back:
-            #
-            # constraint synthetic_versioned_thing_uq unique (changeset_id, thing_id)
-            #
-            versioned_thing_id = results[0]
-        else:
-            versioned_thing_id = self.append_versioned_thing(version_id,
-                                                             thing_id)
-
-        return versioned_thing_id
+        return self._ensure_dimensions(
+            version=(version_type, version),
+            thing=(thing_type, thing_name),
+            versioned_thing=True)['versioned_thing_id']
 
     ##############################
     # Servernames
@@ -322,18 +1161,8 @@ class PgServer(object):
 
         Returns id.
         """
-        self.cur.execute("SELECT id FROM servername WHERE servername.servername = %s", (servername,))
-        results = self.cur.fetchone()
-        if results:
-            servername_id = results[0]
-        else:
-            self.cur.execute(
-                """
-                INSERT INTO servername (insertion_time, servername)
-                VALUES ('now()', %s)
-                RETURNING id""", (servername,))
-            servername_id = self.cur.fetchone()[0]
-        return servername_id
+        return self._ensure_dimensions(
+            servername=servername)['servername_id']
 
     ##############################
     # Things
@@ -343,10 +1172,10 @@ class PgServer(object):
         """
         thingtype must be a member of the type ThingType.
         """
-        self.cur.execute(
+        self._execute_prepared(
             """
             INSERT INTO thing (insertion_time, thing_type, unique_thing_name)
-            VALUES ('now()', %s, %s)
+            VALUES (now(), %s, %s)
             RETURNING id""", (thing_type, thing_name))
         return self.cur.fetchone()[0]
 
@@ -356,18 +1185,8 @@ class PgServer(object):
         Returns thing id; if name linked with thingtype doesn't exist,
         inserts it.
         """
-        self.cur.execute("""
-SELECT id
-FROM thing
-WHERE thing.unique_thing_name = %s AND
-thing.thing_type = %s""", (thing_name, thing_type))
-        results = self.cur.fetchone()
-        if results:
-            row_id = results[0]
-        else:
-            row_id = self.append_thing(thing_type, thing_name)
-
-        return row_id
+        return self._ensure_dimensions(
+            thing=(thing_type, thing_name))['thing_id']
 
     ##############################
     # Promotes
@@ -381,24 +1200,33 @@ thing.thing_type = %s""", (thing_name, thing_type))
         'environment',
         'misc')
 
+    _promote_select = "SELECT {0} FROM promotes_view ".format(
+        ", ".join(wanted_promote_columns))
+
+    # promotes come back with insertion_time named promotion_time.
+    promote_result_columns = (
+        'promote_id',
+        'promotion_time',
+        'thing_type',
+        'thing_name',
+        'thing_time',
+        'environment',
+        'misc')
+
+    PromoteRecord = record_type('PromoteRecord', promote_result_columns)
+
+    def _iter_promotes(self, rows):
+        """
+        Lazily processes promote rows into PromoteRecords.
+        """
+        return self._iter_getter(self.PromoteRecord, rows)
+
     def _process_promote_getter(self):
         """
         Assumes a SELECT has just taken place against the promotes;
         processes the results and returns them.
         """
-        results = self._process_getter(
-            ('promote_id',
-             'promotion_time',
-             'thing_type',
-             'thing_name',
-             'thing_time',
-             'environment',
-             'misc'))
-        for result in results:
-            result['promotion_time'] = result['promotion_time'].isoformat()
-            result['thing_time'] = result['thing_time'].isoformat()
-
-        return results
+        return list(self._iter_promotes(self.cur.fetchall()))
 
     def append_promote(self, thing_type, thing_name, environment, misc):
         """
@@ -408,19 +1236,26 @@ thing.thing_type = %s""", (thing_name, thing_type))
 
         Returns the synthetic primary key.
         """
-        self.cur.execute(
+        self._execute_prepared(
             """
             INSERT INTO promote (insertion_time, thing_id, environment, misc)
-            VALUES ('now()', %s, %s, %s)
+            VALUES (now(), %s, %s, %s)
             RETURNING id""",
             (self.ensure_thing(thing_type, thing_name),
              environment,
              psycopg2.extras.Json(misc)))
         return self.cur.fetchone()[0]
 
-    def get_promote_by_attrs(self, promote_attrs):
-        where, data = SQLClauseFactory.generate_where(promote_attrs)
-        self.cur.execute(self._promote_select + where, data)
+    def get_promote_by_attrs(self, promote_attrs, limit=None, order_by=None,
+                        after=None, count_only=False):
+        """
+        Searches promotes; see _search.
+        """
+        count = self._search(self._promote_select, self.wanted_promote_columns,
+                             'promote_id', promote_attrs, limit, order_by, after,
+                             count_only)
+        if count_only:
+            return count
         return self._process_promote_getter()
 
     def get_promote_by_thing(self, thing_type, thing):
@@ -429,7 +1264,7 @@ thing.thing_type = %s""", (thing_name, thing_type))
 
         Returns a list of dicts.
         """
-        self.cur.execute(
+        self._execute_prepared(
             """
 SELECT
             promote.id as promote_id,
@@ -442,7 +1277,7 @@ SELECT
 FROM promote
 INNER JOIN thing ON thing.id = promote.thing_id
 WHERE promote.thing_id = %s
-            """,
+            """ + self._order_newest('promote_id', 'promotion_time'),
             (self.ensure_thing(thing_type, thing),))
         return self._process_promote_getter()
 
@@ -452,7 +1287,7 @@ WHERE promote.thing_id = %s
 
         `promote_id` is the primary key for the promote table.
         """
-        self.cur.execute(
+        self._execute_prepared(
             """
 SELECT
             promote.id as promote_id,
@@ -474,7 +1309,7 @@ WHERE promote.id = %s
         Get all promotes in the environment `env` and returns them as a
         list of dicts.
         """
-        self.cur.execute(
+        self._execute_prepared(
             """
 SELECT
             promote.id as promote_id,
@@ -487,29 +1322,33 @@ SELECT
 FROM promote
 INNER JOIN thing ON thing.id = promote.thing_id
 WHERE promote.environment = %s
-            """,
+            """ + self._order_newest('promote_id', 'promotion_time'),
             (env,))
         return self._process_promote_getter()
 
-    def get_all_promotes(self):
+    def get_all_promotes(self, limit=None, after=None, raw=False):
         """
-        Return list of all promotes the database knows about.
+        Return list of all promotes the database knows about, newest
+        first; see _paginate for `limit` and `after`. With `raw`, the
+        rows are tuples ordered as promote_result_columns.
         """
-        self.cur.execute(
-            """
-SELECT
-            promote.id as promote_id,
-            promote.insertion_time as promotion_time,
-            thing.thing_type as thing_type,
-            thing.unique_thing_name as thing,
-            thing.insertion_time as thing_time,
-            promote.environment,
-            promote.misc
-FROM promote
-INNER JOIN thing ON thing.id = promote.thing_id
-            """)
+        self.cur.execute(*self._paginate(self._promote_select, 'promote_id',
+                                          limit, after))
+        if raw:
+            return self.cur.fetchall()
         return self._process_promote_getter()
 
+    def stream_all_promotes(self, raw=False, itersize=None, after=None):
+        """
+        Yields every promote, newest first (or only those older than
+        `after`; see _paginate), from a server-side cursor; as tuples
+        if `raw`.
+        """
+        rows = self._stream(*self._paginate(self._promote_select,
+                                            'promote_id', after=after),
+                            itersize=itersize)
+        return rows if raw else self._iter_promotes(rows)
+
 
     ##############################
     # Builds
@@ -525,12 +1364,17 @@ INNER JOIN thing ON thing.id = promote.thing_id
                             'result',
                             'misc')
 
+    _build_select = "SELECT {0} FROM builds_view ".format(
+        ", ".join(wanted_build_columns))
+
+    BuildRecord = record_type('BuildRecord', wanted_build_columns)
+
     def _process_build_getter(self):
         """
         Processes the database results and returns them as a list of
-        Python dicts.
+        BuildRecords.
         """
-        return self._process_getter(self.wanted_build_columns)
+        return self._process_getter(self.BuildRecord)
 
     def append_build(self,
                      version_type,
@@ -546,10 +1390,10 @@ INNER JOIN thing ON thing.id = promote.thing_id
         """
         version_id = self.ensure_version(version_type, version)
 
-        self.cur.execute(
+        self._execute_prepared(
             """
             INSERT INTO build (insertion_time, version_id, job_url, job_description, duration, result, misc)
-            VALUES ('now()', %s, %s, %s, %s, %s, %s)
+            VALUES (now(), %s, %s, %s, %s, %s, %s)
             RETURNING id""",
             (version_id,
              job_url,
@@ -559,18 +1403,26 @@ INNER JOIN thing ON thing.id = promote.thing_id
              psycopg2.extras.Json(misc)))
         return self.cur.fetchone()[0]
 
-    def get_build_by_attrs(self, build_attrs):
-        where, data = SQLClauseFactory.generate_where(build_attrs)
-        self.cur.execute(self._build_select + where, data)
+    def get_build_by_attrs(self, build_attrs, limit=None, order_by=None,
+                        after=None, count_only=False):
+        """
+        Searches builds; see _search.
+        """
+        count = self._search(self._build_select, self.wanted_build_columns,
+                             'build_id', build_attrs, limit, order_by, after,
+                             count_only)
+        if count_only:
+            return count
         return self._process_build_getter()
 
     def get_build_by_url(self, build_url):
         """
         Returns all builds matching `build_url`
         """
-        self.cur.execute(
+        self._execute_prepared(
             self._build_select +
-            "WHERE job_url = %s", (build_url,))
+            "WHERE job_url = %s" + self._order_newest('build_id'),
+            (build_url,))
         return self._process_build_getter()
 
     def get_build_by_build_id(self, build_id):
@@ -578,26 +1430,43 @@ INNER JOIN thing ON thing.id = promote.thing_id
         Returns the build denoted by ``build_id` or fails; build_id is
         the primary key of the build table.
         """
-        self.cur.execute(
+        self._execute_prepared(
             self._build_select +
             "WHERE build_id = %s", (build_id,))
         return self._process_build_getter()
 
-    def get_all_builds(self):
+    def get_all_builds(self, limit=None, after=None, raw=False):
         """
-        Return a list of all builds that are known to the database.
+        Return a list of all builds that are known to the database,
+        newest first; see _paginate for `limit` and `after`. With `raw`,
+        the rows are tuples ordered as wanted_build_columns.
         """
-        self.cur.execute(self._build_select)
+        self.cur.execute(*self._paginate(self._build_select, 'build_id',
+                                          limit, after))
+        if raw:
+            return self.cur.fetchall()
         return self._process_build_getter()
 
+    def stream_all_builds(self, raw=False, itersize=None, after=None):
+        """
+        Yields every build, newest first (or only those older than
+        `after`; see _paginate), from a server-side cursor; as tuples
+        if `raw`.
+        """
+        rows = self._stream(*self._paginate(self._build_select, 'build_id',
+                                          after=after),
+                            itersize=itersize)
+        return rows if raw else self._iter_getter(self.BuildRecord, rows)
+
     def get_build_by_version(self, version_type, version ):
         """
         Returns list of all builds known to be associated with the
         version.
         """
-        self.cur.execute(self._build_select +
-                         "WHERE version_id = %s",
-                         (self.ensure_version(version_type, version),))
+        self._execute_prepared(self._build_select +
+                               "WHERE version_id = %s" +
+                               self._order_newest('build_id'),
+                               (self.ensure_version(version_type, version),))
         return self._process_build_getter()
 
     ##############################
@@ -622,12 +1491,16 @@ INNER JOIN thing ON thing.id = promote.thing_id
                                'result',
                                'misc')
 
+    _artifact_select = "SELECT {0} FROM artifacts_view ".format(
+        ", ".join(wanted_artifact_columns))
+
+    ArtifactRecord = record_type('ArtifactRecord', wanted_artifact_columns)
+
     def _process_artifact_getter(self):
         """
-        Returns list of artifact results as dicts.
+        Returns list of artifact results as ArtifactRecords.
         """
-        return self._process_getter(
-            self.wanted_artifact_columns)
+        return self._process_getter(self.ArtifactRecord)
 
     def append_artifact(self, version_type, version, filename, build_id, misc):
         """
@@ -647,19 +1520,26 @@ INNER JOIN thing ON thing.id = promote.thing_id
                                                          ThingType.FILENAME,
                                                          filename)
 
-        self.cur.execute(
+        self._execute_prepared(
             """
             INSERT INTO artifact (insertion_time, versioned_thing_id, build_id, misc)
-            VALUES ('now()', %s, %s, %s)
+            VALUES (now(), %s, %s, %s)
             RETURNING id""",
             (versioned_thing_id,
              build_id,
              psycopg2.extras.Json(misc)))
         return self.cur.fetchone()[0]
 
-    def get_artifact_by_attrs(self, artifact_attrs):
-        where, data = SQLClauseFactory.generate_where(artifact_attrs)
-        self.cur.execute(self._artifact_select + where, data)
+    def get_artifact_by_attrs(self, artifact_attrs, limit=None, order_by=None,
+                        after=None, count_only=False):
+        """
+        Searches artifacts; see _search.
+        """
+        count = self._search(self._artifact_select, self.wanted_artifact_columns,
+                             'artifact_id', artifact_attrs, limit, order_by, after,
+                             count_only)
+        if count_only:
+            return count
         return self._process_artifact_getter()
 
     def get_artifact_by_filename(self, filename):
@@ -669,10 +1549,11 @@ INNER JOIN thing ON thing.id = promote.thing_id
 
         Does not return artifacts that aren't filenames.
         """
-        query = self._artifact_select + "WHERE thing_id = %s"
+        query = (self._artifact_select + "WHERE thing_id = %s" +
+                 self._order_newest('artifact_id'))
         thing_id = (self.ensure_thing(ThingType.FILENAME, filename),)
 
-        self.cur.execute(query, thing_id)
+        self._execute_prepared(query, thing_id)
 
         return self._process_artifact_getter()
 
@@ -683,9 +1564,10 @@ INNER JOIN thing ON thing.id = promote.thing_id
         Note that build_id is the primary key for builds.
         """
 
-        query = self._artifact_select + "WHERE build_id = %s"
+        query = (self._artifact_select + "WHERE build_id = %s" +
+                 self._order_newest('artifact_id'))
 
-        self.cur.execute(query, (build_id,))
+        self._execute_prepared(query, (build_id,))
 
         return self._process_artifact_getter()
 
@@ -695,10 +1577,11 @@ INNER JOIN thing ON thing.id = promote.thing_id
         `version_type`. `version` must be the full 40-character hash,
         not a short form.
         """
-        query = self._artifact_select + "WHERE version_id = %s"
+        query = (self._artifact_select + "WHERE version_id = %s" +
+                 self._order_newest('artifact_id'))
 
         v_id = self.ensure_version(version_type, version)
-        self.cur.execute(query, (v_id,))
+        self._execute_prepared(query, (v_id,))
 
         return self._process_artifact_getter()
 
@@ -709,19 +1592,34 @@ INNER JOIN thing ON thing.id = promote.thing_id
         """
         query = self._artifact_select + "WHERE artifact_id = %s"
 
-        self.cur.execute(query, (artifact_id,))
+        self._execute_prepared(query, (artifact_id,))
 
         return self._process_artifact_getter()
 
-    def get_all_artifacts(self):
+    def get_all_artifacts(self, limit=None, after=None, raw=False):
         """
-        Gets all known artifacts. It is probable that this is not a call
-        that should be made.
+        Gets all known artifacts, newest first. It is probable that this
+        is not a call that should be made without a `limit`; see
+        _paginate. With `raw`, the rows are tuples ordered as
+        wanted_artifact_columns.
         """
-        self.cur.execute(self._artifact_select)
-
+        self.cur.execute(*self._paginate(self._artifact_select, 'artifact_id',
+                                          limit, after))
+        if raw:
+            return self.cur.fetchall()
         return self._process_artifact_getter()
 
+    def stream_all_artifacts(self, raw=False, itersize=None, after=None):
+        """
+        Yields every artifact, newest first (or only those older than
+        `after`; see _paginate), from a server-side cursor; as tuples
+        if `raw`.
+        """
+        rows = self._stream(*self._paginate(self._artifact_select,
+                                            'artifact_id', after=after),
+                            itersize=itersize)
+        return rows if raw else self._iter_getter(self.ArtifactRecord, rows)
+
     ##############################
     # Deploys
 
@@ -737,19 +1635,25 @@ INNER JOIN thing ON thing.id = promote.thing_id
                              "servername",
                              "misc")
 
-    def _process_deploy_getter(self):
+    _deploy_select = "SELECT {0} FROM deploys_view ".format(
+        ", ".join(wanted_deploy_columns))
+
+    # If servername is not recorded in the database, it is None, and
+    # not present in the record's _asdict().
+    DeployRecord = record_type('DeployRecord', wanted_deploy_columns,
+                               optional=('servername',))
+
+    def _iter_deploys(self, rows):
+        """
+        Lazily processes deploy rows into DeployRecords.
         """
-        Return list of deploys as dicts.
+        return self._iter_getter(self.DeployRecord, rows)
 
-        If servername is not recorded in the database, it is not
-        present in the dict.
+    def _process_deploy_getter(self):
         """
-        result = self._process_getter(
-            self.wanted_deploy_columns)
-        for r in result:
-            if r['servername'] == 'null':
-                del r['servername']
-        return result
+        Return list of deploys as DeployRecords.
+        """
+        return self._process_getter(self.DeployRecord)
 
 
     def append_deploy(self,
@@ -771,49 +1675,45 @@ INNER JOIN thing ON thing.id = promote.thing_id
 
         returns deploy_id, the FK for deploys.
         """
-        versioned_thing_id = self.ensure_versioned_thing(version_type,
-                                                         version,
-                                                         thing_type,
-                                                         thing_name)
+        ids = self._ensure_dimensions(version=(version_type, version),
+                                      thing=(thing_type, thing_name),
+                                      versioned_thing=True,
+                                      servername=servername)
 
-        # note, two separate and *similar* queries, not identical.
-        if servername:
-            servername_id = self.ensure_servername(servername)
-            self.cur.execute(
-                """
-                INSERT INTO deploy (insertion_time,
-                                    versioned_thing_id,
-                                    servername_id,
-                                    environment,
-                                    misc)
-                VALUES ('now()', %s, %s, %s, %s)
-                RETURNING id""",
-                (versioned_thing_id,
-                 servername_id,
-                 environment,
-                 psycopg2.extras.Json(misc)))
-        else:
-            self.cur.execute(
-                """
-                INSERT INTO deploy (insertion_time, versioned_thing_id, environment, misc)
-                VALUES ('now()', %s, %s, %s)
-                RETURNING id""",
-                (versioned_thing_id,
-                 environment,
-                 psycopg2.extras.Json(misc)))
+        # servername_id is nullable: not everything is a server.
+        self._execute_prepared(
+            """
+            INSERT INTO deploy (insertion_time,
+                                versioned_thing_id,
+                                servername_id,
+                                environment,
+                                misc)
+            VALUES (now(), %s, %s, %s, %s)
+            RETURNING id""",
+            (ids['versioned_thing_id'],
+             ids.get('servername_id'),
+             environment,
+             psycopg2.extras.Json(misc)))
 
         return self.cur.fetchone()[0]
 
-    def get_deploy_by_attrs(self, deploy_attrs):
-        where, data = SQLClauseFactory.generate_where(deploy_attrs)
-        self.cur.execute(self._deploy_select + where, data)
+    def get_deploy_by_attrs(self, deploy_attrs, limit=None, order_by=None,
+                        after=None, count_only=False):
+        """
+        Searches deploys; see _search.
+        """
+        count = self._search(self._deploy_select, self.wanted_deploy_columns,
+                             'deploy_id', deploy_attrs, limit, order_by, after,
+                             count_only)
+        if count_only:
+            return count
         return self._process_deploy_getter()
 
     def get_deploys_by_deploy_id(self, deploy_id):
         """
         Get the deploy specified by deploy_id and returns it.
         """
-        self.cur.execute(
+        self._execute_prepared(
             self._deploy_select + "WHERE deploy_id = %s",
             (deploy_id,))
         return self._process_deploy_getter()
@@ -823,8 +1723,9 @@ INNER JOIN thing ON thing.id = promote.thing_id
         Get the deploys visible in environment and returns the list.
         """
         LOGGER.debug("getting deploys in env: %s", environment)
-        self.cur.execute(
-            self._deploy_select + "WHERE environment = %s",
+        self._execute_prepared(
+            self._deploy_select + "WHERE environment = %s" +
+            self._order_newest('deploy_id'),
             (environment,))
         return self._process_deploy_getter()
 
@@ -836,12 +1737,15 @@ INNER JOIN thing ON thing.id = promote.thing_id
         """
         LOGGER.debug("getting deploys by name of: %s", thing_name)
         if not thingtype:
-            self.cur.execute(
-                self._deploy_select + "WHERE thing_name = %s",
+            self._execute_prepared(
+                self._deploy_select + "WHERE thing_name = %s" +
+                self._order_newest('deploy_id'),
                 (thing_name,))
         else:
-            self.cur.execute(
-                self._deploy_select + "WHERE thing_name = %s AND thing_type = %s",
+            self._execute_prepared(
+                self._deploy_select +
+                "WHERE thing_name = %s AND thing_type = %s" +
+                self._order_newest('deploy_id'),
                 (thing_name, thingtype))
         return self._process_deploy_getter()
 
@@ -849,39 +1753,1076 @@ INNER JOIN thing ON thing.id = promote.thing_id
         """
         Gets all deploys associated with `version_type`, `version`.
         """
-        versioned_things = self.get_versioned_things_if_exists(version_type, version)
+        self._execute_prepared(
+            self._deploy_select +
+            "WHERE version_type = %s AND version = %s" +
+            self._order_newest('deploy_id'),
+            (version_type, version))
+        return self._process_deploy_getter()
+
+    def get_all_deploys(self, limit=None, after=None, raw=False):
+        """
+        Return a list of all deploys known to the database, newest
+        first; see _paginate for `limit` and `after`. With `raw`, the
+        rows are tuples ordered as wanted_deploy_columns.
+        """
+        self.cur.execute(*self._paginate(self._deploy_select, 'deploy_id',
+                                          limit, after))
+        if raw:
+            return self.cur.fetchall()
+        return self._process_deploy_getter()
 
-        results = []
+    def stream_all_deploys(self, raw=False, itersize=None, after=None):
+        """
+        Yields every deploy, newest first (or only those older than
+        `after`; see _paginate), from a server-side cursor; as tuples
+        if `raw`.
+        """
+        rows = self._stream(*self._paginate(self._deploy_select,
+                                            'deploy_id', after=after),
+                            itersize=itersize)
+        return rows if raw else self._iter_deploys(rows)
 
-        for versioned_thing in versioned_things:
-            version_id = versioned_thing['version_id']
-            query = self._deploy_select + "WHERE version_id = %s"
+    ##############################
+    # Batches
 
-            LOGGER.debug("q: %s, %s", query, version_id)
+    # rows per multi-row INSERT statement.
+    batch_page_size = 1000
+
+    def _insert_many(self, table, columns, rows):
+        """
+        INSERTs `rows` (tuples ordered as `columns`) into `table` with
+        multi-row VALUES statements, stamping insertion_time.
+
+        Returns the new ids, in the order of `rows`.
+        """
+        template = "('now()', {0})".format(", ".join(["%s"] * len(columns)))
+        ids = []
+        for start in xrange(0, len(rows), self.batch_page_size):
+            page = rows[start:start + self.batch_page_size]
             self.cur.execute(
-                query,
-                (version_id, ))
-            results.extend(self._process_deploy_getter())
+                "INSERT INTO {0} (insertion_time, {1}) VALUES {2} RETURNING id".format(
+                    table,
+                    ", ".join(columns),
+                    ",".join(self.cur.mogrify(template, row) for row in page)))
+            ids.extend(row[0] for row in self.cur.fetchall())
+        return ids
+
+    def append_batch(self, assertions):
+        """
+        Appends many assertions in this one transaction.
+
+        `assertions` is a list of (kind, kwargs) where kind is one of
+        'build', 'artifact', 'promote' or 'deploy', and kwargs are the
+        arguments of the matching append_* method.
+
+        Each distinct dimension is resolved once per batch, and each
+        kind is inserted with multi-row INSERTs. Returns a list of
+        (id, error) pairs in input order. An assertion the database
+        refuses (an artifact whose build_id does not exist, a version
+        already known under another version_type, a duration out of
+        range...) gets an error rather than failing the batch: if the
+        batch fails, it is undone and each assertion is appended under
+        its own savepoint instead.
+        """
+        results, error = self._savepoint(self._append_batch, assertions)
+        if error is None:
+            return results
+        LOGGER.info("batch failed (%s); appending one at a time",
+                    self._error_message(error))
+        results = []
+        for assertion in assertions:
+            result, error = self._savepoint(self._append_batch, [assertion])
+            results.extend(result or [(None, self._error_message(error))])
+        return results
 
+    def append_ingested(self, log, batch, assertions):
+        """
+        append_batch for write-behind assertions: `batch` are their
+        sequence numbers in ingest log `log` (a UUID), `assertions` as
+        for append_batch.
+
+        Each new row is recorded in ingest_outcome in this transaction.
+        An assertion already recorded there was committed by an earlier
+        attempt whose outcome never reached the log; it is not appended
+        again, and its recorded id is returned. The records of the log's
+        assertions before `batch` are dropped, since the log only moves
+        past an assertion once its outcome is on disk.
+        """
+        self.cur.execute(
+            "DELETE FROM ingest_outcome WHERE log = %s AND seq < %s",
+            (log, min(batch)))
+        self.cur.execute(
+            "SELECT seq, id FROM ingest_outcome WHERE log = %s AND seq = ANY(%s)",
+            (log, list(batch)))
+        done = dict(self.cur.fetchall())
+        todo = [(seq, assertion)
+                for seq, assertion in zip(batch, assertions)
+                if seq not in done]
+        if done:
+            LOGGER.info("ingest log %s: %d assertions already written",
+                        log, len(done))
+        results = {}
+        if todo:
+            appended = self.append_batch([a for _, a in todo])
+            rows = []
+            for (seq, (kind, _)), result in zip(todo, appended):
+                results[seq] = result
+                if result[1] is None:
+                    rows.append((log, seq, kind, result[0]))
+            for start in xrange(0, len(rows), self.batch_page_size):
+                self.cur.execute(
+                    "INSERT INTO ingest_outcome (log, seq, kind, id) VALUES " +
+                    ",".join(self.cur.mogrify("(%s, %s, %s, %s)", row)
+                             for row in rows[start:start + self.batch_page_size]))
+        return [(done[seq], None) if seq in done else results[seq]
+                for seq in batch]
+
+    def _savepoint(self, func, *args):
+        """
+        Calls `func` inside a savepoint. Returns (its result, None), or
+        (None, the error) if it raised a database error; its statements,
+        and the dimension ids it resolved, are then undone and the rest
+        of the transaction carries on. Raises if the connection is lost.
+        """
+        resolved = len(self._resolved)
+        self.cur.execute("SAVEPOINT history_append")
+        try:
+            result = func(*args)
+        except psycopg2.Error as ex:
+            self.cur.execute("ROLLBACK TO SAVEPOINT history_append")
+            del self._resolved[resolved:]
+            return None, ex
+        self.cur.execute("RELEASE SAVEPOINT history_append")
+        return result, None
+
+    @staticmethod
+    def _error_message(ex):
+        """
+        The message of a psycopg2 error, without its DETAIL and LINE
+        context.
+        """
+        diag = getattr(ex, 'diag', None)
+        message = diag.message_primary if diag is not None else None
+        return message or str(ex).strip()
+
+    def _append_batch(self, assertions):
+        """
+        append_batch for a batch the database takes as a whole.
+        """
+        results = [None] * len(assertions)
+        by_kind = collections.defaultdict(list)
+        for index, (kind, kwargs) in enumerate(assertions):
+            by_kind[kind].append((index, kwargs))
+
+        resolved = {}
+        def ensure(**dimensions):
+            key = tuple(sorted(dimensions.items()))
+            if key not in resolved:
+                resolved[key] = self._ensure_dimensions(**dimensions)
+            return resolved[key]
+
+        def insert(table, columns, pending):
+            if pending:
+                ids = self._insert_many(table, columns,
+                                        [row for _, row in pending])
+                for (index, _), row_id in zip(pending, ids):
+                    results[index] = (row_id, None)
+
+        pending = []
+        for index, a in by_kind.pop('build', []):
+            ids = ensure(version=(a['version_type'], a['version']))
+            pending.append((index, (ids['version_id'],
+                                    a['job_url'],
+                                    a['job_description'],
+                                    a['duration'],
+                                    a['result'],
+                                    psycopg2.extras.Json(a['misc']))))
+        insert('build',
+               ('version_id', 'job_url', 'job_description', 'duration',
+                'result', 'misc'),
+               pending)
+
+        artifacts = by_kind.pop('artifact', [])
+        known_builds = set()
+        if artifacts:
+            self.cur.execute("SELECT id FROM build WHERE id = ANY(%s)",
+                             (list(set(a['build_id'] for _, a in artifacts)),))
+            known_builds = set(row[0] for row in self.cur.fetchall())
+        pending = []
+        for index, a in artifacts:
+            if a['build_id'] not in known_builds:
+                results[index] = (None, 'build id not found')
+                continue
+            ids = ensure(version=(a['version_type'], a['version']),
+                         thing=(ThingType.FILENAME, a['filename']),
+                         versioned_thing=True)
+            pending.append((index, (ids['versioned_thing_id'],
+                                    a['build_id'],
+                                    psycopg2.extras.Json(a['misc']))))
+        insert('artifact',
+               ('versioned_thing_id', 'build_id', 'misc'),
+               pending)
+
+        pending = []
+        for index, a in by_kind.pop('promote', []):
+            ids = ensure(thing=(a['thing_type'], a['thing_name']))
+            pending.append((index, (ids['thing_id'],
+                                    a['environment'],
+                                    psycopg2.extras.Json(a['misc']))))
+        insert('promote',
+               ('thing_id', 'environment', 'misc'),
+               pending)
+
+        pending = []
+        for index, a in by_kind.pop('deploy', []):
+            ids = ensure(version=(a['version_type'], a['version']),
+                         thing=(a['thing_type'], a['thing_name']),
+                         versioned_thing=True,
+                         servername=a.get('servername') or None)
+            pending.append((index, (ids['versioned_thing_id'],
+                                    ids.get('servername_id'),
+                                    a['environment'],
+                                    psycopg2.extras.Json(a['misc']))))
+        insert('deploy',
+               ('versioned_thing_id', 'servername_id', 'environment', 'misc'),
+               pending)
+
+        for kind, rows in by_kind.items():
+            for index, _ in rows:
+                results[index] = (None, 'unknown assertion type: {0}'.format(kind))
         return results
 
-    def get_all_deploys(self):
+    ##############################
+    # Imports
+    #
+    # Bulk loads for backfills: rows are COPYed into a temporary
+    # staging table of text columns, checked and given their dimension
+    # ids with a handful of set-based statements, then merged into the
+    # fact table with one INSERT ... SELECT.
+
+    # the fields of each kind of assertion, as for append_*; every kind
+    # may also give an insertion_time.
+    import_columns = {
+        'build': ('version_type', 'version', 'job_url', 'job_description',
+                  'duration', 'result', 'misc'),
+        'artifact': ('version_type', 'version', 'filename', 'build_id',
+                     'misc'),
+        'promote': ('thing_type', 'thing_name', 'environment', 'misc'),
+        'deploy': ('thing_type', 'thing_name', 'version_type', 'version',
+                   'environment', 'servername', 'misc'),
+    }
+
+    import_optional = frozenset(['servername', 'misc', 'insertion_time'])
+
+    # column -> (condition on the staged text making a row bad, reason)
+    _import_checks = (
+        ('version_type',
+         "version_type <> ALL (enum_range(NULL::version_enum)::text[])",
+         "'version_type must be one of: ' || "
+         "array_to_string(enum_range(NULL::version_enum), ', ')"),
+        ('thing_type',
+         "thing_type <> ALL (enum_range(NULL::thing_enum)::text[])",
+         "'thing_type must be one of: ' || "
+         "array_to_string(enum_range(NULL::thing_enum), ', ')"),
+        ('environment',
+         "environment <> ALL (enum_range(NULL::environment_enum)::text[])",
+         "'environment must be one of: ' || "
+         "array_to_string(enum_range(NULL::environment_enum), ', ')"),
+        ('duration', "duration !~ '^-?[0-9]{1,9}$'",
+         "'duration must be an integer'"),
+        ('result', "length(result) > 16",
+         "'result must be at most 16 characters'"),
+        ('build_id', "build_id !~ '^[0-9]{1,9}$'",
+         "'build_id must be an integer'"),
+        ('build_id',
+         "NOT EXISTS (SELECT 1 FROM build WHERE id = build_id::integer)",
+         "'build id not found'"),
+    )
+
+    # (thing_type, thing_name) of each kind's thing, over the stage s.
+    _import_things = {
+        'artifact': ("'filename'", 's.filename'),
+        'promote': ('s.thing_type', 's.thing_name'),
+        'deploy': ('s.thing_type', 's.thing_name'),
+    }
+
+    _import_joins = {
+        'version': """
+            INNER JOIN version ON version.version = s.version""",
+        'thing': """
+            INNER JOIN thing
+                  ON thing.thing_type = {thing_type}::thing_enum
+                  AND thing.unique_thing_name = {thing_name}""",
+        'versioned_thing': """
+            INNER JOIN versioned_thing
+                  ON versioned_thing.version_id = version.id
+                  AND versioned_thing.thing_id = thing.id""",
+        'servername': """
+            LEFT JOIN servername ON servername.servername = s.servername""",
+    }
+
+    # (dimensions joined, fact columns, their values over the stage s)
+    _import_merge = {
+        'build': (('version',),
+                  'version_id, job_url, job_description, duration, result, misc',
+                  'version.id, s.job_url, s.job_description, '
+                  's.duration::integer, s.result, s.misc::jsonb'),
+        'artifact': (('version', 'thing', 'versioned_thing'),
+                     'versioned_thing_id, build_id, misc',
+                     'versioned_thing.id, s.build_id::integer, s.misc::jsonb'),
+        'promote': (('thing',),
+                    'thing_id, environment, misc',
+                    'thing.id, s.environment::environment_enum, '
+                    's.misc::jsonb'),
+        'deploy': (('version', 'thing', 'versioned_thing', 'servername'),
+                   'versioned_thing_id, servername_id, environment, misc',
+                   'versioned_thing.id, servername.id, '
+                   's.environment::environment_enum, s.misc::jsonb'),
+    }
+
+    @staticmethod
+    def _copy_value(value):
+        """
+        `value` (None or text) as a field of COPY's text format.
+        """
+        if value is None:
+            return '\\N'
+        if isinstance(value, unicode):
+            value = value.encode('utf-8')
+        return (value.replace('\\', '\\\\').replace('\t', '\\t')
+                .replace('\n', '\\n').replace('\r', '\\r'))
+
+    def _import_line(self, columns, record):
+        """
+        The COPY line of one assertion's `columns`, or ValueError if a
+        field is missing or malformed in a way the database would
+        reject the whole COPY for.
+        """
+        fields = []
+        for column in columns:
+            value = record.get(column)
+            if value == '' and column in self.import_optional:
+                # an empty CSV field
+                value = None
+            if value is None:
+                if column not in self.import_optional:
+                    raise ValueError('missing required field: ' + column)
+                if column == 'misc':
+                    value = {}
+            if column == 'misc':
+                if isinstance(value, basestring):
+                    try:
+                        value = json.loads(value)
+                    except ValueError as ex:
+                        raise ValueError('misc is not JSON: {0}'.format(ex))
+                value = json.dumps(value)
+                if '\\u0000' in value:
+                    raise ValueError('misc may not contain \\u0000')
+            elif column == 'insertion_time' and value is not None:
+                value = _import_timestamp(value)
+            elif value is not None:
+                if not isinstance(value, basestring):
+                    value = unicode(value)
+                if '\x00' in value:
+                    raise ValueError('NUL character in ' + column)
+            fields.append(self._copy_value(value))
+        return '\t'.join(fields) + '\n'
+
+    def import_assertions(self, kind, records):
+        """
+        Loads `records`, dicts of the fields of `kind` assertions (see
+        import_columns), in this one transaction. Dimensions missing
+        from the database are created for the whole set at once.
+        Returns (rows imported, [(index into records, reason)]) for
+        the records that were rejected.
+
+        Rows without an insertion_time get now(). Monthly partitions
+        are created for the months of those with one, and
+        current_deploy is recomputed for the imported deploys' things,
+        so an imported deploy older than the current one does not
+        replace it.
+        """
+        columns = self.import_columns[kind] + ('insertion_time',)
+        rejects = []
+        buf = cStringIO.StringIO()
+        for index, record in enumerate(records):
+            try:
+                buf.write('{0}\t{1}'.format(
+                    index, self._import_line(columns, record)))
+            except (ValueError, TypeError) as ex:
+                rejects.append((index, str(ex)))
+        buf.seek(0)
+
+        stage = 'import_' + kind
+        self.cur.execute(
+            "CREATE TEMPORARY TABLE {0} (line integer, {1}) "
+            "ON COMMIT DROP".format(
+                stage, ', '.join(c + ' text' for c in columns)))
+        self.cur.copy_expert("COPY {0} (line, {1}) FROM STDIN".format(
+            stage, ', '.join(columns)), buf)
+
+        checks = [(condition, reason)
+                  for column, condition, reason in self._import_checks
+                  if column in columns]
+        if checks:
+            self.cur.execute("""
+                WITH checked AS (
+                    SELECT line, CASE {0} END AS reason FROM {1})
+                DELETE FROM {1} USING checked
+                WHERE {1}.line = checked.line AND checked.reason IS NOT NULL
+                RETURNING checked.line, checked.reason
+                """.format(' '.join('WHEN {0} THEN {1}'.format(*check)
+                                    for check in checks), stage))
+            rejects.extend(self.cur.fetchall())
+
+        self.cur.execute("""
+            SELECT ensure_monthly_partition(%s, month)
+            FROM (SELECT DISTINCT date_trunc(
+                      'month', insertion_time::timestamptz AT TIME ZONE 'UTC'
+                  )::date AS month
+                  FROM {0} WHERE insertion_time IS NOT NULL) months
+            ORDER BY month
+            """.format(stage), (kind,))
+        backfilled = self.cur.rowcount > 0
+
+        dimensions, fact_columns, values = self._import_merge[kind]
+        thing_type, thing_name = self._import_things.get(kind, (None, None))
+        if 'version' in dimensions:
+            self.cur.execute("""
+                INSERT INTO version (insertion_time, version_type, version)
+                SELECT now(), version_type::version_enum, version
+                FROM (SELECT DISTINCT version_type, version FROM {0}) s
+                ORDER BY version
+                ON CONFLICT DO NOTHING
+                """.format(stage))
+            # version is unique by itself, not with its type.
+            self.cur.execute("""
+                DELETE FROM {0} s WHERE NOT EXISTS (
+                    SELECT 1 FROM version
+                    WHERE version.version = s.version
+                    AND version.version_type::text = s.version_type)
+                RETURNING line,
+                          'version ' || version || ' is not a ' || version_type
+                """.format(stage))
+            rejects.extend(self.cur.fetchall())
+        if 'thing' in dimensions:
+            self.cur.execute("""
+                INSERT INTO thing (insertion_time, thing_type, unique_thing_name)
+                SELECT now(), thing_type::thing_enum, thing_name
+                FROM (SELECT DISTINCT {1} AS thing_type, {2} AS thing_name
+                      FROM {0} s) s
+                ORDER BY thing_type, thing_name
+                ON CONFLICT DO NOTHING
+                """.format(stage, thing_type, thing_name))
+
+        def joins(*names):
+            return ''.join(self._import_joins[name] for name in names).format(
+                thing_type=thing_type, thing_name=thing_name)
+
+        if 'versioned_thing' in dimensions:
+            self.cur.execute("""
+                INSERT INTO versioned_thing (insertion_time, version_id, thing_id)
+                SELECT now(), version_id, thing_id
+                FROM (SELECT DISTINCT version.id AS version_id,
+                                      thing.id AS thing_id
+                      FROM {0} s {1}) s
+                ORDER BY version_id, thing_id
+                ON CONFLICT DO NOTHING
+                """.format(stage, joins('version', 'thing')))
+        if 'servername' in dimensions:
+            self.cur.execute("""
+                INSERT INTO servername (insertion_time, servername)
+                SELECT now(), servername
+                FROM (SELECT DISTINCT servername FROM {0}
+                      WHERE servername IS NOT NULL) s
+                ORDER BY servername
+                ON CONFLICT DO NOTHING
+                """.format(stage))
+
+        self.cur.execute("""
+            INSERT INTO {0} (insertion_time, {1})
+            SELECT COALESCE(s.insertion_time::timestamptz, now()), {2}
+            FROM {3} s {4}
+            ORDER BY s.line
+            """.format(kind, fact_columns, values, stage, joins(*dimensions)))
+        imported = self.cur.rowcount
+
+        if kind == 'deploy' and backfilled:
+            self._import_current_deploys(stage)
+        rejects.sort()
+        return imported, rejects
+
+    def _import_current_deploys(self, stage):
         """
-        Return a list of all deploys known to the database.
+        The deploy trigger keeps the highest deploy id current, which
+        is the latest one for live deploys but not for imported
+        history; recomputes the current deploys of the staged things
+        by insertion_time instead.
         """
-        self.cur.execute(self._deploy_select)
+        self.cur.execute("""
+            INSERT INTO current_deploy (environment,
+                                        thing_id,
+                                        servername_id,
+                                        versioned_thing_id,
+                                        deploy_id,
+                                        insertion_time)
+            SELECT DISTINCT ON (deploy.environment,
+                                versioned_thing.thing_id,
+                                COALESCE(deploy.servername_id, 0))
+                   deploy.environment,
+                   versioned_thing.thing_id,
+                   deploy.servername_id,
+                   deploy.versioned_thing_id,
+                   deploy.id,
+                   deploy.insertion_time
+            FROM deploy
+            INNER JOIN versioned_thing
+                  ON versioned_thing.id = deploy.versioned_thing_id
+            WHERE versioned_thing.thing_id IN (
+                SELECT thing.id FROM thing
+                INNER JOIN (SELECT DISTINCT thing_type, thing_name
+                            FROM {0}) s
+                      ON thing.thing_type::text = s.thing_type
+                      AND thing.unique_thing_name = s.thing_name)
+            ORDER BY deploy.environment,
+                     versioned_thing.thing_id,
+                     COALESCE(deploy.servername_id, 0),
+                     deploy.insertion_time DESC,
+                     deploy.id DESC
+            ON CONFLICT (environment, thing_id, COALESCE(servername_id, 0))
+            DO UPDATE SET versioned_thing_id = EXCLUDED.versioned_thing_id,
+                          deploy_id = EXCLUDED.deploy_id,
+                          insertion_time = EXCLUDED.insertion_time
+            """.format(stage))
 
-        return self._process_deploy_getter()
+    ##############################
+    # Exports
+    #
+    # Bulk reads for analysts: COPY (SELECT ...) TO STDOUT, so the
+    # database formats every row and Python only passes the bytes on.
+
+    # the view each kind is read from, and its columns; the same ones
+    # the GET routes return.
+    export_columns = {
+        'build': ('builds_view', wanted_build_columns),
+        'artifact': ('artifacts_view', wanted_artifact_columns),
+        'promote': ('promotes_view', wanted_promote_columns),
+        'deploy': ('deploys_view', wanted_deploy_columns),
+    }
+
+    export_formats = ('csv', 'ndjson')
+
+    # COPY's CSV format with a quote and a delimiter that never occur
+    # in JSON text, so each row_to_json line comes out as it is.
+    _export_copy = {
+        'csv': "COPY ({0}) TO STDOUT WITH (FORMAT csv, HEADER true)",
+        'ndjson': "COPY (SELECT row_to_json(e) FROM ({0}) e) TO STDOUT "
+                  "WITH (FORMAT csv, QUOTE E'\\x01', DELIMITER E'\\x02')",
+    }
+
+    def export(self, kind, out, fmt='csv', since=None, until=None,
+               filters=None):
+        """
+        Writes every `kind` row with insertion_time in [since, until)
+        (either may be None) and each view column in `filters` equal to
+        its value to the file-like `out`, in no particular order. The
+        rows are those of the GET routes (promotes' insertion_time is
+        promotion_time), as CSV with a header row or as NDJSON;
+        timestamps are in UTC.
+
+        ValueError for a column that can't be filtered on.
+        """
+        select = self._export_select(kind, since, until, filters)
+        self.cur.execute("SET LOCAL TimeZone = 'UTC'")
+        self.cur.copy_expert(self._export_copy[fmt].format(select), out)
+
+    def check_export(self, kind, since=None, until=None, filters=None):
+        """
+        ValueError if export() would fail on these arguments: a column
+        that can't be filtered on, or a value its column can't hold
+        (?build_id=abc). Only plans the query; no row is read. Leaves
+        the transaction aborted when it raises.
+        """
+        select = self._export_select(kind, since, until, filters)
+        try:
+            self.cur.execute("EXPLAIN " + select)
+        except psycopg2.DataError as ex:
+            raise ValueError(self._error_message(ex))
+
+    def _export_select(self, kind, since, until, filters):
+        """
+        The SELECT of an export, with its values filled in (COPY takes
+        no parameters).
+        """
+        view, columns = self.export_columns[kind]
+        conditions = []
+        params = []
+        for column, value in sorted((filters or {}).items()):
+            if column not in columns or column == 'misc':
+                raise ValueError('cannot filter {0}s by {1}'.format(
+                    kind, column))
+            conditions.append('{0} = %s'.format(column))
+            params.append(value)
+        if since is not None:
+            conditions.append('insertion_time >= %s')
+            params.append(since)
+        if until is not None:
+            conditions.append('insertion_time < %s')
+            params.append(until)
+        select = "SELECT {0} FROM {1}".format(
+            ', '.join('insertion_time AS promotion_time'
+                      if kind == 'promote' and column == 'insertion_time'
+                      else column
+                      for column in columns),
+            view)
+        if conditions:
+            select += ' WHERE ' + ' AND '.join(conditions)
+        return self.cur.mogrify(select, params)
+
+    ##############################
+    # Stats
+    #
+    # Aggregates for dashboards, computed in SQL over a window of
+    # insertion_time, so only the partitions in the window are read.
+
+    build_stats_columns = ('result',
+                           'count',
+                           'avg_duration',
+                           'p50_duration',
+                           'p95_duration')
+
+    deploy_stats_columns = ('environment',
+                            'thing_type',
+                            'thing_name',
+                            'count')
+
+    promote_stats_columns = ('environment',
+                             'count')
+
+    BuildStats = record_type('BuildStats', build_stats_columns)
+
+    DeployStats = record_type('DeployStats', deploy_stats_columns)
+
+    PromoteStats = record_type('PromoteStats', promote_stats_columns)
+
+    @staticmethod
+    def _stats_window(table, since=None, until=None):
+        """
+        Condition restricting `table` to insertion_time in [since,
+        until); the default window is the last 30 days.
+
+        Returns (condition, params).
+        """
+        return ("""{0}.insertion_time >=
+                       COALESCE(%s::timestamptz, now() - interval '30 days')
+                   AND {0}.insertion_time < COALESCE(%s::timestamptz, now())
+                """.format(table),
+                (since, until))
+
+    def get_build_stats(self, since=None, until=None):
+        """
+        Build counts and duration statistics per result, most common
+        result first.
+        """
+        window, params = self._stats_window('build', since, until)
+        self.cur.execute(
+            """
+            SELECT result,
+                   count(*),
+                   avg(duration)::float8,
+                   percentile_cont(0.5) WITHIN GROUP (ORDER BY duration),
+                   percentile_cont(0.95) WITHIN GROUP (ORDER BY duration)
+            FROM build
+            WHERE {0}
+            GROUP BY result
+            ORDER BY count(*) DESC, result
+            """.format(window),
+            params)
+        return self._process_getter(self.BuildStats)
+
+    def get_deploy_stats(self, since=None, until=None, top=None):
+        """
+        Deploy counts per environment and thing, most deployed first;
+        only the `top` ones if given. Read from the deploy_hourly
+        rollup, so the window is widened to whole (UTC) hours.
+        """
+        window, params = self._rollup_window(since, until)
+        self.cur.execute(
+            """
+            SELECT counts.environment,
+                   thing.thing_type,
+                   thing.unique_thing_name,
+                   counts.count
+            FROM (SELECT environment, thing_id, sum(count)::bigint AS count
+                  FROM deploy_hourly_all
+                  WHERE {0}
+                  GROUP BY environment, thing_id) AS counts
+            INNER JOIN thing ON thing.id = counts.thing_id
+            ORDER BY counts.count DESC, thing.unique_thing_name
+            LIMIT %s
+            """.format(window),
+            params + (top,))
+        return self._process_getter(self.DeployStats)
+
+    def get_promote_stats(self, since=None, until=None):
+        """
+        Promote counts per environment.
+        """
+        window, params = self._stats_window('promote', since, until)
+        self.cur.execute(
+            """
+            SELECT environment, count(*)
+            FROM promote
+            WHERE {0}
+            GROUP BY environment
+            ORDER BY environment
+            """.format(window),
+            params)
+        return self._process_getter(self.PromoteStats)
+
+    ##############################
+    # Rollups
+    #
+    # deploy_hourly and build_hourly (schema/008) are kept up to date
+    # by statement triggers on deploy and build, which append to
+    # <rollup>_delta; fold_rollups moves the deltas in, and readers
+    # sum <rollup>_all, both parts. Each rollup is listed with its key
+    # columns, its value columns, and the query computing it from the
+    # raw rows from {since} on; backfill and the consistency check
+    # both use that query.
+
+    # the first hour a backfill or check covers.
+    _rollup_since = ("utc_hour(COALESCE(%(since)s::timestamptz, "
+                     "'-infinity'))")
+
+    _rollups = (
+        ('deploy_hourly',
+         ('hour', 'environment', 'thing_id'),
+         ('count',),
+         """
+         SELECT utc_hour(deploy.insertion_time) AS hour,
+                deploy.environment,
+                versioned_thing.thing_id,
+                count(*) AS count
+         FROM deploy
+         INNER JOIN versioned_thing
+               ON versioned_thing.id = deploy.versioned_thing_id
+         WHERE deploy.insertion_time >= {since}
+         GROUP BY 1, 2, 3
+         """),
+        ('build_hourly',
+         ('hour', 'result', 'version_type'),
+         ('count', 'duration_sum'),
+         """
+         SELECT utc_hour(build.insertion_time) AS hour,
+                build.result,
+                version.version_type,
+                count(*) AS count,
+                sum(build.duration) AS duration_sum
+         FROM build
+         INNER JOIN version ON version.id = build.version_id
+         WHERE build.insertion_time >= {since}
+         GROUP BY 1, 2, 3
+         """),
+    )
+
+    deploy_hourly_columns = ('hour', 'environment', 'count')
+
+    build_hourly_columns = ('hour', 'result', 'count', 'avg_duration')
+
+    DeployHourly = record_type('DeployHourly', deploy_hourly_columns)
+
+    BuildHourly = record_type('BuildHourly', build_hourly_columns)
+
+    rollup_mismatch_columns = ('rollup', 'key', 'expected', 'found')
+
+    @staticmethod
+    def _rollup_window(since=None, until=None):
+        """
+        Condition restricting a rollup to the hours overlapping [since,
+        until); the default window is the last 30 days.
+
+        Returns (condition, params).
+        """
+        return ("""hour >= utc_hour(COALESCE(%s::timestamptz,
+                                             now() - interval '30 days'))
+                   AND hour < COALESCE(%s::timestamptz, now())
+                """,
+                (since, until))
+
+    def get_deploy_hourly(self, since=None, until=None, environment=None):
+        """
+        Deploys per hour and environment, oldest hour first; only
+        `environment`'s if given.
+        """
+        window, params = self._rollup_window(since, until)
+        self.cur.execute(
+            """
+            SELECT hour, environment, sum(count)::bigint
+            FROM deploy_hourly_all
+            WHERE {0} AND (%s::environment_enum IS NULL
+                           OR environment = %s::environment_enum)
+            GROUP BY hour, environment
+            ORDER BY hour, environment
+            """.format(window),
+            params + (environment, environment))
+        return self._process_getter(self.DeployHourly)
+
+    def get_build_hourly(self, since=None, until=None):
+        """
+        Build counts and mean duration per hour and result, oldest hour
+        first.
+        """
+        window, params = self._rollup_window(since, until)
+        self.cur.execute(
+            """
+            SELECT hour,
+                   result,
+                   sum(count)::bigint,
+                   sum(duration_sum)::float8 / sum(count)
+            FROM build_hourly_all
+            WHERE {0}
+            GROUP BY hour, result
+            ORDER BY hour, result
+            """.format(window),
+            params)
+        return self._process_getter(self.BuildHourly)
+
+    def fold_rollups(self):
+        """
+        Moves the deltas the triggers appended into the rollups. Run it
+        every minute or so; readers add in the deltas, so it only keeps
+        them short.
+
+        Returns {rollup: buckets updated}.
+        """
+        folded = {}
+        for table, keys, values, _ in self._rollups:
+            # deltas committed after the DELETE's snapshot stay for the
+            # next fold; a concurrent fold waits on the rows this one
+            # deletes, then skips them. Buckets are upserted in key
+            # order, so two folds can't deadlock.
+            self.cur.execute(
+                """
+                WITH moved AS (DELETE FROM {table}_delta RETURNING *)
+                INSERT INTO {table} ({columns})
+                SELECT {keys}, {sums}
+                FROM moved
+                GROUP BY {keys}
+                ORDER BY {keys}
+                ON CONFLICT ({keys})
+                DO UPDATE SET {updates}
+                """.format(
+                    table=table,
+                    columns=", ".join(keys + values),
+                    keys=", ".join(keys),
+                    sums=", ".join("sum({0})".format(v) for v in values),
+                    updates=", ".join(
+                        "{0} = {1}.{0} + EXCLUDED.{0}".format(v, table)
+                        for v in values)))
+            folded[table] = self.cur.rowcount
+        return folded
+
+    def backfill_rollups(self, since=None):
+        """
+        Recomputes the rollups from the raw rows, for every hour from
+        the one holding `since` on (everything by default). Appends
+        and folds wait while this runs.
+
+        Returns {rollup: buckets written}.
+        """
+        # the raw rows must hold still between the DELETE and the
+        # INSERT, and a fold must not add deltas back in; reads carry
+        # on.
+        self.cur.execute("LOCK TABLE deploy, build IN SHARE MODE")
+        self.cur.execute(
+            "LOCK TABLE deploy_hourly, build_hourly IN EXCLUSIVE MODE")
+        params = {'since': since}
+        written = {}
+        for table, keys, values, query in self._rollups:
+            for part in (table, table + '_delta'):
+                self.cur.execute(
+                    "DELETE FROM {0} WHERE hour >= {1}".format(
+                        part, self._rollup_since),
+                    params)
+            self.cur.execute(
+                "INSERT INTO {0} ({1}) {2}".format(
+                    table, ", ".join(keys + values),
+                    query.format(since=self._rollup_since)),
+                params)
+            written[table] = self.cur.rowcount
+        return written
+
+    def check_rollups(self, since=None):
+        """
+        Compares the rollups with the raw rows, for every hour from the
+        one holding `since` on (everything by default).
+
+        Returns a list of mismatches: dicts with the rollup, the
+        bucket's key, and the values expected from the raw rows and
+        found in the rollup (None for a missing bucket).
+
+        The triggers add the rows' deltas in the transaction that
+        inserts them, and a fold moves deltas in one transaction, so
+        each comparison, being one statement with one snapshot, needs
+        no lock.
+        """
+        params = {'since': since}
+        mismatches = []
+        for table, keys, values, query in self._rollups:
+            self.cur.execute(
+                """
+                SELECT {keys}, {raw_values}, {rollup_values}
+                FROM (SELECT {key_list}, {sums}
+                      FROM {table}_all
+                      WHERE hour >= {since}
+                      GROUP BY {key_list}) AS rollup
+                FULL OUTER JOIN ({query}) AS raw USING ({key_list})
+                WHERE ({raw_values}) IS DISTINCT FROM ({rollup_values})
+                ORDER BY {key_list}
+                """.format(
+                    keys=", ".join(keys),
+                    key_list=", ".join(keys),
+                    raw_values=", ".join("raw." + v for v in values),
+                    rollup_values=", ".join("rollup." + v for v in values),
+                    sums=", ".join("sum({0})::bigint AS {0}".format(v)
+                                   for v in values),
+                    table=table,
+                    since=self._rollup_since,
+                    query=query.format(since=self._rollup_since)),
+                params)
+            for row in self.cur.fetchall():
+                key = dict(zip(keys, row[:len(keys)]))
+                key['hour'] = key['hour'].isoformat()
+                expected = row[len(keys):len(keys) + len(values)]
+                found = row[len(keys) + len(values):]
+                mismatches.append(dict(zip(
+                    self.rollup_mismatch_columns,
+                    (table,
+                     key,
+                     None if expected[0] is None else dict(zip(values,
+                                                                expected)),
+                     None if found[0] is None else dict(zip(values,
+                                                             found))))))
+        return mismatches
+
+    ##############################
+    # Partitions
+    #
+    # The fact tables are partitioned by month of insertion_time
+    # (schema/006); rows for a month without a partition land in a
+    # default partition, which every query has to scan.
+
+    def ensure_partitions(self, months_ahead=3):
+        """
+        Creates any missing monthly partitions of the fact tables, from
+        this month to `months_ahead` months out. Meant to run from cron
+        well before the partitions are needed.
+
+        Returns the names of the partitions, existing or new.
+        """
+        self.cur.execute("SELECT ensure_fact_partitions(%s)",
+                         (months_ahead,))
+        return [row[0] for row in self.cur.fetchall()]
 
     ##############################
     # Misc first order queries
-    # TODO - Implement them.
+
+    # current_deploy (schema/005) is maintained by a trigger on deploy;
+    # it points at the latest deploy per (environment, thing, server).
+    # insertion_time is the deploy partition key: with it, each lookup
+    # probes one monthly partition instead of every one.
+    _current_deploy_select = """
+        SELECT {0} FROM current_deploy
+        INNER JOIN deploys_view
+              ON deploys_view.deploy_id = current_deploy.deploy_id
+             AND deploys_view.insertion_time = current_deploy.insertion_time
+        """.format(", ".join("deploys_view." + column
+                             for column in wanted_deploy_columns))
+
     def get_current_environment(self, environment):
         """
-        Returns the list of artifacts in the current environment.
+        Returns the latest deploy of every thing to every server in
+        `environment`, as a list of deploy dicts. The cost depends on
+        what is deployed now, not on the length of the history.
         """
-        return None
+        self._execute_prepared(
+            self._current_deploy_select +
+            """
+            WHERE current_deploy.environment = %s
+            ORDER BY deploys_view.thing_name, deploys_view.servername
+            """,
+            (environment,))
+        return self._process_deploy_getter()
 
+    # builds of the version; artifacts of the version or of those
+    # builds; deploys of the version or of those artifacts' versioned
+    # things. The UNIONs (rather than ORs) let each half use its index.
+    _lineage_query = """
+        WITH v AS (
+            SELECT id, version_type, version FROM version
+            WHERE version = %(version)s),
+        builds AS (
+            SELECT {build_columns} FROM builds_view
+            WHERE version_id IN (SELECT id FROM v)),
+        artifacts AS (
+            SELECT {artifact_columns} FROM artifacts_view
+            WHERE version_id IN (SELECT id FROM v)
+            UNION
+            SELECT {artifact_columns} FROM artifacts_view
+            WHERE build_id IN (SELECT build_id FROM builds)),
+        deploys AS (
+            SELECT {deploy_columns} FROM deploys_view
+            WHERE version_id IN (SELECT id FROM v)
+            UNION
+            SELECT {deploy_columns} FROM deploys_view
+            WHERE (version_id, thing_id) IN
+                  (SELECT version_id, thing_id FROM artifacts)),
+        events AS (
+            SELECT 'build' AS kind, 1 AS stage, insertion_time,
+                   build_id AS id, to_jsonb(builds) AS event
+            FROM builds
+            UNION ALL
+            SELECT 'artifact', 2, insertion_time, artifact_id,
+                   to_jsonb(artifacts)
+            FROM artifacts
+            UNION ALL
+            SELECT 'deploy', 3, insertion_time, deploy_id,
+                   to_jsonb(deploys) - 'thing_id'
+                   - CASE WHEN servername IS NULL
+                          THEN 'servername' ELSE '' END
+            FROM deploys)
+        SELECT v.id, v.version_type, v.version,
+               (SELECT COALESCE(jsonb_agg(
+                            jsonb_build_object('type', kind) || event
+                            ORDER BY insertion_time, stage, id), '[]')
+                FROM events)
+        FROM v
+        """.format(build_columns=", ".join(wanted_build_columns),
+                   artifact_columns=", ".join(wanted_artifact_columns),
+                   deploy_columns=", ".join(wanted_deploy_columns +
+                                            ('thing_id',)))
+
+    lineage_columns = ('version_id', 'version_type', 'version', 'timeline')
+
+    def get_lineage(self, version):
+        """
+        Returns what came of `version`, in one query: its builds, the
+        artifacts of the version or of those builds, and the deploys of
+        the version or of those artifacts, merged into one `timeline`,
+        oldest first. Each event is the usual build, artifact or deploy
+        dict plus its `type`; timestamps are ISO 8601 strings.
+
+        Returns None if the version is unknown.
+        """
+        self._execute_prepared(self._lineage_query, {'version': version})
+        row = self.cur.fetchone()
+        if row is None:
+            return None
+        return dict(zip(self.lineage_columns, row))
+
+    # TODO - Implement this.
     def get_artifact_history(self):
         """
         Returns all promotions associated with the artifact.
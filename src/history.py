@@ -1,7 +1,12 @@
 #!/usr/bin/python
 import argparse
+import csv
+import datetime
+import gzip
+import json
 import logging
 import sys
+import time
 from pprint import pprint
 from backend import PgServer, ThingType
 logging.basicConfig(format='%(asctime)-15s %(levelname)s: %(message)s')
@@ -77,11 +82,192 @@ def arg_handler():
     temp_parser = subparsers.add_parser('all-deploys')
     temp_parser = subparsers.add_parser('all-promotes')
 
+    temp_parser = subparsers.add_parser('partitions')
+    temp_parser.add_argument('--months-ahead', type=int, default=3)
+
+    temp_parser = subparsers.add_parser('rollups')
+    temp_parser.add_argument('--backfill', action='store_true',
+                             help='rebuild the rollups from the raw rows')
+    temp_parser.add_argument('--check', action='store_true',
+                             help='compare the rollups with the raw rows')
+    temp_parser.add_argument('--fold', action='store_true',
+                             help='move the pending deltas into the rollups')
+    temp_parser.add_argument('--since',
+                             help='only hours from this timestamp on')
+
+    temp_parser = subparsers.add_parser('import')
+    temp_parser.add_argument('kind',
+                             choices=sorted(PgServer.import_columns))
+    temp_parser.add_argument('files', nargs='*',
+                             help='CSV or NDJSON files; stdin if none')
+    temp_parser.add_argument('--format', choices=('csv', 'ndjson'),
+                             help='default: from the file extension, '
+                                  'NDJSON for stdin')
+    temp_parser.add_argument('--chunk-size', type=int, default=50000,
+                             help='rows per transaction')
+    temp_parser.add_argument('--rejects',
+                             help='write rejected rows here, not stderr')
+
+    temp_parser = subparsers.add_parser('export')
+    temp_parser.add_argument('kind',
+                             choices=sorted(PgServer.export_columns))
+    temp_parser.add_argument('--format', choices=PgServer.export_formats,
+                             default='csv')
+    temp_parser.add_argument('--since',
+                             help='only rows from this timestamp on')
+    temp_parser.add_argument('--until',
+                             help='only rows before this timestamp')
+    temp_parser.add_argument('--where', action='append', default=[],
+                             metavar='COLUMN=VALUE',
+                             help='only rows with this value; repeatable')
+    temp_parser.add_argument('--gzip', action='store_true')
+    temp_parser.add_argument('--output', help='file to write; stdout if not given')
+
     return parser.parse_args()
 
+def export_rows(args):
+    """
+    Writes every args.kind row matching args as CSV or NDJSON; see
+    PgServer.export.
+    """
+    filters = {}
+    for condition in args.where:
+        column, _, value = condition.partition('=')
+        filters[column] = value
+    raw = open(args.output, 'wb') if args.output else sys.stdout
+    out = gzip.GzipFile(fileobj=raw, mode='wb') if args.gzip else raw
+    try:
+        with PgServer() as server:
+            server.export(args.kind, out, args.format,
+                          args.since, args.until, filters)
+    finally:
+        if out is not raw:
+            out.close()
+        if raw is not sys.stdout:
+            raw.close()
+
+def as_dict(record):
+    """
+    A backend record as the dict the CLI prints, timestamps in ISO 8601.
+    """
+    result = record._asdict()
+    for key, value in result.iteritems():
+        if isinstance(value, datetime.datetime):
+            result[key] = value.isoformat()
+    return result
+
+def pprint_records(records):
+    """
+    pprints a getter's `records` as a list of dicts.
+    """
+    pprint([as_dict(record) for record in records])
+
+def print_records(records):
+    """
+    Prints `records` as they are streamed, one JSON object per line.
+    """
+    for record in records:
+        print json.dumps(as_dict(record), sort_keys=True)
+
+def read_assertions(files, file_format=None):
+    """
+    Yields (where, record or None, error) for every row of `files` (or
+    stdin): CSV with a header row of field names, or one JSON object
+    per line.
+    """
+    for name in files or ['-']:
+        source = sys.stdin if name == '-' else open(name, 'rb')
+        fmt = file_format or ('csv' if name.lower().endswith('.csv')
+                              else 'ndjson')
+        if fmt == 'csv':
+            reader = csv.DictReader(source)
+            for record in reader:
+                where = '{0}:{1}'.format(name, reader.line_num)
+                # DictReader files the fields past the header under None
+                if None in record:
+                    yield where, None, 'unexpected extra fields'
+                    continue
+                yield (where,
+                       dict((k, v.decode('utf-8'))
+                            for k, v in record.iteritems() if v is not None),
+                       None)
+        else:
+            for number, line in enumerate(source, 1):
+                if not line.strip():
+                    continue
+                where = '{0}:{1}'.format(name, number)
+                try:
+                    record = json.loads(line)
+                except ValueError as ex:
+                    yield where, None, 'not JSON: {0}'.format(ex)
+                    continue
+                if not isinstance(record, dict):
+                    yield where, None, 'expected a JSON object'
+                    continue
+                yield where, record, None
+        if source is not sys.stdin:
+            source.close()
+
+def import_assertions(args):
+    """
+    Loads args.files into the database, args.chunk_size rows per
+    transaction; see PgServer.import_assertions. Prints throughput as
+    it goes, and every rejected row with its reason.
+    """
+    rejects = open(args.rejects, 'w') if args.rejects else sys.stderr
+    totals = {'read': 0, 'imported': 0, 'rejected': 0}
+    start = time.time()
+
+    def reject(where, reason):
+        rejects.write('{0}\t{1}\n'.format(where, reason))
+        totals['rejected'] += 1
+
+    def load(chunk):
+        with PgServer() as server:
+            imported, rejected = server.import_assertions(
+                args.kind, [record for _, record in chunk])
+        totals['imported'] += imported
+        for index, reason in rejected:
+            reject(chunk[index][0], reason)
+        elapsed = time.time() - start
+        LOGGER.info("%d %ss imported, %d rejected, %.0f rows/s",
+                    totals['imported'], args.kind, totals['rejected'],
+                    totals['read'] / max(elapsed, 0.001))
+
+    chunk = []
+    for where, record, error in read_assertions(args.files, args.format):
+        totals['read'] += 1
+        if error:
+            reject(where, error)
+            continue
+        kind = record.pop('type', args.kind)
+        if kind != args.kind:
+            reject(where, 'type is {0}, not {1}'.format(kind, args.kind))
+            continue
+        chunk.append((where, record))
+        if len(chunk) >= args.chunk_size:
+            load(chunk)
+            chunk = []
+    if chunk:
+        load(chunk)
+
+    elapsed = time.time() - start
+    print "{0} rows read, {1} imported, {2} rejected in {3:.1f}s ({4:.0f} rows/s)".format(
+        totals['read'], totals['imported'], totals['rejected'], elapsed,
+        totals['read'] / elapsed if elapsed else 0)
+    if rejects is not sys.stderr:
+        rejects.close()
+
 def main(args):
     args = arg_handler()
     command_string = args.command
+    if command_string == 'import':
+        # a transaction per chunk, not one for the whole command.
+        import_assertions(args)
+        return 0
+    if command_string == 'export':
+        export_rows(args)
+        return 0
     with PgServer() as server:
         if command_string == 'w-changeset':
             for v in args.value:
@@ -107,16 +293,16 @@ def main(args):
                 {} )
         elif command_string == 'build':
             if args.job_url:
-                pprint(server.get_build_by_url(args.job_url))
+                pprint_records(server.get_build_by_url(args.job_url))
             elif args.build_id:
-                pprint(server.get_build_by_build_id(args.build_id))
+                pprint_records(server.get_build_by_build_id(args.build_id))
             elif args.changeset:
-                pprint(server.get_build_by_version('changeset', args.changeset))
+                pprint_records(server.get_build_by_version('changeset', args.changeset))
             else:
                 print "Must specify one of three options - execute --help"
 
         elif command_string == "all-builds":
-            pprint(server.get_all_builds())
+            print_records(server.stream_all_builds())
 
         elif command_string == 'w-artifact':
             print server.append_artifact(
@@ -128,24 +314,24 @@ def main(args):
 
         elif command_string == 'artifact':
             if args.filename:
-                pprint(server.get_artifact_by_filename(args.filename))
+                pprint_records(server.get_artifact_by_filename(args.filename))
             elif args.changeset:
-                pprint(server.get_artifact_by_version('changeset', args.changeset))
+                pprint_records(server.get_artifact_by_version('changeset', args.changeset))
             elif args.build_id:
-                pprint(server.get_artifact_by_build_id(args.build_id))
+                pprint_records(server.get_artifact_by_build_id(args.build_id))
             elif args.artifact_id:
-                pprint(server.get_artifact_by_artifact_id(args.artifact_id))
+                pprint_records(server.get_artifact_by_artifact_id(args.artifact_id))
             else:
                 print "Must specify one of three options... see --help"
 
         elif command_string == "all-artifacts":
-            pprint(server.get_all_artifacts())
+            print_records(server.stream_all_artifacts())
 
         elif command_string == "all-deploys":
-            pprint(server.get_all_deploys())
+            print_records(server.stream_all_deploys())
 
         elif command_string == "all-promotes":
-            pprint(server.get_all_promotes())
+            print_records(server.stream_all_promotes())
 
         elif command_string == 'w-deploy':
             pprint(server.append_deploy(
@@ -159,13 +345,13 @@ def main(args):
         elif command_string == "deploy":
 
             if args.environment:
-                pprint(server.get_deploys_by_environment(args.environment))
+                pprint_records(server.get_deploys_by_environment(args.environment))
             elif args.deploy_id:
-                pprint(server.get_deploys_by_deploy_id(args.deploy_id))
+                pprint_records(server.get_deploys_by_deploy_id(args.deploy_id))
             elif args.thing_name:
-                pprint(server.get_deploys_by_thing_name(args.thing_name))
+                pprint_records(server.get_deploys_by_thing_name(args.thing_name))
             elif args.changeset:
-                pprint(server.get_deploys_by_version('changeset', args.changeset))
+                pprint_records(server.get_deploys_by_version('changeset', args.changeset))
             else:
                 print "must specify a correct option...  see --help"
 
@@ -178,13 +364,26 @@ def main(args):
 
         elif command_string == 'promote':
             if args.filename:
-                pprint(server.get_promote_by_thing(ThingType.FILENAME,
-                                                   args.filename))
+                pprint_records(server.get_promote_by_thing(ThingType.FILENAME,
+                                                           args.filename))
             elif args.environment:
-                pprint(server.get_promote_by_environment(args.environment))
+                pprint_records(server.get_promote_by_environment(args.environment))
             else:
                 print "Need an option, specify --help"
 
+        elif command_string == 'partitions':
+            pprint(server.ensure_partitions(args.months_ahead))
+
+        elif command_string == 'rollups':
+            if args.fold:
+                pprint(server.fold_rollups())
+            if args.backfill:
+                pprint(server.backfill_rollups(args.since))
+            if args.check:
+                pprint(server.check_rollups(args.since))
+            if not (args.fold or args.backfill or args.check):
+                print "Need --fold, --backfill and/or --check"
+
         else:
             assert False, "unable to parse"
     return 0
@@ -0,0 +1,367 @@
+"""
+Write-behind ingest: assertions are acknowledged once they are on
+local disk, and written to the database in the background.
+
+The log is a file of JSON lines. An assertion line
+{"seq": n, "type": kind, "args": {...}} is written (and fsynced) before
+the POST is acknowledged with n; an outcome line
+{"seq": n, "type": kind, "id": id} or {"seq": n, "type": kind,
+"error": message} is written once the assertion's transaction has
+committed or been rejected. On start, assertions without an outcome
+are replayed.
+
+The first line, {"log": uuid}, names the log. The database records
+each written assertion under that name and its seq (ingest_outcome),
+in the transaction that writes it, so an assertion that committed but
+has no outcome line yet is not written again when retried or replayed.
+"""
+import collections
+import fcntl
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+
+import prometheus_client
+import psycopg2
+from psycopg2.pool import PoolError
+
+from backend import PgServer, load_settings
+
+LOGGER = logging.getLogger(__name__)
+LOGGER.setLevel(logging.DEBUG)
+
+INGEST_PENDING = prometheus_client.Gauge(
+    'history_ingest_pending',
+    'Assertions in the ingest log not yet written to the database')
+INGEST_WRITTEN = prometheus_client.Counter(
+    'history_ingest_written_total',
+    'Assertions drained from the ingest log into the database')
+INGEST_REJECTED = prometheus_client.Counter(
+    'history_ingest_rejected_total',
+    'Assertions refused because the ingest log was full')
+
+# errors that mean the database is unreachable, rather than that the
+# batch is bad; the batch is retried as is.
+_UNAVAILABLE = (psycopg2.OperationalError, psycopg2.InterfaceError, PoolError)
+
+class IngestQueueFull(Exception):
+    """
+    Raised by IngestQueue.put when max_pending assertions are waiting.
+    `failing` is true when that is because the database writes are
+    failing, rather than falling behind.
+    """
+
+    def __init__(self, pending, failing):
+        super(IngestQueueFull, self).__init__(
+            '{0} assertions waiting to be written'.format(pending))
+        self.failing = failing
+
+class IngestQueue(object):
+    """
+    A durable, bounded queue of assertions in front of
+    PgServer.append_batch.
+
+    put() appends to the log and returns once it is fsynced; callers
+    that arrive during an fsync share the next one. A writer thread
+    drains the log in batches of up to `batch_size` assertions, one
+    transaction each, and retries with backoff while the database is
+    unavailable. Only one process may use a log at a time.
+    """
+
+    # rewrite the log once it grows past this many bytes, keeping the
+    # unfinished assertions and the last `retain` outcomes.
+    compact_bytes = 64 * 1024 * 1024
+    retain = 100000
+
+    # seconds between retries while the database is unavailable.
+    min_backoff = 0.5
+    max_backoff = 30
+
+    def __init__(self, path, properties, max_pending=10000, batch_size=500):
+        self.path = path
+        self.properties = properties
+        self.max_pending = max_pending
+        self.batch_size = batch_size
+        self.failing = False
+        # the log's name in ingest_outcome
+        self.log_id = None
+
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._sync_lock = threading.Lock()
+        # seq -> (kind, args) for every assertion without an outcome;
+        # _queued holds the seqs not yet taken by the writer.
+        self._unfinished = {}
+        self._queued = collections.deque()
+        # seq -> outcome line, oldest first
+        self._outcomes = collections.OrderedDict()
+        self._seq = 0
+        # lines written, and lines known to be on disk
+        self._written = 0
+        self._synced = 0
+
+        self._lock_file = open(path + '.lock', 'a')
+        try:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except IOError:
+            raise IOError('{0} is in use by another process'.format(path))
+        self._replay()
+        self._file = open(path, 'a')
+        if self.log_id is None:
+            self.log_id = uuid.uuid4().hex
+            with self._lock:
+                written = self._write([{'log': self.log_id}])
+            self._sync(written)
+        INGEST_PENDING.set(len(self._unfinished))
+
+        self._writer = threading.Thread(target=self._drain,
+                                        name='ingest-writer')
+        self._writer.daemon = True
+        self._writer.start()
+
+    def _replay(self):
+        """
+        Reads the log back into memory. A line cut short by a crash can
+        only be the last one, and was never acknowledged; it is
+        truncated away.
+        """
+        if not os.path.exists(self.path):
+            return
+        good = 0
+        with open(self.path, 'r+') as log:
+            for line in iter(log.readline, ''):
+                try:
+                    if not line.endswith('\n'):
+                        raise ValueError('no newline')
+                    entry = json.loads(line)
+                except ValueError:
+                    if log.readline():
+                        raise ValueError(
+                            '{0}: corrupt line at byte {1}'.format(
+                                self.path, good))
+                    LOGGER.warning("%s: dropping a partial last line",
+                                   self.path)
+                    log.truncate(good)
+                    break
+                good += len(line)
+                self._load(entry)
+        self._queued.extend(sorted(self._unfinished))
+        if self._unfinished:
+            LOGGER.info("%s: replaying %d assertions",
+                        self.path, len(self._unfinished))
+
+    def _load(self, entry):
+        if 'log' in entry:
+            self.log_id = entry['log']
+            return
+        seq = entry['seq']
+        self._seq = max(self._seq, seq)
+        if 'args' in entry:
+            self._unfinished[seq] = (entry['type'], entry['args'])
+        else:
+            self._unfinished.pop(seq, None)
+            self._outcomes[seq] = entry
+
+    def _write(self, entries):
+        """
+        Writes `entries` as lines; call with _lock held. Returns the
+        line count to pass to _sync.
+        """
+        for entry in entries:
+            self._file.write(json.dumps(entry) + '\n')
+        self._written += len(entries)
+        return self._written
+
+    def _sync(self, written):
+        """
+        Returns once the first `written` lines are on disk. The fsync
+        runs outside _lock, so puts keep going while it does, and a
+        put that finds its line already synced returns at once.
+        """
+        with self._sync_lock:
+            if self._synced >= written:
+                return
+            with self._lock:
+                self._file.flush()
+                target = self._written
+            os.fsync(self._file.fileno())
+            self._synced = target
+
+    def put(self, kind, args):
+        """
+        Durably queues an assertion for PgServer.append_batch: `kind`
+        is 'build', 'artifact', 'promote' or 'deploy' and `args` the
+        kwargs of the matching append_*. Returns its sequence number.
+        """
+        with self._lock:
+            if len(self._unfinished) >= self.max_pending:
+                INGEST_REJECTED.inc()
+                raise IngestQueueFull(len(self._unfinished), self.failing)
+            self._seq += 1
+            seq = self._seq
+            written = self._write([{'seq': seq, 'type': kind, 'args': args}])
+            self._unfinished[seq] = (kind, args)
+            self._queued.append(seq)
+            INGEST_PENDING.set(len(self._unfinished))
+            self._wakeup.notify()
+        self._sync(written)
+        return seq
+
+    def status(self, seq):
+        """
+        The state of assertion `seq`: a dict with 'state' 'pending',
+        'done' (and the new row's 'id') or 'failed' (and 'error'), or
+        None if `seq` was never issued or its outcome has been
+        compacted away.
+        """
+        with self._lock:
+            if seq in self._unfinished:
+                return {'seq': seq,
+                        'type': self._unfinished[seq][0],
+                        'state': 'pending'}
+            outcome = self._outcomes.get(seq)
+        if outcome is None:
+            return None
+        result = dict(outcome)
+        result['state'] = 'failed' if 'error' in outcome else 'done'
+        return result
+
+    def summary(self):
+        with self._lock:
+            return {'pending': len(self._unfinished),
+                    'max_pending': self.max_pending,
+                    'last_seq': self._seq,
+                    'failing': self.failing}
+
+    ##############################
+    # the writer thread
+
+    def _drain(self):
+        backoff = self.min_backoff
+        while True:
+            with self._lock:
+                while not self._queued:
+                    self._wakeup.wait()
+                batch = [self._queued.popleft()
+                         for _ in xrange(min(self.batch_size,
+                                             len(self._queued)))]
+                assertions = [self._unfinished[seq] for seq in batch]
+            try:
+                results = self._append(batch, assertions)
+            except _UNAVAILABLE as ex:
+                LOGGER.warning("ingest: database unavailable (%s); "
+                               "retrying in %.1fs", ex, backoff)
+                with self._lock:
+                    self.failing = True
+                    self._queued.extendleft(reversed(batch))
+                time.sleep(backoff)
+                backoff = min(backoff * 2, self.max_backoff)
+                continue
+            except Exception:
+                LOGGER.exception("ingest: unexpected error; retrying")
+                with self._lock:
+                    self._queued.extendleft(reversed(batch))
+                time.sleep(self.max_backoff)
+                continue
+            backoff = self.min_backoff
+            self._finish(batch, assertions, results)
+
+    def _append(self, batch, assertions):
+        """
+        append_ingested in one transaction. If the batch fails as a
+        whole, each assertion is retried in its own, so only the bad
+        ones fail; those that commit before the database becomes
+        unavailable are skipped when the batch is retried.
+        """
+        try:
+            with PgServer(self.properties, pooled=True) as server:
+                return server.append_ingested(self.log_id, batch, assertions)
+        except _UNAVAILABLE:
+            raise
+        except Exception as ex:
+            if len(assertions) == 1:
+                return [(None, str(ex).strip())]
+        results = []
+        for seq, assertion in zip(batch, assertions):
+            results.extend(self._append([seq], [assertion]))
+        return results
+
+    def _finish(self, batch, assertions, results):
+        with self._lock:
+            self.failing = False
+            entries = []
+            for seq, (kind, _), (row_id, error) in zip(batch, assertions,
+                                                       results):
+                entry = {'seq': seq, 'type': kind}
+                if error:
+                    entry['error'] = error
+                else:
+                    entry['id'] = row_id
+                entries.append(entry)
+                del self._unfinished[seq]
+                self._outcomes[seq] = entry
+            written = self._write(entries)
+            INGEST_PENDING.set(len(self._unfinished))
+        self._sync(written)
+        INGEST_WRITTEN.inc(len(batch))
+        if os.path.getsize(self.path) > self.compact_bytes:
+            self._compact()
+
+    def _compact(self):
+        """
+        Replaces the log with one holding only the last `retain`
+        outcomes and the unfinished assertions. Puts wait meanwhile.
+        """
+        with self._sync_lock:
+            with self._lock:
+                while len(self._outcomes) > max(self.retain, 1):
+                    self._outcomes.popitem(last=False)
+                # the newest outcome is kept, so the sequence carries on
+                # from the rewritten log.
+                entries = [{'log': self.log_id}] + self._outcomes.values() + [
+                    {'seq': seq, 'type': kind, 'args': args}
+                    for seq, (kind, args) in sorted(
+                        self._unfinished.iteritems())]
+                temp = self.path + '.compact'
+                with open(temp, 'w') as log:
+                    for entry in entries:
+                        log.write(json.dumps(entry) + '\n')
+                    log.flush()
+                    os.fsync(log.fileno())
+                os.rename(temp, self.path)
+                directory = os.open(os.path.dirname(os.path.abspath(
+                    self.path)), os.O_RDONLY)
+                try:
+                    os.fsync(directory)
+                finally:
+                    os.close(directory)
+                self._file.close()
+                self._file = open(self.path, 'a')
+                self._written = self._synced = 0
+        LOGGER.info("ingest: compacted %s to %d lines",
+                    self.path, len(entries))
+
+_QUEUES = {}
+_QUEUES_LOCK = threading.Lock()
+
+def get_queue(properties='env.properties.toml'):
+    """
+    The process's IngestQueue for the INGESTLOG of `properties`,
+    started (and its log replayed) the first time it is asked for;
+    None if INGESTLOG is not set.
+    """
+    settings = load_settings(properties)
+    if not settings.ingest_log:
+        return None
+    with _QUEUES_LOCK:
+        queue = _QUEUES.get(settings.ingest_log)
+        if queue is None:
+            queue = IngestQueue(settings.ingest_log,
+                                properties,
+                                max_pending=settings.ingest_max_pending,
+                                batch_size=settings.ingest_batch_size)
+            _QUEUES[settings.ingest_log] = queue
+    return queue
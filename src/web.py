@@ -3,22 +3,32 @@ Flask app connecting the web to the backend.
 """
 
 # stdlib imports
+import base64
 import datetime
-import dateutil.parser
 import json
 import os
+import Queue
+import signal
+import sys
+import threading
 import time
-from collections import defaultdict
+import urllib
+import zlib
+from collections import defaultdict, namedtuple
 
 # third part imports
 import flask
 import prometheus_client
-from flask_restplus import abort, Api, Resource, fields, apidoc
+from flask_restplus import abort, Api, Resource, fields, apidoc, inputs
 from flask_bootstrap import Bootstrap
 from psycopg2 import IntegrityError
+from psycopg2.extensions import QueryCanceledError
+from psycopg2.pool import PoolError
 
 # internal imports
-from backend import PgServer
+from backend import (PgServer, SQLClauseFactory, load_settings,
+                     reload_settings)
+from ingest import IngestQueueFull, get_queue
 
 
 ##############################
@@ -56,20 +66,105 @@ e = prometheus_client.Counter('http_request_errors_total',
 def stand_up_prometheus(*args, **kwargs):
     prometheus_client.start_http_server(5001)
 
+
 ##############################
 # globals
 
 ENVIRONMENT_PROPERTIES = 'env.properties.toml'
 
+# settings are parsed once per process; `kill -HUP` re-reads them.
+try:
+    signal.signal(signal.SIGHUP, reload_settings)
+except ValueError:
+    # not imported from the main thread; no reload hook.
+    pass
+
+# replay any write-behind assertions left over from the last run as
+# soon as the app is loaded (twistd imports it), not on its first
+# request. Under the development server's reloader, only the child
+# that serves requests takes the log.
+if __name__ != "__main__" or os.environ.get('WERKZEUG_RUN_MAIN'):
+    get_queue(ENVIRONMENT_PROPERTIES)
+
 #############################
 # utils
 
 
-def parse_times(obj):
-    for attr in obj:
-        if attr.endswith('_time'):
-            obj[attr] = dateutil.parser.parse(obj[attr])
-    return obj
+def json_default(obj):
+    """
+    `default` for json.dumps: the backend hands back native datetimes,
+    serialized here (and by fields.DateTime) exactly once.
+    """
+    if isinstance(obj, datetime.datetime):
+        return obj.isoformat()
+    raise TypeError(repr(obj) + " is not JSON serializable")
+
+
+class RowEncoder(object):
+
+    """
+    Encodes backend result tuples straight to JSON text, producing the
+    same document marshal() + json.dumps would for `model`, without the
+    intermediate dicts.
+
+    Built once per model; every model field must be one of `columns`,
+    so the Swagger model and the wire format cannot drift apart.
+    """
+
+    @staticmethod
+    def _integer(value):
+        return 'null' if value is None else str(int(value))
+
+    @staticmethod
+    def _string(value):
+        if value is None:
+            return 'null'
+        return json.encoder.encode_basestring_ascii(value)
+
+    @staticmethod
+    def _datetime(value):
+        return 'null' if value is None else '"' + value.isoformat() + '"'
+
+    @staticmethod
+    def _raw(value):
+        return json.dumps(value, default=json_default)
+
+    def __init__(self, model, columns):
+        self.columns = tuple(columns)
+        self._fields = []
+        for name, field in model.items():
+            if isinstance(field, fields.Integer):
+                encode = self._integer
+            elif isinstance(field, fields.DateTime):
+                encode = self._datetime
+            elif isinstance(field, fields.String):
+                encode = self._string
+            else:
+                encode = self._raw
+            self._fields.append((json.dumps(name) + ':',
+                                 self.columns.index(name),
+                                 encode))
+
+    def index(self, column):
+        return self.columns.index(column)
+
+    def encode(self, row):
+        return '{' + ','.join(key + encode(row[index])
+                              for key, index, encode in self._fields) + '}'
+
+    def encode_list(self, rows):
+        """
+        Yields the JSON array of `rows` in chunks.
+        """
+        yield '['
+        first = True
+        for row in rows:
+            if first:
+                first = False
+                yield self.encode(row)
+            else:
+                yield ',' + self.encode(row)
+        yield ']'
 
 
 ##############################
@@ -91,24 +186,34 @@ class ARGS(object):
     """
     enum to DRY up the repetitive typos in strings.
     """
+    AFTER = 'after'
     ARTIFACT_ID = 'artifact_id'
     BUILD_ID = 'build_id'
+    COUNT_ONLY = 'count_only'
     DEPLOY_ID = 'deploy_id'
     DURATION = 'duration'
     ENVIRONMENT = 'environment'
     FILENAME = 'filename'
+    FORMAT = 'format'
+    GZIP = 'gzip'
     INSERTION_TIME = 'insertion_time'
     JOB_DESCRIPTION = 'job_description'
     JOB_URL = 'job_url'
+    LIMIT = 'limit'
     MISC = 'misc'
+    ORDER_BY = 'order_by'
     PROMOTE_ID = 'promote_id'
     PROMOTE_TIME = 'promotion_time'
     SERVER_NAME = 'servername'
+    SINCE = 'since'
+    STREAM = 'stream'
     RESULT = 'result'
     THING_ID = 'thing_id'
     THING_NAME = 'thing_name'
     THING_TIME = 'thing_time'
     THING_TYPE = 'thing_type'
+    TOP = 'top'
+    UNTIL = 'until'
     VERSION = 'version'
     VERSION_ID = 'version_id'
     VERSION_TYPE = 'version_type'
@@ -274,11 +379,130 @@ deploy_get_parser.add_argument(ARGS.VERSION_TYPE, type=str,
 deploy_get_parser.add_argument(ARGS.VERSION, type=str)
 deploy_get_parser.add_argument(ARGS.THING_NAME, type=str)
 
+environment_current_parser = api.parser()
+environment_current_parser.add_argument(ARGS.ENVIRONMENT, type=str,
+                                        required=True,
+                                        choices=ENUMS.environment)
+
+lineage_get_parser = api.parser()
+lineage_get_parser.add_argument(ARGS.VERSION, type=str, required=True)
+
+build_stats = api.model('BuildStats', {
+    ARGS.RESULT: fields.String(),
+    'count': fields.Integer(),
+    'avg_duration': fields.Float(),
+    'p50_duration': fields.Float(),
+    'p95_duration': fields.Float(),
+})
+
+deploy_stats = api.model('DeployStats', {
+    ARGS.ENVIRONMENT: fields.String(),
+    ARGS.THING_TYPE: fields.String(),
+    ARGS.THING_NAME: fields.String(),
+    'count': fields.Integer(),
+})
+
+promote_stats = api.model('PromoteStats', {
+    ARGS.ENVIRONMENT: fields.String(),
+    'count': fields.Integer(),
+})
+
+deploy_hourly = api.model('DeployHourly', {
+    'hour': fields.DateTime(),
+    ARGS.ENVIRONMENT: fields.String(),
+    'count': fields.Integer(),
+})
+
+build_hourly = api.model('BuildHourly', {
+    'hour': fields.DateTime(),
+    ARGS.RESULT: fields.String(),
+    'count': fields.Integer(),
+    'avg_duration': fields.Float(),
+})
+
+# shared by the /stats routes; the window defaults to the last 30 days.
+stats_get_parser = api.parser()
+stats_get_parser.add_argument(
+    ARGS.SINCE, type=inputs.datetime_from_iso8601,
+    help='start of the window (inclusive), ISO 8601')
+stats_get_parser.add_argument(
+    ARGS.UNTIL, type=inputs.datetime_from_iso8601,
+    help='end of the window (exclusive), ISO 8601')
+
+deploy_stats_get_parser = stats_get_parser.copy()
+deploy_stats_get_parser.add_argument(
+    ARGS.TOP, type=inputs.positive,
+    help='only the n most deployed things')
+
+deploy_hourly_get_parser = stats_get_parser.copy()
+deploy_hourly_get_parser.add_argument(
+    ARGS.ENVIRONMENT, type=str, choices=ENUMS.environment,
+    help='only this environment')
+
+export_get_parser = api.parser()
+export_get_parser.add_argument(
+    ARGS.FORMAT, type=str, choices=PgServer.export_formats,
+    default='ndjson')
+export_get_parser.add_argument(
+    ARGS.SINCE, type=inputs.datetime_from_iso8601,
+    help='only rows from this time on (inclusive), ISO 8601')
+export_get_parser.add_argument(
+    ARGS.UNTIL, type=inputs.datetime_from_iso8601,
+    help='only rows before this time, ISO 8601')
+export_get_parser.add_argument(
+    ARGS.GZIP, type=inputs.boolean, default=False,
+    help='send a gzip file')
+
+# the rest of an export's query parameters are column filters.
+export_get_parser_names = frozenset(arg.name for arg in export_get_parser.args)
+
+# shared by the /<thing>/all routes.
+list_get_parser = api.parser()
+list_get_parser.add_argument(
+    ARGS.LIMIT, type=inputs.positive,
+    help='page size; the next page is in the Link header')
+list_get_parser.add_argument(
+    ARGS.AFTER, type=str, help='cursor from a previous page')
+list_get_parser.add_argument(
+    ARGS.STREAM, type=inputs.boolean, default=False,
+    help='stream every row as newline-delimited JSON')
+
+# /<thing>/all rows are encoded straight from the backend's tuples.
+list_encoders = {
+    'builds': RowEncoder(build, PgServer.wanted_build_columns),
+    'artifacts': RowEncoder(artifact, PgServer.wanted_artifact_columns),
+    'promotes': RowEncoder(promote, PgServer.promote_result_columns),
+    'deploys': RowEncoder(deploy, PgServer.wanted_deploy_columns),
+}
+
+# /batch lines are validated against the matching POST parser.
+batch_parsers = {
+    'build': build_post_parser,
+    'artifact': artifact_post_parser,
+    'promote': promote_post_parser,
+    'deploy': deploy_post_parser,
+}
+
+# most assertions, and bytes, a single /batch request may carry.
+BATCH_MAX_LINES = 10000
+BATCH_MAX_BYTES = 32 * 1024 * 1024
+
 
 ##############################
 # Flask BEFORE/AFTER request modifiers.
 
 
+def logged_body():
+    """
+    The request body, for the logging hooks. /batch reads its body line
+    by line so that it can refuse one past its caps; it is not read
+    here, or logged.
+    """
+    if flask.request.endpoint == 'api.batch':
+        return '<{0} bytes of batch>'.format(flask.request.content_length)
+    return flask.request.get_data()
+
+
 @app.before_request
 def pre_request_logging():
     flask.g.start = time.time()
@@ -287,7 +511,7 @@ def pre_request_logging():
         "PRE",
         flask.request.method,
         flask.request.url,
-        flask.request.data]))
+        logged_body()]))
 
 
 # Add logging after every request
@@ -300,7 +524,7 @@ def post_request_logging(response):
         flask.request.method,
         str(response.status_code),
         flask.request.url,
-        flask.request.data]))
+        logged_body()]))
     return response
 
 
@@ -342,14 +566,16 @@ def search():
     # transform query string into query dict
 
         query_args = parse_query_string(query_string)
+        options, _ = parse_search_options(request_vars, things_to_search)
 
         if len(query_args) > 0:
-            search_results = search_with_attrs(query_args, things_to_search)
+            search_results = search_with_attrs(query_args, things_to_search,
+                                               options)
 
     return flask.render_template(
         'search.html',
         query_string=query_string,
-        input_json=json.dumps(search_results))
+        input_json=json.dumps(search_results, default=json_default))
 
 
 # Takes in dict of <column:value>'s and a thing type and
@@ -366,7 +592,11 @@ def filter_args(params_dict, thing_type):
         valid_keys = set(PgServer.wanted_deploy_columns)
     elif thing_type == 'PROMOTES':
         valid_keys = set(PgServer.wanted_promote_columns)
-    filtered_keys = param_keys & valid_keys
+    # misc.<path> keys search inside misc.
+    filtered_keys = set(
+        k for k in param_keys
+        if k in valid_keys or (k.startswith(ARGS.MISC + '.') and
+                               ARGS.MISC in valid_keys))
     if (len(filtered_keys) == 0) or (len(filtered_keys) != len(param_keys)):
         return {}
 
@@ -381,6 +611,13 @@ def parse_query_string(query_string):
     comparators = ['<=', '>=', '<', '>']
     # for each "attr == val" clause in the query string
     for query_condition in query_string.split('&&'):
+        # misc @> {...}: the JSON document keeps its whitespace
+        if '@>' in query_condition:
+            attr, value = query_condition.split('@>', 1)
+            query_args[attr.strip()].append(parse_containment(attr.strip(),
+                                                              value))
+            continue
+
         # strip whitespaces
         query_condition = query_condition.replace(' ', '')
 
@@ -392,7 +629,6 @@ def parse_query_string(query_string):
 
                 # if contains glob characters
                 if '*' in value:
-                    args['attr_alias'] = attr + '::text'
                     args['value'] = value.replace('*', '%')
                     args['condition'] = 'LIKE'
                 else:
@@ -417,6 +653,10 @@ def parse_api_args(request_args):
     query_args = defaultdict(lambda: list())
     comparators = ['<=', '>=', '<', '>']
     for k, v in request_args.iteritems():
+        # misc=@>{...}: the JSON document may contain commas and spaces
+        if v.startswith('@>'):
+            query_args[k].append(parse_containment(k, v[2:]))
+            continue
         found = False
         v = v.replace(' ', '')
         for query_condition in v.split(","):
@@ -430,7 +670,6 @@ def parse_api_args(request_args):
                     break
             if not found:
                 if '*' in v:
-                    args['attr_alias'] = k + '::text'
                     args['value'] = query_condition.replace('*', '%')
                     args['condition'] = 'LIKE'
                 else:
@@ -440,6 +679,88 @@ def parse_api_args(request_args):
     return query_args
 
 
+# misc@>{...} in either search syntax
+def parse_containment(attr, value):
+    if attr != ARGS.MISC:
+        abort(400, '@> only applies to misc')
+    try:
+        document = json.loads(value)
+    except ValueError:
+        abort(400, 'misc@> needs a JSON document')
+    return {'condition': '@>', 'value': document}
+
+
+# Convert one NDJSON line from /batch into (kind, append_* kwargs)
+def parse_assertion(line):
+    record = json.loads(line)
+    if not isinstance(record, dict):
+        raise ValueError('expected a JSON object')
+    kind = record.pop('type', None)
+    parser = batch_parsers.get(kind)
+    if parser is None:
+        raise ValueError('type must be one of: ' +
+                         ', '.join(sorted(batch_parsers)))
+    kwargs = {}
+    for arg in parser.args:
+        value = record.get(arg.name)
+        if value is None:
+            if arg.required:
+                raise ValueError('missing required field: ' + arg.name)
+            value = arg.default
+        if arg.name == ARGS.MISC:
+            # a JSON object here, not a JSON-encoded form string.
+            if isinstance(value, basestring):
+                value = json.loads(value)
+        elif arg.type is int and (isinstance(value, bool) or
+                                  isinstance(value, float) and
+                                  not value.is_integer()):
+            # int() would quietly make 3.7 a 3, and true a 1.
+            raise ValueError(arg.name + ' must be an integer')
+        else:
+            value = arg.type(value)
+        if arg.choices and value not in arg.choices:
+            raise ValueError('{0} must be one of: {1}'.format(
+                arg.name, ', '.join(arg.choices)))
+        kwargs[arg.name] = value
+    return kind, kwargs
+
+
+# seconds a client turned away by a full ingest queue should wait.
+INGEST_RETRY_AFTER = {429: 1, 503: 30}
+
+WRITE_BEHIND_RESPONSES = {
+    202: 'queued, with Prefer: respond-async; see /ingest/status/<seq>',
+    429: 'ingest queue full; retry after Retry-After seconds',
+    503: 'ingest queue full and the database unavailable'}
+
+
+def write_behind(kind, args):
+    """
+    A POST of a `kind` assertion that asked for `Prefer: respond-async`
+    is queued in the ingest log rather than written now. Returns the
+    (body, code, headers) to respond with, or None to write it now:
+    the client did not ask, or INGESTLOG is not set.
+
+    202 carries the assertion's sequence number; /ingest/status/<seq>
+    gives its id once it is written. A full queue is 429 if the
+    database is keeping up but slowly, 503 if it is unavailable.
+    """
+    if 'respond-async' not in flask.request.headers.get('Prefer', ''):
+        return None
+    queue = get_queue(ENVIRONMENT_PROPERTIES)
+    if queue is None:
+        return None
+    try:
+        seq = queue.put(kind, args)
+    except IngestQueueFull as ex:
+        code = 503 if ex.failing else 429
+        app.logger.warn(ex)
+        return ({'message': str(ex)}, code,
+                {'Retry-After': str(INGEST_RETRY_AFTER[code])})
+    status = flask.url_for('api.ingest_status', seq=seq)
+    return {'seq': seq, 'status': status}, 202, {'Location': status}
+
+
 def found_thing_attrs(thing, search_args):
     for k, v in search_args.iteritems():
         if thing.get(k) == v:
@@ -448,40 +769,230 @@ def found_thing_attrs(thing, search_args):
     return True
 
 
-def search_with_attrs(query_args, types_of_things):
+# How each searchable thing type is searched: the key of its results,
+# its PgServer getter, the view columns it can be ordered by, the
+# fields of its records (in the same order) and its id column.
+SearchTarget = namedtuple('SearchTarget', ('key',
+                                           'getter',
+                                           'columns',
+                                           'result_columns',
+                                           'id_column'))
+
+SEARCH_TARGETS = {
+    'BUILDS': SearchTarget('builds', 'get_build_by_attrs',
+                           PgServer.wanted_build_columns,
+                           PgServer.wanted_build_columns,
+                           ARGS.BUILD_ID),
+    'ARTIFACTS': SearchTarget('artifacts', 'get_artifact_by_attrs',
+                              PgServer.wanted_artifact_columns,
+                              PgServer.wanted_artifact_columns,
+                              ARGS.ARTIFACT_ID),
+    'DEPLOYS': SearchTarget('deploys', 'get_deploy_by_attrs',
+                            PgServer.wanted_deploy_columns,
+                            PgServer.wanted_deploy_columns,
+                            ARGS.DEPLOY_ID),
+    'PROMOTES': SearchTarget('promotes', 'get_promote_by_attrs',
+                             PgServer.wanted_promote_columns,
+                             PgServer.promote_result_columns,
+                             ARGS.PROMOTE_ID),
+}
+
+
+def parse_search_options(request_args, types_of_things):
+    """
+    Splits the search options (limit, order_by, after, count_only) off
+    the other `request_args`, checking them against the thing types to
+    be searched; aborts with 400 on a bad one.
+
+    Returns (options, the remaining args).
+    """
+    args = dict(request_args.iteritems())
+    options = {}
+    try:
+        if ARGS.LIMIT in args:
+            options['limit'] = inputs.positive(args.pop(ARGS.LIMIT))
+        if ARGS.COUNT_ONLY in args:
+            options['count_only'] = inputs.boolean(args.pop(ARGS.COUNT_ONLY))
+    except ValueError as error:
+        abort(400, str(error))
+
+    order_by = args.pop(ARGS.ORDER_BY, None)
+    if order_by:
+        column = order_by.lstrip('-')
+        if column in SQLClauseFactory.unorderable_columns or not all(
+                column in SEARCH_TARGETS[type_of_thing].columns
+                for type_of_thing in types_of_things):
+            abort(400, 'cannot order by ' + column)
+        options['order_by'] = order_by
+
+    after = args.pop(ARGS.AFTER, None)
+    if after:
+        if len(types_of_things) != 1:
+            abort(400, 'after needs a single thing type')
+        options['after'] = decode_cursor(after)
+    return options, args
+
+
+class ConnectionSlots(object):
+    """
+    Counts the threads of every request holding (or waiting for) a
+    database connection for one kind of work, so that a burst of it
+    leaves connections to the rest: concurrent searches each want a
+    pooled connection per thing type, and exports hold a connection
+    of their own for as long as their client reads.
+    """
+
+    def __init__(self):
+        self._lock = threading.Condition(threading.Lock())
+        self._used = 0
+
+    def acquire(self, limit, timeout):
+        """
+        Takes a slot once fewer than `limit` are taken; False if none
+        frees up within `timeout` seconds.
+        """
+        deadline = time.time() + timeout
+        with self._lock:
+            while self._used >= limit:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return False
+                self._lock.wait(remaining)
+            self._used += 1
+            return True
+
+    def release(self):
+        with self._lock:
+            self._used -= 1
+            self._lock.notify()
+
+
+SEARCH_SLOTS = ConnectionSlots()
+
+
+def search_one(getter, search_args, kwargs, settings, deadline, abandoned,
+               outcome):
+    """
+    Runs one thing type's search on its own pooled connection, for a
+    thread of search_with_attrs. Waiting for a search slot, waiting for
+    the connection and the query all share `deadline` (a time.time());
+    once `abandoned` is set the caller has stopped waiting, and the
+    query is not run at all.
+
+    Fills in `outcome`: 'rows' (or the count), or 'timed_out' if the
+    deadline passed first, or 'error' (an exc_info) for anything else.
+    """
+    if not SEARCH_SLOTS.acquire(settings.search_connections,
+                                deadline - time.time()):
+        outcome['timed_out'] = True
+        return
+    try:
+        with PgServer(settings, pooled=True,
+                      checkout_timeout=max(0, deadline - time.time())
+                      ) as server:
+            remaining = deadline - time.time()
+            if abandoned.is_set() or remaining <= 0:
+                outcome['timed_out'] = True
+                return
+            server.set_statement_timeout(remaining)
+            outcome['rows'] = getattr(server, getter)(search_args, **kwargs)
+    except (QueryCanceledError, PoolError):
+        outcome['timed_out'] = True
+    except Exception:
+        outcome['error'] = sys.exc_info()
+    finally:
+        SEARCH_SLOTS.release()
+
+
+def search_with_attrs(query_args, types_of_things, options=None):
+    """
+    Searches each of `types_of_things` at the same time, each on its
+    own pooled connection, and returns {'builds': [...], ...} for the
+    types with matches; see parse_search_options for `options`.
+
+    At most `limit` rows, and never more than `search_limit`, come back
+    per type; types that had more are listed under 'truncated', and
+    'next' maps them to the `after` cursor of their next page. With
+    `count_only`, each type searched maps to its number of matches
+    instead. A type not answered within `search_timeout` seconds,
+    counting the wait for a connection (at most `search_connections`
+    are searching at once), is cancelled and listed under 'timed_out',
+    and the others are still returned.
+    """
+    options = options or {}
+    settings = load_settings(ENVIRONMENT_PROPERTIES)
+    limit = min(options.get('limit') or settings.search_limit,
+                settings.search_limit)
+    timeout = settings.search_timeout
+    count_only = options.get('count_only', False)
+    order_column = (options.get('order_by') or
+                    '-' + ARGS.INSERTION_TIME).lstrip('-')
+    if count_only:
+        kwargs = {'count_only': True}
+    else:
+        # one more than asked for, to tell whether there are more.
+        kwargs = {'limit': limit + 1,
+                  'order_by': options.get('order_by'),
+                  'after': options.get('after')}
+
+    # statement_timeout cancels slow queries server side; the deadline
+    # also covers waiting for a connection. A straggler finishes (and
+    # hands its connection back) in the background, skipping its query
+    # if it has not started it.
+    deadline = time.time() + timeout
+    abandoned = threading.Event()
+    searches = []
+    for type_of_thing in types_of_things:
+        search_args = filter_args(query_args, type_of_thing)
+        if len(search_args) > 0:
+            target = SEARCH_TARGETS[type_of_thing]
+            outcome = {}
+            thread = threading.Thread(
+                target=search_one,
+                args=(target.getter, search_args, kwargs, settings,
+                      deadline, abandoned, outcome))
+            thread.daemon = True
+            thread.start()
+            searches.append((target, thread, outcome))
+
     results = {}
-    matched_builds = []
-    matched_artifacts = []
-    matched_deploys = []
-    matched_promotes = []
-
-    with PgServer(ENVIRONMENT_PROPERTIES) as server:
-        for type_of_thing in types_of_things:
-            search_args = filter_args(query_args, type_of_thing)
-            if len(search_args) > 0:
-                if type_of_thing == 'BUILDS':
-                    for build in server.get_build_by_attrs(search_args):
-                        matched_builds.append(build)
-                    if len(matched_builds) > 0:
-                        results['builds'] = matched_builds
-
-                elif type_of_thing == 'ARTIFACTS':
-                    for artifact in server.get_artifact_by_attrs(search_args):
-                        matched_artifacts.append(artifact)
-                    if len(matched_artifacts) > 0:
-                        results['artifacts'] = matched_artifacts
-
-                elif type_of_thing == 'DEPLOYS':
-                    for deploy in server.get_deploy_by_attrs(search_args):
-                        matched_deploys.append(deploy)
-                    if len(matched_deploys) > 0:
-                        results['deploys'] = matched_deploys
-
-                elif type_of_thing == 'PROMOTES':
-                    for promote in server.get_promote_by_attrs(search_args):
-                        matched_promotes.append(promote)
-                    if len(matched_promotes) > 0:
-                        results['promotes'] = matched_promotes
+    truncated = []
+    next_pages = {}
+    timed_out = []
+    for target, thread, outcome in searches:
+        key = target.key
+        # a second's grace for the server to report the cancellation.
+        thread.join(max(0, deadline + 1 - time.time()))
+        if 'error' in outcome:
+            abandoned.set()
+            error_type, error, traceback = outcome['error']
+            raise error_type, error, traceback
+        if thread.is_alive() or outcome.get('timed_out'):
+            abandoned.set()
+            timed_out.append(key)
+            continue
+        rows = outcome['rows']
+        if count_only:
+            results[key] = rows
+            continue
+        if len(rows) > limit:
+            truncated.append(key)
+            rows = rows[:limit]
+            last = rows[-1]
+            value = getattr(last, target.result_columns[
+                target.columns.index(order_column)])
+            next_pages[key] = encode_cursor(
+                value.isoformat() if isinstance(value, datetime.datetime)
+                else value,
+                getattr(last, target.id_column))
+        if len(rows) > 0:
+            results[key] = [row._asdict() for row in rows]
+    if truncated:
+        results['truncated'] = truncated
+        results['next'] = next_pages
+    if timed_out:
+        app.logger.warning('search timed out for %s', timed_out)
+        results['timed_out'] = timed_out
     return results
 
 
@@ -490,7 +1001,7 @@ def thing_attrs():
     request_vars = flask.request.args
     app.logger.debug(request_vars)
     result = {}
-    with PgServer(ENVIRONMENT_PROPERTIES) as server:
+    with PgServer(ENVIRONMENT_PROPERTIES, pooled=True) as server:
         result['build'] = server.wanted_build_columns
         result['artifact'] = server.wanted_artifact_columns
         result['deploy'] = server.wanted_deploy_columns
@@ -507,7 +1018,7 @@ def specific_thing_attrs(thing_type):
     if thing_type not in ENUMS.PATH_THING_TYPES:
         abort(404)
 
-    with PgServer(ENVIRONMENT_PROPERTIES) as server:
+    with PgServer(ENVIRONMENT_PROPERTIES, pooled=True) as server:
         if thing_type == 'build':
             result = server.wanted_build_columns
         elif thing_type == 'artifact':
@@ -525,8 +1036,10 @@ def search_all():
     request_vars = flask.request.args
     app.logger.debug(request_vars)
     things_to_search = ['BUILDS', 'PROMOTES', 'DEPLOYS', 'ARTIFACTS']
+    options, request_vars = parse_search_options(request_vars,
+                                                 things_to_search)
     query_args = parse_api_args(request_vars)
-    search_results = search_with_attrs(query_args, things_to_search)
+    search_results = search_with_attrs(query_args, things_to_search, options)
     return to_json(search_results)
 
 
@@ -534,8 +1047,9 @@ def search_all():
 def search_builds():
     request_vars = flask.request.args
     app.logger.debug(request_vars)
+    options, request_vars = parse_search_options(request_vars, ['BUILDS'])
     query_args = parse_api_args(request_vars)
-    search_results = search_with_attrs(query_args, ['BUILDS'])
+    search_results = search_with_attrs(query_args, ['BUILDS'], options)
     return to_json(search_results)
 
 
@@ -543,8 +1057,9 @@ def search_builds():
 def search_artifacts():
     request_vars = flask.request.args
     app.logger.debug(request_vars)
+    options, request_vars = parse_search_options(request_vars, ['ARTIFACTS'])
     query_args = parse_api_args(request_vars)
-    search_results = search_with_attrs(query_args, ['ARTIFACTS'])
+    search_results = search_with_attrs(query_args, ['ARTIFACTS'], options)
     return to_json(search_results)
 
 
@@ -552,8 +1067,9 @@ def search_artifacts():
 def search_promotes():
     request_vars = flask.request.args
     app.logger.debug(request_vars)
+    options, request_vars = parse_search_options(request_vars, ['PROMOTES'])
     query_args = parse_api_args(request_vars)
-    search_results = search_with_attrs(query_args, ['PROMOTES'])
+    search_results = search_with_attrs(query_args, ['PROMOTES'], options)
     return to_json(search_results)
 
 
@@ -561,8 +1077,9 @@ def search_promotes():
 def search_deploys():
     request_vars = flask.request.args
     app.logger.debug(request_vars)
+    options, request_vars = parse_search_options(request_vars, ['DEPLOYS'])
     query_args = parse_api_args(request_vars)
-    search_results = search_with_attrs(query_args, ['DEPLOYS'])
+    search_results = search_with_attrs(query_args, ['DEPLOYS'], options)
     return to_json(search_results)
 
 
@@ -600,11 +1117,213 @@ def to_json(data, code=200):
     """
     Convert response to json; set mimetype, set code.
     """
-    response = flask.Response(json.dumps(data), code)
+    response = flask.Response(json.dumps(data, default=json_default), code)
     response.mimetype = 'text/json'
     return response
 
 
+def encode_cursor(value, row_id):
+    """
+    Opaque keyset pagination cursor for the row at (value, id); value
+    is the insertion_time, or whatever the rows are ordered by.
+    """
+    return base64.urlsafe_b64encode(
+        u'{0}|{1}'.format(value, row_id).encode('utf-8'))
+
+
+def decode_cursor(cursor):
+    try:
+        value, row_id = base64.urlsafe_b64decode(
+            str(cursor)).decode('utf-8').rsplit('|', 1)
+        return value, int(row_id)
+    except (TypeError, ValueError):
+        api.abort(400, 'malformed cursor')
+
+
+# an export's rows pass from the COPY to the response in chunks of
+# about this many bytes, at most this many chunks at a time.
+EXPORT_CHUNK_BYTES = 64 * 1024
+EXPORT_QUEUE_CHUNKS = 16
+
+# exports running at once, up to EXPORTCONNECTIONS; and seconds a
+# client turned away by them should wait.
+EXPORT_SLOTS = ConnectionSlots()
+EXPORT_RETRY_AFTER = 30
+
+
+class ExportCancelled(IOError):
+    """
+    Raised into an export's COPY once its client has gone away.
+    """
+    pass
+
+
+def export_chunks(settings, kind, fmt, since, until, filters, compress):
+    """
+    Starts PgServer.export on a connection of its own, not a pooled
+    one, with an EXPORTTIMEOUT statement timeout. Returns (chunks,
+    cancel): an iterator over its bytes, gzipped if `compress`, and a
+    function that stops it, for a client gone before reading it all.
+
+    The caller holds an EXPORT_SLOTS slot, which the export releases
+    when it ends. Raises ValueError, before any row is read, for
+    filters the database can't take (PgServer.check_export), and the
+    database's error if the export can't start at all.
+
+    copy_expert blocks, writing to a file, so it runs in a thread that
+    hands chunks over through a bounded queue: memory stays constant
+    and the COPY goes as fast as the client reads. An error part way
+    through cuts the body short, as streamed /all responses do.
+    """
+    chunks = Queue.Queue(maxsize=EXPORT_QUEUE_CHUNKS)
+    cancelled = threading.Event()
+    checked = object()
+    done = object()
+
+    def put(item):
+        while not cancelled.is_set():
+            try:
+                chunks.put(item, timeout=1)
+                return
+            except Queue.Full:
+                pass
+        raise ExportCancelled('export client went away')
+
+    class Writer(object):
+        def __init__(self):
+            self.parts = []
+            self.size = 0
+
+        def write(self, data):
+            self.parts.append(data)
+            self.size += len(data)
+            if self.size >= EXPORT_CHUNK_BYTES:
+                self.flush()
+
+        def flush(self):
+            if self.parts:
+                put(''.join(self.parts))
+                self.parts = []
+                self.size = 0
+
+    def copy():
+        try:
+            writer = Writer()
+            with PgServer(settings) as server:
+                server.set_statement_timeout(settings.export_timeout)
+                server.check_export(kind, since, until, filters)
+                put(checked)
+                server.export(kind, writer, fmt, since, until, filters)
+            writer.flush()
+            put(done)
+        except ExportCancelled:
+            pass
+        except Exception as ex:
+            if not isinstance(ex, ValueError):
+                app.logger.exception('export of %ss failed', kind)
+            try:
+                put(ex)
+            except ExportCancelled:
+                pass
+        finally:
+            EXPORT_SLOTS.release()
+
+    thread = threading.Thread(target=copy, name='export')
+    thread.daemon = True
+    thread.start()
+    first = chunks.get()
+    if first is not checked:
+        raise first
+
+    def generate():
+        # wbits 16 + MAX_WBITS: a gzip file, not a bare zlib stream.
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        try:
+            while True:
+                item = chunks.get()
+                if item is done:
+                    break
+                if isinstance(item, Exception):
+                    return
+                yield compressor.compress(item) if compress else item
+            if compress:
+                yield compressor.flush()
+        finally:
+            cancelled.set()
+
+    return generate(), cancelled.set
+
+
+def list_all(thing, time_key, id_key):
+    """
+    Shared GET for the /<thing>/all routes: everything, a keyset page
+    (?limit=&after=, next page in the Link header), or an NDJSON stream
+    (?stream=true). Whatever has no limit (everything, everything
+    after ?after=, the stream) comes off a server-side cursor in
+    constant memory. Rows skip marshal() and are encoded by the
+    thing's RowEncoder.
+    """
+    args = list_get_parser.parse_args()
+    app.logger.debug(args)
+    encoder = list_encoders[thing]
+    after = None
+    if args.get(ARGS.AFTER):
+        after = decode_cursor(args[ARGS.AFTER])
+
+    if args.get(ARGS.STREAM):
+        def generate():
+            with PgServer(ENVIRONMENT_PROPERTIES, pooled=True) as server:
+                for row in getattr(server, 'stream_all_' + thing)(
+                        raw=True, after=after):
+                    yield encoder.encode(row) + '\n'
+        return flask.Response(flask.stream_with_context(generate()),
+                              mimetype='application/x-ndjson')
+
+    limit = args.get(ARGS.LIMIT)
+    if not limit:
+        # everything (after the cursor, if any): the same JSON array,
+        # streamed off a server-side cursor rather than fetched whole.
+        def generate():
+            with PgServer(ENVIRONMENT_PROPERTIES, pooled=True) as server:
+                for chunk in encoder.encode_list(
+                        getattr(server, 'stream_all_' + thing)(
+                            raw=True, after=after)):
+                    yield chunk
+        return flask.Response(flask.stream_with_context(generate()),
+                              mimetype='application/json')
+
+    with PgServer(ENVIRONMENT_PROPERTIES, pooled=True) as server:
+        rows = getattr(server, 'get_all_' + thing)(limit, after, raw=True)
+
+    headers = {}
+    if len(rows) == limit:
+        last = rows[-1]
+        headers['Link'] = '<{0}?{1}>; rel="next"'.format(
+            flask.request.base_url,
+            urllib.urlencode({
+                ARGS.LIMIT: limit,
+                ARGS.AFTER: encode_cursor(
+                    last[encoder.index(time_key)].isoformat(),
+                    last[encoder.index(id_key)])}))
+    return flask.Response(encoder.encode_list(rows), 200, headers,
+                          mimetype='application/json')
+
+
+@app.errorhandler(PoolError)
+def pool_exhausted(error):
+    """
+    Every pooled database connection is busy; ask the client to retry.
+    """
+    app.logger.warn(error)
+    return to_json({'message': str(error)}, 503)
+
+
+@api.errorhandler(PoolError)
+def api_pool_exhausted(error):
+    app.logger.warn(error)
+    return {'message': str(error)}, 503
+
+
 @api.route("/build")
 class Build(Resource):
 
@@ -620,7 +1339,7 @@ class Build(Resource):
         result = None
         code = 200
 
-        with PgServer(ENVIRONMENT_PROPERTIES) as server:
+        with PgServer(ENVIRONMENT_PROPERTIES, pooled=True) as server:
             if args.get(ARGS.JOB_URL):
                 app.logger.debug(ARGS.JOB_URL)
                 result = server.get_build_by_url(args[ARGS.JOB_URL])
@@ -634,11 +1353,11 @@ class Build(Resource):
             else:
                 code = 409
                 result = []
-        result = [parse_times(x) for x in result]
         app.logger.debug(result)
         return result, code
 
     @api.doc(parser=build_post_parser)
+    @api.doc(responses=WRITE_BEHIND_RESPONSES)
     def post(self):
         """
         create a new build assertion
@@ -646,9 +1365,12 @@ class Build(Resource):
         args = build_post_parser.parse_args()
         args[ARGS.MISC] = json.loads(args[ARGS.MISC])
         app.logger.debug(args)
+        queued = write_behind('build', args)
+        if queued:
+            return queued
         result = None
         code = 200
-        with PgServer(ENVIRONMENT_PROPERTIES) as server:
+        with PgServer(ENVIRONMENT_PROPERTIES, pooled=True) as server:
             result = server.append_build(**args)
             app.logger.debug('created new build id: %d', result)
         return result, code
@@ -668,32 +1390,26 @@ class BuildRecord(Resource):
         app.logger.info("Getting id  %s", id)
         code = 200
         result = 'No data visible'
-        with PgServer(ENVIRONMENT_PROPERTIES) as server:
+        with PgServer(ENVIRONMENT_PROPERTIES, pooled=True) as server:
             result = server.get_build_by_build_id(id)
 
         if result == []:
             code = 404
 
-        result = [parse_times(x) for x in result]
-
         return result, code
 
 
 @api.route("/build/all")
 class BuildList(Resource):
 
-    @api.marshal_list_with(build, code=200)
+    @api.response(200, 'ok', [build])
+    @api.doc(parser=list_get_parser,
+             responses={400: 'malformed cursor'})
     def get(self):
         """
         list all build assertions
         """
-        result = None
-        code = 200
-        with PgServer(ENVIRONMENT_PROPERTIES) as server:
-            result = server.get_all_builds()
-        app.logger.debug(result)
-        result = [parse_times(x) for x in result]
-        return result, code
+        return list_all('builds', ARGS.INSERTION_TIME, ARGS.BUILD_ID)
 
 
 # artifact
@@ -712,7 +1428,7 @@ class Artifact(Resource):
         code = 200
         args = artifact_get_parser.parse_args()
         app.logger.debug(args)
-        with PgServer(ENVIRONMENT_PROPERTIES) as server:
+        with PgServer(ENVIRONMENT_PROPERTIES, pooled=True) as server:
             if args.get(ARGS.FILENAME):
                 result = server.get_artifact_by_filename(args[ARGS.FILENAME])
             elif args.get(ARGS.VERSION) and ARGS.VERSION_TYPE:
@@ -726,12 +1442,12 @@ class Artifact(Resource):
                     args[ARGS.ARTIFACT_ID])
             else:
                 code = 409
-        result = [parse_times(x) for x in result]
         app.logger.debug('fetched artifact: %s', result)
         return result, code
 
     @api.doc(parser=artifact_post_parser,
              responses={404: 'build id not found'})
+    @api.doc(responses=WRITE_BEHIND_RESPONSES)
     def post(self):
         """
         create a new artifact
@@ -741,8 +1457,11 @@ class Artifact(Resource):
         args = artifact_post_parser.parse_args()
         args[ARGS.MISC] = json.loads(args[ARGS.MISC])
         app.logger.debug(args)
+        queued = write_behind('artifact', args)
+        if queued:
+            return queued
         try:
-            with PgServer(ENVIRONMENT_PROPERTIES) as server:
+            with PgServer(ENVIRONMENT_PROPERTIES, pooled=True) as server:
                 result = server.append_artifact(**args)
         except IntegrityError as ex:
             app.logger.warn(ex)
@@ -766,31 +1485,24 @@ class ArtifactRecord(Resource):
         app.logger.info("Getting id  %s", id)
         code = 200
         result = []
-        with PgServer(ENVIRONMENT_PROPERTIES) as server:
+        with PgServer(ENVIRONMENT_PROPERTIES, pooled=True) as server:
             result = server.get_artifact_by_artifact_id(id)
         if result == []:
             code = 404
-        result = [parse_times(x) for x in result]
         return result, code
 
 
 @api.route("/artifact/all")
 class ArtifactList(Resource):
 
-    @api.marshal_list_with(artifact, code=200)
+    @api.response(200, 'ok', [artifact])
+    @api.doc(parser=list_get_parser,
+             responses={400: 'malformed cursor'})
     def get(self):
         """
         list all artifacts
         """
-        result = None
-        code = 200
-        args = flask.request.values
-        app.logger.debug(args)
-
-        with PgServer(ENVIRONMENT_PROPERTIES) as server:
-            result = server.get_all_artifacts()
-        result = [parse_times(x) for x in result]
-        return (result, code)
+        return list_all('artifacts', ARGS.INSERTION_TIME, ARGS.ARTIFACT_ID)
 
 # not yet implemented
 # @api.route("/artifact/history")
@@ -809,7 +1521,7 @@ class ArtifactList(Resource):
 #         # TODO - Implement this.
 #         if artifact_id:
 #             result = None
-#             with PgServer(ENVIRONMENT_PROPERTIES) as server:
+#             with PgServer(ENVIRONMENT_PROPERTIES, pooled=True) as server:
 #                 (result, code) = (
 #                     server.get_artifact_history(artifact_id), 501)
 #         else:
@@ -835,7 +1547,7 @@ class Promote(Resource):
         app.logger.debug(args)
         result = []
         code = 200
-        with PgServer(ENVIRONMENT_PROPERTIES) as server:
+        with PgServer(ENVIRONMENT_PROPERTIES, pooled=True) as server:
             if args.get(ARGS.THING_TYPE) and args.get(ARGS.THING_NAME):
                 result = server.get_promote_by_thing(args[ARGS.THING_TYPE],
                                                      args[ARGS.THING_NAME])
@@ -847,12 +1559,12 @@ class Promote(Resource):
                     args[ARGS.PROMOTE_ID])
             else:
                 code = 409
-        result = [parse_times(x) for x in result]
         app.logger.debug(result)
         return result, code
 
     @api.doc(parser=promote_post_parser,
              responses={404: 'thing id not found'})
+    @api.doc(responses=WRITE_BEHIND_RESPONSES)
     def post(self):
         """
         create a promotion assertion
@@ -860,10 +1572,13 @@ class Promote(Resource):
         args = promote_post_parser.parse_args()
         args[ARGS.MISC] = json.loads(args[ARGS.MISC])
         app.logger.debug(args)
+        queued = write_behind('promote', args)
+        if queued:
+            return queued
         code = 200
         result = None
         try:
-            with PgServer(ENVIRONMENT_PROPERTIES) as server:
+            with PgServer(ENVIRONMENT_PROPERTIES, pooled=True) as server:
                 result = server.append_promote(**args)
         except IntegrityError as ex:
             app.logger.warn(ex)
@@ -885,31 +1600,24 @@ class PromoteRecord(Resource):
         app.logger.info("Getting id  %s", id)
         code = 200
         result = 'No data visible'
-        with PgServer(ENVIRONMENT_PROPERTIES) as server:
+        with PgServer(ENVIRONMENT_PROPERTIES, pooled=True) as server:
             result = server.get_promote_by_promote_id(id)
         if result == []:
             code = 404
-        result = [parse_times(x) for x in result]
         return result, code
 
 
 @api.route("/promote/all")
 class PromoteList(Resource):
 
-    @api.marshal_list_with(promote, code=200)
+    @api.response(200, 'ok', [promote])
+    @api.doc(parser=list_get_parser,
+             responses={400: 'malformed cursor'})
     def get(self):
         """
         list all promotion assertions
         """
-        args = flask.request.values
-        app.logger.debug(args)
-        result = None
-        code = 200
-        with PgServer(ENVIRONMENT_PROPERTIES) as server:
-            result = server.get_all_promotes()
-        app.logger.debug(result)
-        result = [parse_times(x) for x in result]
-        return result, code
+        return list_all('promotes', ARGS.PROMOTE_TIME, ARGS.PROMOTE_ID)
 
 
 # deploy
@@ -930,7 +1638,7 @@ class Deploy(Resource):
         app.logger.debug(args)
         result = []
         code = 200
-        with PgServer(ENVIRONMENT_PROPERTIES) as server:
+        with PgServer(ENVIRONMENT_PROPERTIES, pooled=True) as server:
             if args.get(ARGS.DEPLOY_ID):
                 result = server.get_deploys_by_deploy_id(args[ARGS.DEPLOY_ID])
             elif args.get(ARGS.ENVIRONMENT):
@@ -946,12 +1654,12 @@ class Deploy(Resource):
                     args[ARGS.THING_NAME])
             else:
                 code = 409
-        result = [parse_times(x) for x in result]
         app.logger.debug(result)
         return result, code
 
     @api.doc(parser=deploy_post_parser,
              responses={200: 'created deployment'})
+    @api.doc(responses=WRITE_BEHIND_RESPONSES)
     def post(self):
         """
         create deployment assertion
@@ -960,9 +1668,12 @@ class Deploy(Resource):
         args[ARGS.MISC] = json.loads(args[ARGS.MISC])
 
         app.logger.info("POST DEPLOY ARGS %s",  args)
+        queued = write_behind('deploy', args)
+        if queued:
+            return queued
         code = 200
         result = None
-        with PgServer(ENVIRONMENT_PROPERTIES) as server:
+        with PgServer(ENVIRONMENT_PROPERTIES, pooled=True) as server:
             result = server.append_deploy(**args)
             app.logger.debug('successful deploy asserted: %d' % result)
         return result, code
@@ -984,60 +1695,318 @@ class DeployRecord(Resource):
         app.logger.info("Getting deploy id  %s", id)
         code = 200
         result = 'No data available'
-        with PgServer(ENVIRONMENT_PROPERTIES) as server:
+        with PgServer(ENVIRONMENT_PROPERTIES, pooled=True) as server:
             result = server.get_deploys_by_deploy_id(id)
             app.logger.debug('got deploy records: %s', result)
         if result == []:
             code = 404
-        result = [parse_times(x) for x in result]
         return result, code
 
 
 @api.route("/deploy/all")
 class DeployList(Resource):
 
-    @api.marshal_list_with(deploy, code=200)
-    @api.doc(responses={409: 'bad parameter type'})
+    @api.response(200, 'ok', [deploy])
+    @api.doc(parser=list_get_parser,
+             responses={400: 'malformed cursor'})
     def get(self):
         """
         list all deployment assertions
         """
-        args = flask.request.values
+        return list_all('deploys', ARGS.INSERTION_TIME, ARGS.DEPLOY_ID)
+
+
+def read_batch_lines():
+    """
+    The lines of the /batch request body, read one at a time: a body
+    with more than BATCH_MAX_LINES lines or BATCH_MAX_BYTES bytes is
+    refused (413) as soon as it passes either, not once it is in memory.
+    """
+    too_large = 'at most {0} assertions and {1} bytes per batch'.format(
+        BATCH_MAX_LINES, BATCH_MAX_BYTES)
+    if flask.request.content_length > BATCH_MAX_BYTES:
+        api.abort(413, too_large)
+    stream = flask.request.stream
+    lines = []
+    size = 0
+    while True:
+        line = stream.readline(BATCH_MAX_BYTES - size + 1)
+        if not line:
+            return lines
+        size += len(line)
+        if len(lines) == BATCH_MAX_LINES or size > BATCH_MAX_BYTES:
+            api.abort(413, too_large)
+        lines.append(line)
+
+
+@api.route("/batch", endpoint='batch')
+class Batch(Resource):
+
+    @api.doc(responses={200: 'per-line ids or errors, in input order',
+                        413: 'too many assertions, or bytes, in one batch'})
+    def post(self):
+        """
+        create many assertions from newline-delimited JSON
+
+        Each line is an object with a "type" of build, artifact,
+        promote or deploy, plus the fields of the matching POST.
+        """
+        lines = read_batch_lines()
+
+        result = []
+        assertions = []
+        for number, line in enumerate(lines, 1):
+            if not line.strip():
+                continue
+            entry = {'line': number}
+            try:
+                assertions.append((entry, parse_assertion(line)))
+            except (ValueError, TypeError) as ex:
+                entry['error'] = str(ex)
+            result.append(entry)
+
+        if assertions:
+            with PgServer(ENVIRONMENT_PROPERTIES, pooled=True) as server:
+                appended = server.append_batch([a for _, a in assertions])
+            for (entry, _), (row_id, error) in zip(assertions, appended):
+                if error:
+                    entry['error'] = error
+                else:
+                    entry['id'] = row_id
+        app.logger.debug('batch of %d assertions', len(assertions))
+        return result, 200
+
+
+@api.route("/export/<string:kind>")
+class Export(Resource):
+
+    @api.doc(parser=export_get_parser,
+             params={'kind': 'build, artifact, promote or deploy'},
+             responses={200: 'every matching row, as CSV or NDJSON',
+                        400: 'bad parameter, filter column or value',
+                        404: 'unknown kind',
+                        503: 'too many exports running; retry after '
+                             'Retry-After seconds'})
+    def get(self, kind):
+        """
+        stream every matching row, as CSV or NDJSON
+
+        Other query parameters are filters: a column of the kind (not
+        misc) and the value it must equal, e.g. ?environment=qa.
+        Rows come in no particular order; timestamps are UTC.
+        """
+        if kind not in PgServer.export_columns:
+            api.abort(404, 'kind must be one of: ' +
+                      ', '.join(sorted(PgServer.export_columns)))
+        args = export_get_parser.parse_args()
+        _, columns = PgServer.export_columns[kind]
+        filters = {}
+        for column, value in flask.request.args.iteritems():
+            if column in export_get_parser_names:
+                continue
+            if column not in columns or column == ARGS.MISC:
+                api.abort(400, 'cannot filter {0}s by {1}'.format(
+                    kind, column))
+            filters[column] = value
+        fmt = args[ARGS.FORMAT]
+        filename = '{0}s.{1}'.format(kind, fmt)
+        mimetype = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+        if args[ARGS.GZIP]:
+            filename += '.gz'
+            mimetype = 'application/gzip'
+        settings = load_settings(ENVIRONMENT_PROPERTIES)
+        if not EXPORT_SLOTS.acquire(settings.export_connections, 0):
+            message = '{0} exports already running'.format(
+                settings.export_connections)
+            app.logger.warn(message)
+            return ({'message': message}, 503,
+                    {'Retry-After': str(EXPORT_RETRY_AFTER)})
+        try:
+            chunks, cancel = export_chunks(
+                settings, kind, fmt, args[ARGS.SINCE], args[ARGS.UNTIL],
+                filters, args[ARGS.GZIP])
+        except ValueError as ex:
+            api.abort(400, str(ex))
+        response = flask.Response(
+            chunks, 200,
+            {'Content-Disposition': 'attachment; filename=' + filename},
+            mimetype=mimetype)
+        # the chunks are only read once the response is under way; a
+        # client gone before that must still stop the export.
+        response.call_on_close(cancel)
+        return response
+
+
+@api.route("/ingest/status")
+class IngestSummary(Resource):
+
+    @api.doc(responses={404: 'write-behind ingest is not enabled'})
+    def get(self):
+        """
+        state of the write-behind ingest queue
+
+        How many assertions wait to be written, the last sequence
+        number issued and whether writes to the database are failing.
+        """
+        queue = get_queue(ENVIRONMENT_PROPERTIES)
+        if queue is None:
+            api.abort(404, 'write-behind ingest is not enabled')
+        return queue.summary(), 200
+
+
+@api.route("/ingest/status/<int:seq>", endpoint='ingest_status')
+class IngestStatus(Resource):
+
+    @api.doc(responses={404: 'unknown or expired sequence number'})
+    def get(self, seq):
+        """
+        state of a write-behind assertion
+
+        "pending" until it is written; then "done" with the database
+        "id" of the new row, or "failed" with an "error".
+        """
+        queue = get_queue(ENVIRONMENT_PROPERTIES)
+        status = queue.status(seq) if queue is not None else None
+        if status is None:
+            api.abort(404, 'unknown or expired sequence number')
+        return status, 200
+
+
+@api.route("/stats/builds")
+class BuildStats(Resource):
+
+    @api.marshal_list_with(build_stats, code=200)
+    @api.doc(parser=stats_get_parser,
+             responses={400: 'bad parameter type'})
+    def get(self):
+        """
+        build counts and durations per result
+        """
+        args = stats_get_parser.parse_args()
         app.logger.debug(args)
-        result = None
-        code = 200
-        with PgServer(ENVIRONMENT_PROPERTIES) as server:
-            result = server.get_all_deploys()
-        result = [parse_times(x) for x in result]
-        return result, code
+        with PgServer(ENVIRONMENT_PROPERTIES, pooled=True) as server:
+            result = server.get_build_stats(args[ARGS.SINCE],
+                                            args[ARGS.UNTIL])
+        return result, 200
+
+
+@api.route("/stats/deploys")
+class DeployStats(Resource):
+
+    @api.marshal_list_with(deploy_stats, code=200)
+    @api.doc(parser=deploy_stats_get_parser,
+             responses={400: 'bad parameter type'})
+    def get(self):
+        """
+        deploy counts per environment and thing, most deployed first
+        """
+        args = deploy_stats_get_parser.parse_args()
+        app.logger.debug(args)
+        with PgServer(ENVIRONMENT_PROPERTIES, pooled=True) as server:
+            result = server.get_deploy_stats(args[ARGS.SINCE],
+                                             args[ARGS.UNTIL],
+                                             args[ARGS.TOP])
+        return result, 200
+
+
+@api.route("/stats/deploys/hourly")
+class DeployHourly(Resource):
+
+    @api.marshal_list_with(deploy_hourly, code=200)
+    @api.doc(parser=deploy_hourly_get_parser,
+             responses={400: 'bad parameter type'})
+    def get(self):
+        """
+        deploy counts per hour and environment, oldest hour first
+        """
+        args = deploy_hourly_get_parser.parse_args()
+        app.logger.debug(args)
+        with PgServer(ENVIRONMENT_PROPERTIES, pooled=True) as server:
+            result = server.get_deploy_hourly(args[ARGS.SINCE],
+                                              args[ARGS.UNTIL],
+                                              args[ARGS.ENVIRONMENT])
+        return result, 200
+
+
+@api.route("/stats/builds/hourly")
+class BuildHourly(Resource):
+
+    @api.marshal_list_with(build_hourly, code=200)
+    @api.doc(parser=stats_get_parser,
+             responses={400: 'bad parameter type'})
+    def get(self):
+        """
+        build counts and durations per hour and result, oldest hour first
+        """
+        args = stats_get_parser.parse_args()
+        app.logger.debug(args)
+        with PgServer(ENVIRONMENT_PROPERTIES, pooled=True) as server:
+            result = server.get_build_hourly(args[ARGS.SINCE],
+                                             args[ARGS.UNTIL])
+        return result, 200
+
+
+@api.route("/stats/promotes")
+class PromoteStats(Resource):
+
+    @api.marshal_list_with(promote_stats, code=200)
+    @api.doc(parser=stats_get_parser,
+             responses={400: 'bad parameter type'})
+    def get(self):
+        """
+        promote counts per environment
+        """
+        args = stats_get_parser.parse_args()
+        app.logger.debug(args)
+        with PgServer(ENVIRONMENT_PROPERTIES, pooled=True) as server:
+            result = server.get_promote_stats(args[ARGS.SINCE],
+                                              args[ARGS.UNTIL])
+        return result, 200
 
 
 # first-order queries:
 
-# not yet implemented
-# @api.route("/environment/current")
-# class Environment(Resource):
-#
-#     @api.doc(responses={409: 'bad parameter type'})
-#     def get(self):
-#         """
-#         list all recent artifact-ids in environment
-#         """
-#         args = flask.request.values
-#         app.logger.debug(args)
-#         response = None
-#         code = 200
-#         environment = args.get('environment')
-#         # TODO - Implement this.
-#         if environment:
-#             with PgServer(ENVIRONMENT_PROPERTIES) as server:
-#                 response = server.get_current_environment(environment)
-#                 code = 501
-#         else:
-#             response = "arguments incorrect"
-#             code = 409
-#
-#         return response, code
+@api.route("/environment/current")
+class EnvironmentCurrent(Resource):
+
+    @api.marshal_list_with(deploy, code=200)
+    @api.doc(parser=environment_current_parser,
+             responses={400: 'bad parameter type'})
+    def get(self):
+        """
+        list what is deployed in an environment right now
+
+        One deploy per thing and server: the latest one.
+        """
+        args = environment_current_parser.parse_args()
+        app.logger.debug(args)
+        with PgServer(ENVIRONMENT_PROPERTIES, pooled=True) as server:
+            result = server.get_current_environment(args[ARGS.ENVIRONMENT])
+        return result, 200
+
+
+@api.route("/lineage")
+class Lineage(Resource):
+
+    @api.doc(parser=lineage_get_parser,
+             responses={200: 'ok',
+                        400: 'bad parameter type',
+                        404: 'version not found'})
+    def get(self):
+        """
+        timeline of a version: its builds, artifacts and deploys
+
+        Artifacts built from the version's builds, and deploys of those
+        artifacts, are included. Each timeline entry is the usual
+        build, artifact or deploy plus its `type`, oldest first.
+        """
+        args = lineage_get_parser.parse_args()
+        app.logger.debug(args)
+        with PgServer(ENVIRONMENT_PROPERTIES, pooled=True) as server:
+            result = server.get_lineage(args[ARGS.VERSION])
+        if result is None:
+            api.abort(404, 'version not found')
+        return result, 200
 
 
 if __name__ == "__main__":